@@ -175,6 +175,49 @@ def read_raw_bytes(connection, number_of_all_channels, bytes_in_sample):
     return new_bytes
 
 
+#     Read a whole block of raw bytes from data logger: number_of_samples
+#     samples from each channel, waiting until the block is complete.
+def read_raw_block(connection, number_of_all_channels, bytes_in_sample, number_of_samples):
+    buffer_size = number_of_all_channels * bytes_in_sample * number_of_samples
+    block = bytearray(buffer_size)
+    view = memoryview(block)
+    received = 0
+    while received < buffer_size:
+        new_bytes = connection.recv_into(view[received:], buffer_size - received)
+        if new_bytes == 0:
+            raise Exception("Connection closed while reading a block")
+        received += new_bytes
+    return block
+
+
+# Convert a block of samples from bytes to a (channels, samples) array.
+# Same conversion as bytes_to_integers, done on the whole block at once.
+def bytes_to_array(
+        block,
+        number_of_channels,
+        bytes_in_sample,
+        output_milli_volts):
+    if bytes_in_sample == 2:
+        values = np.frombuffer(block, dtype='>i2').astype(np.int32)
+    elif bytes_in_sample == 3:
+        # Combine 3 bytes to a 24 bit integer value and make the two's complement
+        raw = np.frombuffer(block, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = (raw[:, 0] << 16) | (raw[:, 1] << 8) | raw[:, 2]
+        values = (values ^ 8388608) - 8388608
+    else:
+        raise Exception(
+            "Unknown bytes_in_sample value. Got: {}, "
+            "but expecting 2 or 3".format(bytes_in_sample))
+    values = values.reshape(-1, number_of_channels).T
+
+    # The last 8 channels (Auxiliary and Accessory-channels)
+    # are not to be converted to milli volts
+    if output_milli_volts:
+        values = values.astype(np.float64)
+        values[:number_of_channels - 8] *= CONVERSION_FACTOR
+    return values
+
+
 # Connect to Sessantaquattro+'s TCP socket and send start command
 def connect_to_sq(
         sq_socket,
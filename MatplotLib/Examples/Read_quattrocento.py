@@ -8,6 +8,7 @@ from PyQt5.QtWidgets import QApplication
 from pyqtgraph.Qt import QtCore
 
 import math
+from socket_tuning import SocketTuning
 
 def CRC8(Vector, Len):
     crc = 0
@@ -123,9 +124,11 @@ RampChan = NumChanVal[NCHsel] - 7
 BuffChan = NumChanVal[NCHsel] - 4
 TotSamp = 0
 
-# Open the TCP socket
-tcpSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+# Open the TCP socket, receive buffer and socket options from the data rate before connect() (socket_tuning.py)
+tuning = SocketTuning(NumChanVal[NCHsel], FsampVal[FSsel], 2)
+tcpSocket = tuning.apply(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
 tcpSocket.connect(('169.254.1.10', TCPPort))
+print('Socket tuning: {0}'.format(tuning.describe()))
 
 # Send the configuration to Quattrocento
 tcpSocket.sendall(bytearray(ConfString))
@@ -0,0 +1,211 @@
+#!python3
+# -------------------------------------------------------
+# Block based live plot shared by the Matplotlib examples
+#
+# A reader thread receives whole blocks of samples and writes them in a
+# single 2-D circular buffer holding HISTORY_TIME seconds of all channels,
+# while FuncAnimation redraws only the lines (blitting) on a fixed y-layout.
+# Memory stays flat however long the session is and the plot never blocks
+# the socket. Every block can also be appended to a spill file to keep the
+# whole session on disk, use load_history() to open it again.
+#
+import threading
+import time
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib import animation
+
+# Use ggplot style for more sophisticated visuals
+plt.style.use('ggplot')
+
+# SECONDS OF SIGNAL SHOWN FOR EACH TRACK
+PLOT_TIME = 1
+# SECONDS OF SIGNAL KEPT IN MEMORY (at least PLOT_TIME)
+HISTORY_TIME = 10
+# File where the whole session is appended, None to keep only HISTORY_TIME in memory
+SPILL_FILE = None
+# Samples are stored as little endian float32 (exact for 16 and 24 bit values)
+HISTORY_DTYPE = np.dtype('<f4')
+# NUMBER OF POINT TO DRAW FOR EACH TRACK
+arraysize = 500
+# Milliseconds between two frames
+UPDATE_INTERVAL = 50
+# Seconds of data read from the socket at once
+BLOCK_TIME = 1 / 32
+track_color = ['b', 'g', 'r', 'c', 'm', 'y', 'k']
+
+# DEFINE IF WE WANT TRACKS ON SAME PLOT OR IN DIFFERENT SUBPLOT.
+# Values accepted: 1, 0 or anything else
+# With blitting multiplot = 1 is usable with more channels, but every subplot
+# keeps the fixed Y_RANGE because axes are not redrawn
+MULTIPLOT = 0
+
+OFFSET_BETWEEN_CHANNELS = 25
+Y_RANGE = 1000
+
+
+class Track:
+    def __init__(self, soundtrack, index):
+        # The samples are stored in the soundtrack buffer, row 'index'
+        self.soundtrack = soundtrack
+        self.index = index
+        # Define other parameters of tracks...
+        self.color = 'g'
+        self.offset = 1
+
+    @property
+    def values(self):
+        return self.soundtrack.latest(self.soundtrack.samples)[self.index] - self.offset
+
+    def set_color(self, c):
+        self.color = c
+
+    def get_color(self):
+        return self.color
+
+    def set_offset(self, off):
+        self.offset = off
+
+    def get_offset(self):
+        return self.offset
+
+
+class SoundTrack:
+    def __init__(self, nChannel, sample_frequency, spill_file=SPILL_FILE):
+        print("soundtrack initialization with nChannel ", nChannel)
+        self.nch = nChannel
+        self.sample_frequency = sample_frequency
+        self.samples = int(PLOT_TIME * sample_frequency)
+        # Only every 'stride' sample is drawn, the buffer keeps all of them
+        self.stride = max(1, self.samples // arraysize)
+        self.draw_positions = np.arange(0, self.samples, self.stride)
+        self.lock = threading.Lock()
+        self.running = False
+        self.reader = None
+        self.animation = None
+
+        # One circular buffer for all the channels, allocated once
+        self.capacity = max(self.samples, int(HISTORY_TIME * sample_frequency))
+        self.buffer = np.zeros((nChannel, self.capacity), dtype=HISTORY_DTYPE)
+        self.write_index = 0
+        self.total_samples = 0
+        self.spill = open(spill_file, 'ab') if spill_file else None
+
+        self.tracks = []
+        for i in range(nChannel):
+            t = Track(self, i)
+            t.set_color(track_color[i % len(track_color)])
+            self.tracks.append(t)
+
+        x = np.linspace(0, PLOT_TIME, self.samples, endpoint=False)[::self.stride]
+        if MULTIPLOT == 1:
+            self.fig, self.lines, self.axs = init_multiplot(x, nChannel, self.tracks)
+        else:
+            for i in range(len(self.tracks)):
+                self.tracks[i].set_offset(OFFSET_BETWEEN_CHANNELS * i)
+            self.fig, self.lines, self.axs = init_multilines(x, nChannel, self.tracks)
+        self.offsets = np.array([t.get_offset() for t in self.tracks], dtype=HISTORY_DTYPE)[:, None]
+
+    def update(self, block):
+        # block is a (channels, samples) array
+        n = block.shape[1]
+        if n > self.capacity:
+            block = block[:, -self.capacity:]
+            n = self.capacity
+        with self.lock:
+            end = self.write_index + n
+            if end <= self.capacity:
+                self.buffer[:, self.write_index:end] = block
+            else:
+                first = self.capacity - self.write_index
+                self.buffer[:, self.write_index:] = block[:, :first]
+                self.buffer[:, :n - first] = block[:, first:]
+            self.write_index = end % self.capacity
+            self.total_samples += n
+        if self.spill is not None:
+            # Sample-major so the file can be reshaped to (samples, channels)
+            self.spill.write(np.ascontiguousarray(block.T, dtype=HISTORY_DTYPE).tobytes())
+
+    def latest(self, n, positions=None):
+        # Last n samples of every channel in time order (positions picks a subset of them)
+        if positions is None:
+            positions = np.arange(n)
+        with self.lock:
+            return self.buffer[:, (self.write_index - n + positions) % self.capacity]
+
+    def draw(self, frame):
+        values = self.latest(self.samples, self.draw_positions) - self.offsets
+        for i in range(self.nch):
+            self.lines[i].set_ydata(values[i])
+        return self.lines
+
+    def read_loop(self, read_block):
+        last_time = time.time()
+        blocks = 0
+        while self.running:
+            try:
+                self.update(read_block())
+            except Exception as e:
+                print(f"Error receiving data: {e}")
+                break
+            blocks += 1
+            if blocks % 100 == 0:
+                new_time = time.time()
+                print("{0:.2f} blocks/s".format(100. / (new_time - last_time)))
+                last_time = new_time
+        self.running = False
+
+    def run(self, read_block):
+        # read_block() returns the next (channels, samples) block, it runs in
+        # its own thread so slow frames never hold back the socket
+        self.running = True
+        self.reader = threading.Thread(target=self.read_loop, args=(read_block,), daemon=True)
+        self.reader.start()
+        self.animation = animation.FuncAnimation(
+            self.fig, self.draw, interval=UPDATE_INTERVAL, blit=True, cache_frame_data=False)
+        plt.show()
+        self.running = False
+        self.reader.join(timeout=1)
+        if self.spill is not None:
+            self.spill.close()
+
+    def get_tracks(self):
+        return self.tracks
+
+
+# Open a spill file written by SoundTrack as a (channels, samples) array without loading it
+def load_history(path, nChannel):
+    return np.memmap(path, dtype=HISTORY_DTYPE, mode='r').reshape(-1, nChannel).T
+
+
+# This function defines lines on different subplot
+def init_multiplot(x, nChannel, tracks):
+    lines = []
+    fig, axs = plt.subplots(nChannel, 1, figsize=(13, 6), squeeze=False)
+    axs = axs[:, 0]
+    fig.subplots_adjust(hspace=.5, wspace=.001)
+
+    for i in range(nChannel):
+        # Fixed limits: blitting only redraws the lines, not the axes
+        axs[i].set_xlim(0, PLOT_TIME)
+        axs[i].set_ylim(-Y_RANGE, Y_RANGE)
+        axs[i].set_ylabel(i + 1)
+        line, = axs[i].plot(x, np.zeros(len(x)), color=tracks[i].get_color(), alpha=0.8, animated=True)
+        lines.append(line)
+    return fig, lines, axs
+
+
+# This function define lines in same plot
+def init_multilines(x, nChannel, tracks):
+    lines = []
+    fig, axs = plt.subplots(figsize=(13, 6))
+    fig.subplots_adjust(hspace=.5, wspace=.001)
+
+    # Fixed layout: every channel has its own lane below the previous one
+    axs.set_xlim(0, PLOT_TIME)
+    axs.set_ylim(-OFFSET_BETWEEN_CHANNELS * nChannel - Y_RANGE, Y_RANGE)
+    for i in range(nChannel):
+        line, = axs.plot(x, np.zeros(len(x)) - tracks[i].get_offset(),
+                         color=tracks[i].get_color(), alpha=0.8, animated=True)
+        lines.append(line)
+    return fig, lines, axs
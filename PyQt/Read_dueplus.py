@@ -1,36 +1,76 @@
 import socket
 import sys
+import threading
 import time
 import signal
 from PyQt5 import QtWidgets, QtCore
 import pyqtgraph as pg
-import struct
 import numpy as np
+from socket_tuning import SocketTuning, drain
+import rendering
+from frame_pacing import FrameScheduler
+from replay import RawRecorder, ReplaySource, load_metadata, segment_path
+from stream_relay import StreamRelay
+from lsl_outlet import StreamInfo, StreamOutlet
+from shared_ring import SharedRing
+from channel_selection import ChannelSelection, GridPicker
+from channel_map import ChannelMap
+from sample_decoding import SampleDecoder
+from lod_view import MinMaxPyramid, SessionView, recording_source
+from imu import OrientationStream, OrientationView
+from events import EdgeDetector, EventLog
+from epochs import EpochAggregator, AveragedView
 
 
 # Configuration class
 class Config:
     DEFAULT_PLOT_TIME = 1      # seconds
+    HISTORY_TIME = 10          # seconds kept by every track, the longest plot time
     UPDATE_RATE = 16           # milliseconds (~60 FPS)
+    MAX_UPDATE_INTERVAL = 250  # milliseconds, slowest frame rate when drawing is over budget
+    DRAW_BUDGET = 0.75         # fraction of the frame interval drawing may use
     PLOT_HEIGHT = 600          # pixels
     WINDOW_SIZE = (1200, 800)  # width, height
+    RECV_SLACK = 0.5           # seconds of data the socket receive buffer can hold
+    READ_MODE = 'adaptive'     # 'latency', 'throughput' or 'adaptive'
+    BUSY_POLL_US = 0           # socket busy polling in microseconds (Linux only, 0 = off)
+    RENDER_MODE = 'fast'       # 'antialiased', 'fast', 'batched' or 'opengl' (see rendering.py)
+    RECORD_FILE = None         # path where the raw stream is recorded, None = no recording
+    REPLAY_FILE = None         # raw recording played back instead of the device, None = live
+    REPLAY_SPEED = 1.0         # 1.0 real time, N times faster, 0 as fast as possible
+    RELAY_ADDRESS = None       # ('127.0.0.1', port) or Unix socket path serving the stream, None = off
+    OUTLET_ADDRESS = None      # same for the time stamped chunks of lsl_outlet.py, None = off
+    SHARED_RING = None         # shared memory name the samples are published under, None = off
+    SHARED_RING_SECONDS = 10   # seconds of data kept in the shared ring
+    SESSION_VIEW = True        # keep a min/max pyramid of the whole session for the session view (lod_view.py)
+    RECONNECT = True           # wait for the probe to connect again when the link drops, False = stop receiving
+    STALL_TIMEOUT = 1.0        # seconds without data before the link is considered lost
+    IMU_RATE = 50              # Hz of the orientation computed from the Quaternions track (imu.py), 0 = off
+    TRIGGER_CHANNEL = None     # acquisition channel with the trigger (e.g. an AUX input), None = no events (events.py)
+    TRIGGER_THRESHOLD = 1000   # raw value between the low and the high trigger level
+    TRIGGER_EDGES = 'rising'   # 'rising', 'falling' or 'both'
+    EPOCH_TRACK = 0            # track averaged around the trigger events (epochs.py), None = off
+    EPOCH_WINDOW = (0.05, 0.1) # seconds before and after each event
 
 
 class Track:
-    def __init__(self, title, frequency, num_channels, offset, conv_fact, plot_time=1):
+    def __init__(self, title, frequency, num_channels, offset, conv_fact, plot_time=1, history_time=10,
+                 sample_dtype=np.int16, max_frequency=None, epoch_window=None):
         self.title = title
         self.frequency = frequency
         self.num_channels = num_channels
         self.offset = offset
         self.conv_fact = conv_fact
-        self.plot_time = plot_time
-        self.buffer = np.zeros((num_channels, int(plot_time * frequency)))
-        self.buffer_index = 0
-        self.time_array = np.linspace(0, self.plot_time, self.buffer.shape[1])
+        self.history_time = max(history_time, plot_time)
+        # History allocated once for the longest plot time at the highest rate of the device,
+        # every sample is written at i and i + capacity so the latest window is always contiguous
+        self.store = np.zeros((num_channels, 2 * int(self.history_time * max(frequency, max_frequency or 0))))
+        self.samples_received = 0
+        self.set_rate(frequency)
 
         # Create PlotWidget with enhanced interactive features
         self.plot_widget = pg.PlotWidget(title=self.title)
-        self.plot_widget.setXRange(0, plot_time)  # Set initial x-axis range
+        self.set_plot_time(plot_time)
         
         # Enable mouse interactions
         self.plot_widget.setMouseEnabled(x=True, y=True)  # Enable both x and y mouse interaction
@@ -44,15 +84,15 @@ class Track:
         
         self.plot_widget.setLabel('bottom', 'Time', units='s')
 
-        # Set background and enable antialiasing
+        # Set background, antialiasing depends on the render mode
         self.plot_widget.getViewBox().setBackgroundColor((30, 30, 30))
-        self.plot_widget.setAntialiasing(True)
         
         # Enable auto range button
         self.plot_widget.enableAutoRange()
         
         # Get colors for this track type
-        self.curves = []
+        pens = []
+        names = []
         for i in range(num_channels):
             if title == 'Quaternions':
                 # Use white for Quaternions
@@ -67,58 +107,213 @@ class Track:
                 # Use pyqtgraph's default color cycling for other tracks
                 pen = pg.mkPen(color=i, width=1)
 
-            curve_name = f"Ch {i+1}" if i < 8 or num_channels <= 8 else None
-            curve = self.plot_widget.plot(pen=pen, name=curve_name)
-            self.curves.append(curve)
+            pens.append(pen)
+            names.append(f"Ch {i+1}" if i < 8 or num_channels <= 8 else None)
+
+        self.pens = pens
+        self.names = names
+        self.channel_offsets = (self.offset * np.arange(num_channels))[:, None]
+
+        # Curves only exist for the selected channels
+        self.picker = None
+        self.session_view = None
+        self.orientation_view = None
+        self.average_view = None
+        self.epoch_window = epoch_window
+        self.epochs = EpochAggregator(num_channels, frequency, *epoch_window) if epoch_window else None
+        self.imu = OrientationStream(frequency, Config.IMU_RATE) if title == 'Quaternions' and Config.IMU_RATE else None
+        self.pyramid = MinMaxPyramid(num_channels, frequency, dtype=sample_dtype) if Config.SESSION_VIEW else None
+        self.selection = ChannelSelection(num_channels)
+        self.selection.changed.connect(self.rebuild_curves)
+        self.rebuild_curves()
+
+    def set_rate(self, frequency):
+        # The history is a view on the store, it is only reallocated for a higher rate than planned
+        self.frequency = frequency
+        self.capacity = int(self.history_time * frequency)
+        if 2 * self.capacity > self.store.shape[1]:
+            self.store = np.zeros((self.num_channels, 2 * self.capacity))
+        self.buffer = self.store[:, :2 * self.capacity]
+        self.buffer[:] = 0
+        self.buffer_index = 0
+
+    def resize(self, frequency, sample_dtype=np.int16):
+        # Same channels after a reconfiguration: new rate, history and session restart empty
+        self.set_rate(frequency)
+        if self.imu is not None:
+            self.imu.reset(frequency)
+        if self.epochs is not None:
+            # The history restarts empty: only the samples written from now on are averaged
+            self.epochs = EpochAggregator(self.num_channels, frequency, *self.epoch_window,
+                                          start=self.samples_received)
+            if self.average_view is not None:
+                self.average_view.aggregator = self.epochs
+        if self.pyramid is not None:
+            self.pyramid = MinMaxPyramid(self.num_channels, frequency, dtype=sample_dtype)
+            if self.session_view is not None:
+                self.session_view.pyramid = self.pyramid
+        self.set_plot_time(self.plot_time)
+        self.rebuild_curves()
+
+    def set_plot_time(self, plot_time):
+        # Only the drawn part of the history changes, nothing is reallocated or copied
+        self.plot_time = plot_time
+        self.window = min(int(plot_time * self.frequency), self.capacity)
+        self.time_array = np.linspace(0, plot_time, self.window)
+        self.plot_widget.setXRange(0, plot_time)
+
+    def rebuild_curves(self, indices=None):
+        indices = self.selection.indices
+        # Channels that are not fed any more restart from zero when selected again
+        self.buffer[np.setdiff1d(np.arange(self.num_channels), indices)] = 0
+        # The epochs are read from the history: the average restarts with the new channels
+        if self.epochs is not None:
+            self.epochs.request_reset()
+        self.plot_widget.clear()
+        self.curves = rendering.create_curves(self.plot_widget, [self.pens[i] for i in indices],
+                                              [self.names[i] for i in indices], Config.RENDER_MODE)
+        self.draw()
 
     def feed(self, packet):
+        # The session history keeps every channel, the plot only the selected ones
+        if self.pyramid is not None:
+            self.pyramid.append(packet)
+        if self.imu is not None:
+            self.imu.process(packet)
+        self.write_history(packet)
+        if self.epochs is not None:
+            self.collect_epochs()
+
+    def add_events(self, samples, stream_samples):
+        # Event samples count the stream, the history counts what was written to it (gaps included):
+        # both end with the block that was just fed
+        self.epochs.add_events(samples - stream_samples + self.samples_received)
+        self.collect_epochs()
+
+    def collect_epochs(self):
+        # The epochs are views of the history, read in the receiver thread that writes it
+        self.epochs.collect(self.buffer, self.buffer_index, self.capacity, self.samples_received)
+
+    def write_history(self, packet):
+        # Only the selected channels are converted and stored
+        rows = self.selection.indices
+        packet = packet[rows]
         packet_size = packet.shape[1]
-        # Use buffer management
-        if self.buffer_index + packet_size > self.buffer.shape[1]:
-            # Calculate exactly how much data fits at the end
-            end_space = self.buffer.shape[1] - self.buffer_index
-            if end_space > 0:
-                self.buffer[:, self.buffer_index:] = packet[:, :end_space]
-            self.buffer[:, :packet_size-end_space] = packet[:, end_space:]
-            self.buffer_index = packet_size - end_space
-        else:
-            self.buffer[:, self.buffer_index:self.buffer_index + packet_size] = packet
-            self.buffer_index = (self.buffer_index + packet_size) % self.buffer.shape[1]
+        self.samples_received += packet_size
+        start = self.buffer_index
+        if packet_size > self.capacity:
+            start = (start + packet_size - self.capacity) % self.capacity
+            packet = packet[:, -self.capacity:]
+            packet_size = self.capacity
+        # Written to both copies, the part that does not fit at the end goes at the start
+        first = min(packet_size, self.capacity - start)
+        for base in (start, start + self.capacity):
+            self.buffer[rows, base:base + first] = packet[:, :first]
+        if first < packet_size:
+            rest = packet_size - first
+            self.buffer[rows, :rest] = packet[:, first:]
+            self.buffer[rows, self.capacity:self.capacity + rest] = packet[:, first:]
+        # Moved after the samples are written, draw() reads it once
+        self.buffer_index = (start + packet_size) % self.capacity
+
+    def mark_gap(self, samples):
+        # Zeros keep the time axis going while the probe was away, the session view shades the gap
+        self.write_history(np.zeros((self.num_channels, min(samples, self.capacity)), dtype=np.int16))
+        if self.pyramid is not None:
+            self.pyramid.mark_gap(samples)
+        if self.imu is not None:
+            self.imu.reset()
 
     def draw(self):
-        for index, curve in enumerate(self.curves):
-            curve.setData(self.time_array, self.buffer[index, :] * self.conv_fact + (self.offset * index))
+        # Latest window in time order, the newest sample on the right
+        rows = self.selection.indices
+        end = self.buffer_index + self.capacity
+        window = self.buffer[rows, end - self.window:end]
+        self.curves.set_data(self.time_array, window * self.conv_fact + self.channel_offsets[rows])
 
 
 class DataReceiverThread(QtCore.QThread):
     data_received = QtCore.pyqtSignal(np.ndarray)
     status_update = QtCore.pyqtSignal(str)
+    reconfigured = QtCore.pyqtSignal()
+    events_detected = QtCore.pyqtSignal(np.ndarray)
 
-    def __init__(self, device, client_socket, tracks):
+    def __init__(self, device, client_socket, tracks, channel_map, recorder=None, relay=None, outlet=None,
+                 ring=None, triggers=None, event_log=None):
         super().__init__()
         self.device = device
         self.client_socket = client_socket
         self.tracks = tracks
+        self.channel_map = channel_map
+        self.recorder = recorder
+        self.relay = relay
+        self.outlet = outlet
+        self.ring = ring
+        self.triggers = triggers
+        self.event_log = event_log
+        self.pending_settings = None
+        self.resume = threading.Event()
+        self.last_data = time.perf_counter()
         self.running = True
         self.packet_count = 0
         self.last_time = time.time()
         self.fps = 0
 
     def run(self):
+        read_policy = self.device.tuning.read_policy
+        decoder = self.device.decoder
+        frame_size = decoder.frame_size
+        pending = b''
         while self.running:
             try:
-                data = self.client_socket.recv(self.device.nchannels * 2 * (self.device.frequency // 16))
+                if self.pending_settings is not None and self.reconfigure():
+                    read_policy = self.device.tuning.read_policy
+                    decoder = self.device.decoder
+                    frame_size = decoder.frame_size
+                    pending = b''
+                data = self.client_socket.recv(read_policy.next_read_size())
                 if not data:
                     print("No data received, connection may be closed")
+                    if self.recover():
+                        pending = b''
+                        continue
                     break
-
-                unpacked_data = struct.unpack(f'>{len(data) // 2}h', data)
-                reshaped_data = np.array(unpacked_data).reshape((-1, self.device.nchannels)).T
-
-                channel_index = 0
-                for track in self.tracks:
-                    track.feed(reshaped_data[channel_index:channel_index + track.num_channels, :])
-                    channel_index += track.num_channels
+                self.last_data = time.perf_counter()
+                read_policy.record(len(data))
+
+                # Keep partial frames for the next read so the channels stay aligned
+                data = pending + data
+                usable = len(data) - len(data) % frame_size
+                pending = data[usable:]
+                if usable == 0:
+                    continue
+                if self.recorder is not None:
+                    self.recorder.write(data[:usable])
+                if self.relay is not None:
+                    self.relay.publish(data[:usable])
+
+                # 16 bit samples are a view on the received bytes, 24 bit ones are decoded in one pass;
+                # each track converts only its selected channels
+                reshaped_data = decoder.decode(data[:usable])
+
+                # One gather for all the tracks, each one gets a view of its channels
+                routed, blocks = self.channel_map.route(reshaped_data)
+                for track, block in zip(self.tracks, blocks):
+                    track.feed(block)
+                if self.outlet is not None:
+                    self.outlet.push_chunk(routed)
+                if self.ring is not None:
+                    self.ring.write(routed)
+                if self.triggers is not None:
+                    events = self.triggers.process(reshaped_data)
+                    if len(events):
+                        if self.event_log is not None:
+                            self.event_log.write(events)
+                        # The tracks were fed this block: the samples of the events are in their history
+                        for track in self.tracks:
+                            if track.epochs is not None:
+                                track.add_events(events['sample'], self.triggers.samples)
+                        self.events_detected.emit(events)
 
                 self.data_received.emit(reshaped_data)
                 
@@ -129,15 +324,68 @@ class DataReceiverThread(QtCore.QThread):
                     elapsed = current_time - self.last_time
                     self.fps = 100 / elapsed if elapsed > 0 else 0
                     self.last_time = current_time
-                    self.status_update.emit(f"Data rate: {self.fps:.1f} packets/second")
+                    self.status_update.emit(f"Data rate: {self.fps:.1f} packets/second, read size: {read_policy.read_size} B")
                     
+            except OSError as e:
+                # Timeouts included: a probe out of range often stops sending without closing
+                print(f"Connection error: {e}")
+                if self.recover():
+                    pending = b''
+                    continue
+                break
             except Exception as e:
                 print(f"Error receiving data: {e}")
                 break
 
+    def recover(self):
+        """Wait for the probe to connect again, False for a replay, with RECONNECT off or when stopping"""
+        if not (Config.RECONNECT and self.running and self.device.server_socket is not None):
+            return False
+        self.status_update.emit("Connection lost, waiting for the probe")
+        while self.running:
+            try:
+                self.client_socket = self.device.reconnect()
+                break
+            except OSError:
+                # Accept timed out: check running again and keep listening
+                continue
+        if not self.running:
+            return False
+        # The tracks, the session and the recording carry on, the missing frames become a gap
+        seconds = time.perf_counter() - self.last_data
+        frames = int(seconds * self.device.frequency)
+        if self.recorder is not None:
+            self.recorder.mark_gap(frames)
+        for track in self.tracks:
+            track.mark_gap(frames)
+        self.last_data = time.perf_counter()
+        print(f"Probe reconnected, {seconds:.2f} s gap ({frames} frames)")
+        self.status_update.emit(f"Probe reconnected after {seconds:.2f} s")
+        return True
+
+    def request_reconfigure(self, settings):
+        # Applied by the receiver between two reads, nothing else touches the socket
+        self.pending_settings = settings
+
+    def reconfigure(self):
+        settings, self.pending_settings = self.pending_settings, None
+        start = time.perf_counter()
+        try:
+            dropped = self.device.reconfigure(**settings)
+        except ValueError as e:
+            print(f"Reconfiguration refused: {e}")
+            return False
+        # The GUI resizes the tracks and reopens the outputs before new frames are routed
+        self.resume.clear()
+        self.reconfigured.emit()
+        self.resume.wait()
+        print(f"Reconfigured in {time.perf_counter() - start:.3f} s ({dropped} B of the old stream dropped)")
+        return True
+
     def stop(self):
         print("Stopping data receiver thread")
         self.running = False
+        self.resume.set()
 
 
 class Soundtrack(QtWidgets.QWidget):
@@ -200,35 +448,159 @@ class Soundtrack(QtWidgets.QWidget):
         self.scroll_area.setWidget(self.scroll_widget)
         
         self.init_tracks()
+        self.channel_map = ChannelMap(self.track_info, self.device.nchannels)
+        print(f"Channel map: {self.channel_map.describe()}")
+
+        # Plot updates: only tracks with new data, slower when drawing is over budget
+        self.scheduler = FrameScheduler(self, self.scroll_area.viewport(), self.tracks, Config.UPDATE_RATE,
+                                        Config.MAX_UPDATE_INTERVAL, Config.DRAW_BUDGET)
+        self.scheduler.start()
+
+        # Every configuration of the device gets its own recording segment
+        self.segment = 0
+        self.open_outputs()
+
+        # Receiving data always comes before drawing it
+        self.receiver_thread = DataReceiverThread(self.device, self.client_socket, self.tracks, self.channel_map,
+                                                  self.recorder, self.relay, self.outlet, self.ring,
+                                                  self.triggers, self.event_log)
+        self.receiver_thread.status_update.connect(self.update_status)
+        self.receiver_thread.events_detected.connect(self.log_events)
+        self.receiver_thread.reconfigured.connect(self.apply_configuration)
+        self.receiver_thread.start(QtCore.QThread.HighestPriority)
+
+    def open_outputs(self):
+        stream = dict(device=type(self.device).__name__, nchannels=self.device.nchannels,
+                      frequency=self.device.frequency, bytes_in_sample=self.device.bytes_in_sample,
+                      byte_order='big', frame_size=self.device.decoder.frame_size)
+        self.recorder = None
+        if Config.RECORD_FILE:
+            path = segment_path(Config.RECORD_FILE, self.segment)
+            self.recorder = RawRecorder(path, **stream)
+            # Zooming into data older than the pyramid raw tail reads the recording
+            for index, track in enumerate(self.tracks):
+                if track.pyramid is not None:
+                    track.pyramid.raw_source = recording_source(path, self.device.nchannels,
+                                                                self.channel_map.channels(index),
+                                                                bytes_in_sample=self.device.bytes_in_sample)
+        self.relay = None
+        if Config.RELAY_ADDRESS:
+            self.relay = StreamRelay(Config.RELAY_ADDRESS, **stream)
+            self.relay.start()
+        info = StreamInfo.from_tracks(type(self.device).__name__, self.device.frequency, self.track_info)
+        self.outlet = None
+        if Config.OUTLET_ADDRESS:
+            self.outlet = StreamOutlet(info, Config.OUTLET_ADDRESS)
+            self.outlet.start()
+        self.ring = None
+        if Config.SHARED_RING:
+            self.ring = SharedRing(Config.SHARED_RING, info.channel_count, self.device.frequency,
+                                   Config.SHARED_RING_SECONDS, self.device.decoder.dtype, channels=info.channels,
+                                   device=info.name)
+            print(f"Samples published in shared memory {Config.SHARED_RING}")
+        # Trigger edges, indexed next to the recording
+        self.triggers = None
+        self.event_log = None
+        if Config.TRIGGER_CHANNEL is not None:
+            if Config.TRIGGER_CHANNEL < self.device.nchannels:
+                self.triggers = EdgeDetector(Config.TRIGGER_CHANNEL, self.device.frequency, Config.TRIGGER_THRESHOLD,
+                                             Config.TRIGGER_EDGES)
+                if self.recorder is not None:
+                    self.event_log = EventLog(self.recorder.path)
+            else:
+                print(f"Trigger channel {Config.TRIGGER_CHANNEL} is not one of the {self.device.nchannels} channels")
 
-        # Timer for plot updates
-        self.timer = QtCore.QTimer()
-        self.timer.timeout.connect(self.update_plot)
-        self.timer.start(Config.UPDATE_RATE)
+    def close_outputs(self):
+        for output in (self.recorder, self.relay, self.outlet, self.ring, self.event_log):
+            if output is not None:
+                output.close()
 
-        self.receiver_thread = DataReceiverThread(self.device, self.client_socket, self.tracks)
-        self.receiver_thread.status_update.connect(self.update_status)
-        self.receiver_thread.start()
+    def reconfigure(self, **settings):
+        """Change the acquisition settings on the open connection, see reconfigure() of the device"""
+        self.receiver_thread.request_reconfigure(settings)
+
+    def apply_configuration(self):
+        # GUI thread, the receiver waits until the new layout is in place
+        self.close_outputs()
+        if self.device.nchannels == self.channel_map.nchannels:
+            for track in self.tracks:
+                track.resize(self.device.frequency, self.device.decoder.dtype)
+        else:
+            # Another channel count means another track table
+            self.clear_tracks()
+            self.init_tracks()
+            self.scheduler.tracks = self.tracks
+        self.channel_map = ChannelMap(self.track_info, self.device.nchannels)
+        self.segment += 1
+        self.open_outputs()
+        receiver = self.receiver_thread
+        receiver.tracks, receiver.channel_map = self.tracks, self.channel_map
+        receiver.recorder, receiver.relay, receiver.outlet, receiver.ring = (self.recorder, self.relay,
+                                                                             self.outlet, self.ring)
+        receiver.triggers, receiver.event_log = self.triggers, self.event_log
+        self.scheduler.invalidate()
+        receiver.resume.set()
+        print(f"Configuration: {self.device.nchannels} channels at {self.device.frequency} Hz, "
+              f"{self.device.decoder.describe()}")
+
+    def clear_tracks(self):
+        for track in self.tracks:
+            for window in (track.picker, track.session_view, track.orientation_view, track.average_view):
+                if window is not None:
+                    window.close()
+        while self.scroll_layout.count():
+            item = self.scroll_layout.takeAt(0)
+            if item.widget() is not None:
+                item.widget().deleteLater()
+        self.tracks = []
 
     def init_tracks(self):
         track_info = [
             ('Bipolar 2 channels', 2, 0, 0.01, 0.000000249),
-            ('Quaternions', 4, 3, 1, 1),
-            ('Buffer', 1, 7, 1, 1),
-            ('Ramp', 1, 8, 1, 1),
+            ('Quaternions', 4, 2, 1, 1),
+            ('Buffer', 1, 6, 1, 1),
+            ('Ramp', 1, 7, 1, 1),
         ]
 
+        # Kept for the channel metadata of the outlet
+        self.track_info = track_info
         for title, n_channels, acq_channel, offset, conv_fact in track_info:
             # Create container widget for each track
             track_container = QtWidgets.QWidget()
             track_layout = QtWidgets.QVBoxLayout(track_container)
             
-            track = Track(title, self.device.frequency, n_channels, offset, conv_fact, self.plot_time)
+            # Averaged around the trigger events, when there are some
+            epoch_window = None
+            if Config.TRIGGER_CHANNEL is not None and Config.EPOCH_TRACK == len(self.tracks):
+                epoch_window = Config.EPOCH_WINDOW
+            track = Track(title, self.device.frequency, n_channels, offset, conv_fact, self.plot_time,
+                          Config.HISTORY_TIME, self.device.decoder.dtype, self.device.max_frequency,
+                          epoch_window)
             self.tracks.append(track)
             
             # Set minimum height for the plot widget
             track.plot_widget.setMinimumHeight(Config.PLOT_HEIGHT)
             
+            buttons_layout = QtWidgets.QHBoxLayout()
+            if n_channels > 1:
+                picker_button = QtWidgets.QPushButton("Channels...")
+                picker_button.clicked.connect(lambda checked, track=track: self.show_picker(track))
+                buttons_layout.addWidget(picker_button)
+            if track.pyramid is not None:
+                session_button = QtWidgets.QPushButton("Session...")
+                session_button.clicked.connect(lambda checked, track=track: self.show_session(track))
+                buttons_layout.addWidget(session_button)
+            if track.epochs is not None:
+                average_button = QtWidgets.QPushButton("Average...")
+                average_button.clicked.connect(lambda checked, track=track: self.show_average(track))
+                buttons_layout.addWidget(average_button)
+            if track.imu is not None:
+                orientation_button = QtWidgets.QPushButton("Orientation...")
+                orientation_button.clicked.connect(lambda checked, track=track: self.show_orientation(track))
+                buttons_layout.addWidget(orientation_button)
+            buttons_layout.addStretch()
+            track_layout.addLayout(buttons_layout)
+
             # Add plot widget to track container
             track_layout.addWidget(track.plot_widget)
             
@@ -238,6 +610,36 @@ class Soundtrack(QtWidgets.QWidget):
         # Add stretch at the end to prevent unwanted spacing
         self.scroll_layout.addStretch()
 
+    def show_picker(self, track):
+        # One picker window per track, kept so that it is not garbage collected
+        if track.picker is None:
+            track.picker = GridPicker(track.selection, f"{track.title}: channels")
+        track.picker.show()
+        track.picker.raise_()
+
+    def show_session(self, track):
+        # Whole session overview and zoomable detail, drawn from the pyramid of the track
+        if track.session_view is None:
+            track.session_view = SessionView(track.pyramid, f"{track.title}: session", track.conv_fact,
+                                             track.offset, track.selection)
+        track.session_view.show()
+        track.session_view.raise_()
+
+    def show_average(self, track):
+        # Running average of the track around the trigger events
+        if track.average_view is None:
+            track.average_view = AveragedView(track.epochs, f"{track.title}: average around events", track.conv_fact,
+                                              track.offset, track.selection)
+        track.average_view.show()
+        track.average_view.raise_()
+
+    def show_orientation(self, track):
+        # Probe orientation from the quaternions, refreshed at the display rate
+        if track.orientation_view is None:
+            track.orientation_view = OrientationView(track.imu, f"{track.title}: orientation", Config.UPDATE_RATE)
+        track.orientation_view.show()
+        track.orientation_view.raise_()
+
     def change_plot_time(self, time_str):
         # Convert string time to seconds
         if time_str.endswith('ms'):
@@ -247,60 +649,58 @@ class Soundtrack(QtWidgets.QWidget):
         
         print(f"Changing plot time to {new_time} seconds")
         
-        # Update plot time for all tracks
+        # The tracks keep their history, only the drawn window changes
+        self.plot_time = new_time
         for track in self.tracks:
-            # Create new buffer with new size
-            new_buffer = np.zeros((track.num_channels, int(new_time * track.frequency)))
-            
-            # Copy existing data if possible
-            if track.buffer_index > 0:
-                # Calculate how much data to copy
-                copy_size = min(new_buffer.shape[1], track.buffer.shape[1])
-                new_buffer[:, -copy_size:] = track.buffer[:, -copy_size:]
-            
-            # Update track properties
-            track.plot_time = new_time
-            track.buffer = new_buffer
-            track.buffer_index = min(track.buffer_index, new_buffer.shape[1])
-            track.time_array = np.linspace(0, track.plot_time, track.buffer.shape[1])
-            
-            # Update plot x-axis range
-            track.plot_widget.setXRange(0, new_time)
+            track.set_plot_time(new_time)
+        self.scheduler.invalidate()
 
     def toggle_pause(self, checked):
         self.is_paused = checked
         self.pause_button.setText("Resume" if checked else "Pause")
         if checked:
-            self.timer.stop()
+            self.scheduler.stop()
             print("Visualization paused")
         else:
-            self.timer.start(Config.UPDATE_RATE)
+            self.scheduler.start()
             print("Visualization resumed")
 
-    def update_status(self, message):
-        self.status_label.setText(message)
+    def log_events(self, events):
+        for event in events:
+            edge = 'rising' if event['edge'] > 0 else 'falling'
+            print(f"Trigger {edge} edge on channel {event['channel']} at {event['sample'] / self.device.frequency:.3f} s")
 
-    def update_plot(self):
-        if not self.is_paused:
-            for track in self.tracks:
-                track.draw()
+    def update_status(self, message):
+        if self.relay is not None:
+            message = f"{message}, {self.relay.describe()}"
+        self.status_label.setText(f"{message}, {self.scheduler.describe()}")
 
     def closeEvent(self, event):
         print("Closing application")
         self.receiver_thread.stop()
         self.receiver_thread.wait()
-        self.client_socket.close()
+        # The receiver holds the socket of the last connection
+        self.receiver_thread.client_socket.close()
+        self.close_outputs()
         event.accept()
 
 
 class Muovi:
-    def __init__(self, host="0.0.0.0", port=54321):
+    # Channels of a frame by mode, only mode 0 (2Ch Bipolar) is documented
+    CHANNELS_BY_MODE = [8]
+
+    def __init__(self, host="0.0.0.0", port=54321, mode=0):
         self.host = host
         self.port = port
-        self.nchannels = 8
+        self.mode = mode
+        self.nchannels = self.channels_for(mode)
         self.frequency = 2000
+        self.bytes_in_sample = 2
+        self.max_frequency = 2000
+        self.decoder = None
         self.server_socket = None
         self.client_socket = None
+        self.tuning = None
 
     def __enter__(self):
         return self
@@ -308,27 +708,91 @@ class Muovi:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.stop_server()
 
+    def make_tuning(self):
+        self.tuning = SocketTuning(self.nchannels, self.frequency, self.bytes_in_sample,
+                                   slack_seconds=Config.RECV_SLACK, busy_poll_us=Config.BUSY_POLL_US,
+                                   read_mode=Config.READ_MODE)
+        self.decoder = SampleDecoder(self.nchannels, self.bytes_in_sample)
+
     def start_server(self):
         try:
+            self.make_tuning()
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.tuning.apply(self.server_socket)
             self.server_socket.bind((self.host, self.port))
             self.server_socket.listen(1)
             print(f"Server listening on {self.host}:{self.port}")
 
             self.client_socket, addr = self.server_socket.accept()
             print(f"Connection accepted from {addr}")
+            self.tuning.apply(self.client_socket)
+            self.client_socket.settimeout(Config.STALL_TIMEOUT)
+            print(f"Socket tuning: {self.tuning.describe()}")
 
-            probe_en = 1
-            emg = 1
-            mode = 0
-            command = 0 + (emg * 8) + (mode * 2) + probe_en
-            self.client_socket.send(bytes([command]))
+            self.client_socket.send(bytes([self.command()]))
 
         except socket.error as e:
             print(f"Error creating server: {e}")
             sys.exit(1)
 
+    def reconnect(self, timeout=0.5):
+        """Accept the probe again on the listening socket and resend the last command
+
+        Raises socket.timeout when the probe has not connected within timeout.
+        """
+        self.server_socket.settimeout(timeout)
+        try:
+            client_socket, addr = self.server_socket.accept()
+        finally:
+            self.server_socket.settimeout(None)
+        print(f"Connection accepted from {addr}")
+        if self.client_socket is not None:
+            self.client_socket.close()
+        self.client_socket = client_socket
+        self.tuning.apply(self.client_socket)
+        self.client_socket.settimeout(Config.STALL_TIMEOUT)
+        self.client_socket.send(bytes([self.command()]))
+        return self.client_socket
+
+    def command(self, probe_en=1):
+        emg = 1  # EMG only
+        return 0 + (emg * 8) + (self.mode * 2) + probe_en
+
+    def channels_for(self, mode):
+        if mode not in range(len(self.CHANNELS_BY_MODE)):
+            raise ValueError(f"Unknown mode {mode}, expecting one of {list(range(len(self.CHANNELS_BY_MODE)))}")
+        return self.CHANNELS_BY_MODE[mode]
+
+    def reconfigure(self, mode=None):
+        """Stop the probe, drop the frames in flight and start it again with new settings
+
+        The connection stays open. Returns the number of bytes dropped.
+        """
+        if self.server_socket is None or self.client_socket is None:
+            raise ValueError("only a connected probe can be reconfigured")
+        nchannels = self.nchannels if mode is None else self.channels_for(mode)
+        self.client_socket.send(bytes([self.command(probe_en=0)]))
+        dropped = drain(self.client_socket)
+        if mode is not None:
+            self.mode = mode
+        self.nchannels = nchannels
+        self.make_tuning()
+        self.tuning.apply(self.client_socket)
+        self.client_socket.send(bytes([self.command()]))
+        return dropped
+
+    def start_replay(self, path, speed=1.0):
+        # Play back a raw recording through the same receiver instead of the probe
+        metadata = load_metadata(path)
+        self.nchannels = metadata.get('nchannels', self.nchannels)
+        self.frequency = metadata.get('frequency', self.frequency)
+        self.bytes_in_sample = metadata.get('bytes_in_sample', self.bytes_in_sample)
+        self.tuning = SocketTuning(self.nchannels, self.frequency, self.bytes_in_sample, read_mode=Config.READ_MODE)
+        self.decoder = SampleDecoder(self.nchannels, self.bytes_in_sample)
+        self.client_socket = ReplaySource(path, self.tuning.frame_size, self.frequency, speed)
+        print(f"Replaying {path} ({self.client_socket.duration():.1f} s) at speed {speed or 'max'}")
+
     def stop_server(self):
         if self.client_socket:
             self.client_socket.close()
@@ -350,12 +814,15 @@ if __name__ == "__main__":
     
     app = QtWidgets.QApplication([])
     
-    # Enable antialiasing for smoother plotting
-    pg.setConfigOptions(antialias=True)
+    # Global pyqtgraph options for the chosen render mode
+    Config.RENDER_MODE = rendering.configure(Config.RENDER_MODE)
     
     # Start server and accept connection using context manager
     with Muovi() as device:
-        device.start_server()
+        if Config.REPLAY_FILE:
+            device.start_replay(Config.REPLAY_FILE, Config.REPLAY_SPEED)
+        else:
+            device.start_server()
 
         # Create and show application window
         window = Soundtrack(device, device.client_socket)
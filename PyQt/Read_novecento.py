@@ -1,55 +1,33 @@
+import os
 import socket
 import numpy as np
 import pyqtgraph as pg
 from PyQt5 import QtCore, QtWidgets
 import math
 import threading
-
-
-def CRC8(Vector, Len):
-    crc = 0
-    j = 0
-
-    while Len > 0:
-        Extract = Vector[j]
-        for i in range(8, 0, -1):
-            Sum = crc % 2 ^ Extract % 2
-            crc //= 2
-
-            if Sum > 0:
-                a = format(crc, '08b')
-                b = format(140, '08b')
-                str_list = [0] * 8
-
-                for k in range(8):
-                    str_list[k] = int(a[k] != b[k])
-
-                crc = int(''.join(map(str, str_list)), 2)
-
-            Extract //= 2
-
-        Len -= 1
-        j += 1
-
-    return crc
+from socket_tuning import SocketTuning
+from replay import RawRecorder, ReplaySource, load_metadata
+from stream_relay import StreamRelay
+from shared_ring import SharedRing
+import render_shard
+import rendering
+from device_config import NovecentoConfig, NovecentoInput, crc8
+from resampling import MixedRateAligner
 
 
 # Configuration
 PlotTime = 1
 Update_time = 200
 offset = 2
+RenderMode = 'batched'  # 'antialiased', 'fast', 'batched' or 'opengl' (see rendering.py)
+RenderProcesses = 0     # > 0: inputs drawn by that many processes (see render_shard.py)
 
 IN_Active = [0] * 10
 Mode = [0] * 10
 Gain = [0] * 10
 HRES = [0] * 10
 HPF = [0] * 10
-Fsamp = [0] * 10
-NumChan = [0] * 10
-Ptr_IN = [0] * 11
-Size_IN = [0] * 11
-
-ChVsType = [0, 14, 22, 38, 46, 70, 102, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+Fsamp = [0] * 10  # Sampling frequency code: 500, 2000, 4000 or 8000 Hz (device_config.NOVECENTO_FSAMP)
 
 # Set configuration for each input
 IN_Active[0] = 1
@@ -122,82 +100,118 @@ HRES[9] = 0
 HPF[9] = 1
 Fsamp[9] = 0
 
-AuxFsamp = [0, 16, 32, 48]  # Codes to set the sampling frequency for AUX Channels
-FsampVal = [500, 2000, 4000, 8000]
-SizeAux = [16, 64, 128, 256]
-FSelAux = 0
+FSelAux = 0  # Sampling frequency code of the AUX channels, same values as Fsamp
 AnOutINSource = 2
 AnOutChan = 1
 AnOutGain = int('00100000', 2)
 
 TCPPort = 23456
+RecvSlack = 2 * PlotTime  # seconds of data the socket receive buffer can hold
+ReadMode = 'adaptive'     # 'latency', 'throughput' or 'adaptive'
+RecordFile = None         # path where the raw stream is recorded, None = no recording
+ReplayFile = None         # raw recording played back instead of the device, None = live
+ReplaySpeed = 1.0         # 1.0 real time, N times faster, 0 as fast as possible
+RelayAddress = None       # ('127.0.0.1', port) or Unix socket path serving the stream, None = off
+SharedRingName = None     # shared memory name the 500 Hz blocks are published under, None = off
+SharedRingSeconds = 10    # seconds of data kept in the shared ring
+CommonRate = None         # Hz every input is resampled to, plotted on a common time axis (resampling.py), None = off
 GainFactor = 0.0002861
 AuxGainFactor = 5 / 2 ** 16 / 0.5
 
-ConfString = [0] * 15
-ConfString[0] = int('10000000', 2) + AuxFsamp[FSelAux] + IN_Active[9] * 2 + IN_Active[8]
-ConfString[1] = 0
-for i in range(8):
-    ConfString[1] += IN_Active[i] * (2 ** i)
-ConfString[2] = AnOutGain + AnOutINSource
-ConfString[3] = AnOutChan
-for i in range(10):
-    ConfString[4 + i] = Mode[i] * 64 + Gain[i] * 16 + HPF[i] * 8 + HRES[i] * 4 + Fsamp[i]
-ConfString[14] = CRC8(ConfString, 14)
-
-# Open the TCP socket
-tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-tcp_socket.connect(('169.254.1.10', TCPPort))
-print('Connected to the Socket')
+# Settings checked once, the configuration strings and the frame layout come from them
+inputs = [NovecentoInput(IN_Active[i], Mode[i], Gain[i], HRES[i], HPF[i], Fsamp[i]) for i in range(10)]
+config = NovecentoConfig(inputs, FSelAux, AnOutINSource, AnOutChan, AnOutGain)
+ConfString = config.conf_string()
 
 def send_request(command):
-    cmd = [command, CRC8([command], 1)]
+    cmd = [command, crc8([command])]
     tcp_socket.sendall(bytearray(cmd))
     response = tcp_socket.recv(20)
     return response
 
-firmware_version = send_request(2)
-print('Firmware Version:', firmware_version[1:])
+if ReplayFile:
+    # The probes configuration was saved with the recording
+    settings = bytes(load_metadata(ReplayFile)['settings'])
+else:
+    # Open the TCP socket
+    tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    tcp_socket.connect(('169.254.1.10', TCPPort))
+    print('Connected to the Socket')
+
+    firmware_version = send_request(2)
+    print('Firmware Version:', firmware_version[1:])
+
+    battery_level = send_request(3)
+    print('Battery Level: {}%'.format(battery_level[1]))
+
+    settings = send_request(1)
+    if settings[19] == 0:
+        print('Error None')
+    elif settings[19] == 255:
+        print('Error CRC')
+print('Probes configuration:', settings[1:11])
 
-battery_level = send_request(3)
-print('Battery Level: {}%'.format(battery_level[1]))
+if not ReplayFile:
+    tcp_socket.sendall(bytearray(ConfString))
 
-settings = send_request(1)
-if settings[19] == 0:
-    print('Error None')
-elif settings[19] == 255:
-    print('Error CRC')
-print('Probes configuration:', settings[1:11])
+# Where each input is in a block, for the probes found on the inputs
+layout = config.layout(settings[1:11])
+print(f"Layout: {layout.describe()}")
+
+PacketSize1Block = layout.block_size
 
-tcp_socket.sendall(bytearray(ConfString))
-
-# Calculate the number of active channels
-NumActInputs = 0
-Ptr_IN[0] = 0
-for i in range(10):
-    NumChan[i] = ChVsType[settings[i + 1]]
-    if NumChan[i] == 0:
-        IN_Active[i] = 0
-    if IN_Active[i] == 1:
-        Size_IN[i] = (HRES[i] + 1) * FsampVal[Fsamp[i]] // 500 * NumChan[i]
-        NumActInputs = NumActInputs + 1
-    Ptr_IN[i + 1] = Ptr_IN[i] + Size_IN[i]
-
-PacketSize1Block = Ptr_IN[10] + SizeAux[FSelAux] + 128
+# Inputs at different rates put on one clock as the blocks arrive
+aligner = None
+if CommonRate:
+    aligner = MixedRateAligner(layout, CommonRate)
+    print(f"Aligner: {aligner.describe()}")
 blockData = PacketSize1Block * 500 * PlotTime * 2
 
-tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, blockData * 2)
+# One frame is a 500 Hz block of PacketSize1Block 16 bit words
+tuning = SocketTuning(PacketSize1Block, 500, slack_seconds=RecvSlack, read_mode=ReadMode)
+if ReplayFile:
+    tcp_socket = ReplaySource(ReplayFile, tuning.frame_size, 500, ReplaySpeed)
+    print(f"Replaying {ReplayFile} ({tcp_socket.duration():.1f} s) at speed {ReplaySpeed or 'max'}")
+else:
+    tuning.apply(tcp_socket)
+    print(f"Socket tuning: {tuning.describe()}")
+
+recorder = None
+if RecordFile:
+    recorder = RawRecorder(RecordFile, device='Novecento', frequency=500, bytes_in_sample=2,
+                           byte_order='little', frame_size=tuning.frame_size,
+                           settings=list(settings), conf_string=ConfString,
+                           accessory=layout.accessory_decoder.metadata())
+
+relay = None
+if RelayAddress:
+    relay = StreamRelay(RelayAddress, device='Novecento', nchannels=PacketSize1Block, frequency=500,
+                        bytes_in_sample=2, byte_order='little', frame_size=tuning.frame_size)
+    relay.start()
+
+ring = None
+if RenderProcesses and not SharedRingName:
+    # The render processes read the samples from the shared ring
+    SharedRingName = f"otb_novecento_{os.getpid()}"
+if SharedRingName:
+    # Rows are 500 Hz blocks, the layout tells readers where each input is inside a block
+    ring = SharedRing(SharedRingName, PacketSize1Block, 500, SharedRingSeconds, device='Novecento',
+                      **layout.ring_layout(GainFactor, AuxGainFactor))
+    print(f"Samples published in shared memory {SharedRingName}")
 
 # Initialize global Data variable
 Data = None
 Temp = None
+Aligned = None
+Accessory = None
 
 # PyQt Application
 app = QtWidgets.QApplication([])
+RenderMode = rendering.configure(RenderMode)
 
 # Create a main widget with a vertical layout
 main_widget = QtWidgets.QWidget()
-layout = QtWidgets.QVBoxLayout(main_widget)
+main_layout = QtWidgets.QVBoxLayout(main_widget)
 
 # Create a scroll area to make the plots scrollable
 scroll_area = QtWidgets.QScrollArea()
@@ -211,7 +225,7 @@ scroll_layout = QtWidgets.QVBoxLayout(scroll_widget)
 scroll_area.setWidget(scroll_widget)
 
 # Add the scroll area to the main layout
-layout.addWidget(scroll_area)
+main_layout.addWidget(scroll_area)
 
 # Increase the size of each plot by specifying the height
 PLOT_HEIGHT = 400  # Height for each plot
@@ -220,16 +234,17 @@ plots = []
 curves = []
 
 # Plot IN Channels
-for i in range(10):
-    if IN_Active[i] == 1:
-        plot_title = f"IN {i + 1} ({NumChan[i]} Chan)"
-        plot = pg.PlotWidget(title=plot_title)
-        plot.setFixedHeight(PLOT_HEIGHT)
-        plot.showGrid(x=True, y=True)
-        plots.append(plot)
-        num_channels = NumChan[i]
-        curves.append([plot.plot(pen=pg.intColor(j, num_channels)) for j in range(num_channels)])
-        scroll_layout.addWidget(plot)
+for slot in layout.inputs:
+    plot_title = f"IN {slot.index + 1} ({slot.channels} Chan)"
+    plot = pg.PlotWidget(title=plot_title)
+    plot.setFixedHeight(PLOT_HEIGHT)
+    plot.showGrid(x=True, y=True)
+    plots.append(plot)
+    # The last 6 channels of each input are not plotted
+    num_channels = slot.channels - 6
+    pens = [pg.mkPen(pg.intColor(j, num_channels)) for j in range(num_channels)]
+    curves.append(rendering.create_curves(plot, pens, mode=RenderMode))
+    scroll_layout.addWidget(plot)
 
 # Plot AUX Channels
 plot_title = "AUX Channels"
@@ -237,7 +252,7 @@ aux_plot = pg.PlotWidget(title=plot_title)
 aux_plot.setFixedHeight(PLOT_HEIGHT)
 aux_plot.showGrid(x=True, y=True)
 plots.append(aux_plot)
-curves.append([aux_plot.plot(pen=pg.intColor(j, 16)) for j in range(16)])
+curves.append(rendering.create_curves(aux_plot, [pg.mkPen(pg.intColor(j, 16)) for j in range(16)], mode=RenderMode))
 scroll_layout.addWidget(aux_plot)
 
 # Plot Accessory Channels
@@ -246,30 +261,47 @@ accessory_plot = pg.PlotWidget(title=plot_title)
 accessory_plot.setFixedHeight(PLOT_HEIGHT)
 accessory_plot.showGrid(x=True, y=True)
 plots.append(accessory_plot)
-curves.append([accessory_plot.plot(pen=pg.intColor(j, 8)) for j in range(8)])
+accessory_decoder = layout.accessory_decoder
+curves.append([accessory_plot.plot(pen=pg.intColor(j, accessory_decoder.channels), name=name)
+               for j, name in enumerate(accessory_decoder.names)])
 scroll_layout.addWidget(accessory_plot)
 
 # Set the main widget to be the window and show it
 main_widget.setWindowTitle('Real-time Plot')
 main_widget.resize(800, 600)  # Initial size of the window
-main_widget.show()
+if not RenderProcesses:
+    main_widget.show()
 
 terminate_thread = threading.Event()
 
 def receive_data():
-    global Data, Temp
-    tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, blockData * 2)
+    global Data, Temp, Aligned, Accessory
     buffer = b''
+    read_policy = tuning.read_policy
     while not terminate_thread.is_set():
         try:
-            chunk = tcp_socket.recv(blockData)
+            chunk = tcp_socket.recv(read_policy.next_read_size())
+            if not chunk:
+                print("No data received, connection may be closed")
+                break
+            read_policy.record(len(chunk))
+            if recorder is not None:
+                recorder.write(chunk)
             buffer += chunk
             while len(buffer) >= blockData:
                 packet = buffer[:blockData]
                 buffer = buffer[blockData:]
+                if relay is not None:
+                    relay.publish(packet)
                 Temp = np.frombuffer(packet, dtype='<i2')  # Little-endian
                 if len(Temp) == PacketSize1Block * 500:
                     Data = Temp.reshape(PacketSize1Block, 500, order='F')
+                    if ring is not None:
+                        ring.write_frames(Temp.reshape(500, PacketSize1Block))
+                    if aligner is not None:
+                        Aligned = aligner.process(Temp.reshape(500, PacketSize1Block))
+                    # int32 accessory channels read in place from the received bytes
+                    Accessory = layout.accessory_decoder.decode(packet)
                 else:
                     print(f"Unexpected packet size: {len(Temp)}")
         except (OSError, ValueError) as e:
@@ -280,36 +312,40 @@ def update_plot():
     global Data, Temp
     if Data is not None:
         current_plot = 0
-        Sig_IN = [None] * 10
-        for i in range(10):
-            if IN_Active[i] == 1:
-                Temp1 = Data[Ptr_IN[i]:Ptr_IN[i + 1], :].reshape(1, NumChan[i] * FsampVal[Fsamp[i]] * PlotTime, order='F')
-                Sig_IN[i] = Temp1.reshape(NumChan[i], FsampVal[Fsamp[i]] * PlotTime, order='F').astype(np.int32)
-
-                for ch in range(NumChan[i] - 6):
-                    if ch < len(curves[current_plot]):
-                        curves[current_plot][ch].setData(Sig_IN[i][ch, :] * GainFactor + offset * ch)
-                current_plot += 1
+        for i, slot in enumerate(layout.inputs):
+            if Aligned is not None:
+                # Resampled inputs share the time axis, in seconds
+                start, stop = aligner.bounds[i]
+                Sig_IN = Aligned[1][start:stop]
+                x = Aligned[0] + np.arange(Sig_IN.shape[1]) / CommonRate
+            else:
+                Temp1 = Data[slot.start:slot.stop, :].reshape(1, slot.channels * slot.frequency * PlotTime, order='F')
+                Sig_IN = Temp1.reshape(slot.channels, slot.frequency * PlotTime, order='F').astype(np.int32)
+                x = np.arange(Sig_IN.shape[1])
+
+            num_channels = slot.channels - 6
+            curves[current_plot].set_data(x, Sig_IN[:num_channels] * GainFactor + offset * np.arange(num_channels)[:, None])
+            current_plot += 1
 
         # AUX Channels
         if current_plot < len(plots):
-            Temp = Data[Ptr_IN[10]:-128, :].reshape(1, 16 * FsampVal[FSelAux] * PlotTime, order='F')
-            Sig_AUX = Temp.reshape(16, FsampVal[FSelAux] * PlotTime, order='F').astype(np.int32)
-
-            for ch in range(16):
-                if ch < len(curves[current_plot]):
-                    curves[current_plot][ch].setData(Sig_AUX[ch, :] * AuxGainFactor + offset * (15 - ch))
+            if Aligned is not None:
+                # Resampled with the inputs, last rows of the aligned block
+                start, stop = aligner.bounds[-1]
+                Sig_AUX = Aligned[1][start:stop]
+                x = Aligned[0] + np.arange(Sig_AUX.shape[1]) / CommonRate
+            else:
+                Temp = Data[layout.aux.start:layout.aux.stop, :].reshape(1, 16 * layout.aux.frequency * PlotTime, order='F')
+                Sig_AUX = Temp.reshape(16, layout.aux.frequency * PlotTime, order='F').astype(np.int32)
+                x = np.arange(Sig_AUX.shape[1])
+
+            curves[current_plot].set_data(x, Sig_AUX * AuxGainFactor + offset * np.arange(15, -1, -1)[:, None])
             current_plot += 1
 
         # Accessory Channels
-        if current_plot < len(plots):
-            Temp = Data[-128:, :].reshape(1, 8 * 8000 * PlotTime, order='F').astype(np.int16)
-            Temp1 = Temp.view(np.int32)
-            Sig_Accessory = Temp1.reshape(4, 8000 * PlotTime, order='F')
-
-            for ch in range(1):
-                if ch < len(curves[current_plot]):
-                    curves[current_plot][ch].setData(Sig_Accessory[ch, :])
+        if current_plot < len(plots) and Accessory is not None:
+            for ch, curve in enumerate(curves[current_plot]):
+                curve.setData(Accessory[ch])
 
 # Thread to receive data
 data_receiver_thread = threading.Thread(target=receive_data)
@@ -322,12 +358,24 @@ timer.start(Update_time)
 
 # Start application
 if __name__ == '__main__':
-    app.exec_()
+    if RenderProcesses:
+        # This process only receives, each render process draws a part of the inputs
+        render_shard.wait(render_shard.launch(SharedRingName, RenderProcesses, PlotTime, Update_time, RenderMode))
+    else:
+        app.exec_()
+
+# The receiver writes to the recorder, relay and ring: let it finish before they are closed
+terminate_thread.set()
+data_receiver_thread.join(timeout=1)
 
 # Stop data transfer
-ConfString[0] = int('00000000', 2)
-ConfString[14] = CRC8(ConfString, 14)
-tcp_socket.sendall(bytearray(ConfString))
+tcp_socket.sendall(bytearray(config.conf_string(go=False)))
 
 tcp_socket.close()
+if recorder is not None:
+    recorder.close()
+if relay is not None:
+    relay.close()
+if ring is not None:
+    ring.close()
 print('Socket closed')
\ No newline at end of file
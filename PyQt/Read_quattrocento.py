@@ -1,3 +1,4 @@
+import os
 import socket
 import numpy as np
 import time
@@ -7,23 +8,29 @@ import threading
 import pyqtgraph as pg
 from PyQt5.QtWidgets import QApplication
 from pyqtgraph.Qt import QtCore
+from socket_tuning import SocketTuning
+import rendering
+from replay import RawRecorder, ReplaySource, load_metadata
+from stream_relay import StreamRelay
+from lsl_outlet import StreamInfo, StreamOutlet
+from shared_ring import SharedRing
+import render_shard
+from channel_selection import ChannelSelection, GridPicker
+from device_config import QuattrocentoConfig
+from events import EdgeDetector, EventLog
 
 # Configuration
-PlotChan = list(range(0, 100))
+PlotChan = list(range(0, 100))  # channels shown at start, the others are picked in the channel grid
 PlotTime = 10 #seconds
 Update_time = 63 #milliseconds
 Decim = 64
+RenderMode = 'batched'  # 'antialiased', 'fast', 'batched' or 'opengl' (see rendering.py)
+RenderProcesses = 0     # > 0: channel groups drawn by that many processes (see render_shard.py)
 
 offset = 2
-Fsamp = [0, 8, 16, 24]
-
-# Sampling frequency values
-FsampVal = [512, 2048, 5120, 10240]
-FSsel = 1
-NumChan = [0, 2, 4, 6]  # Codes to set the number of channels
-# Channels numbers
-NumChanVal = [120, 216, 312, 408]
-NCHsel = 3
+
+FSsel = 1   # Sampling frequency code: 512, 2048, 5120 or 10240 Hz (device_config.QUATTROCENTO_FSAMP)
+NCHsel = 3  # Channels code: 120, 216, 312 or 408 channels (device_config.QUATTROCENTO_CHANNELS)
 AnOutSource = 9  # Source input for analog output
 AnOutChan = 0    # Channel for analog output
 AnOutGain = int('00000000', 2)
@@ -31,131 +38,136 @@ AnOutGain = int('00000000', 2)
 # Number of TCP socket port
 TCPPort = 23456
 
+# Socket tuning
+RecvSlack = 0.5         # seconds of data the socket receive buffer can hold
+ReadMode = 'adaptive'   # 'latency', 'throughput' or 'adaptive'
+
+# Recording and replay
+RecordFile = None       # path where the raw stream is recorded, None = no recording
+ReplayFile = None       # raw recording played back instead of the device, None = live
+ReplaySpeed = 1.0       # 1.0 real time, N times faster, 0 as fast as possible
+RelayAddress = None     # ('127.0.0.1', port) or Unix socket path serving the stream, None = off
+OutletAddress = None    # same for the time stamped chunks of lsl_outlet.py, None = off
+SharedRingName = None   # shared memory name the samples are published under, None = off
+SharedRingSeconds = 10  # seconds of data kept in the shared ring
+TriggerChannel = None   # channel with the trigger (e.g. one of the AUX IN), None = no events (events.py)
+TriggerThreshold = 1000 # raw value between the low and the high trigger level
+TriggerEdges = 'rising' # 'rising', 'falling' or 'both'
+
 GainFactor = 5 / 2**16 / 150 * 1000  # Provide amplitude in mV
 AuxGainFactor = 5 / 2**16 / 0.5      # Gain factor to convert Aux Channels in V
 
-def CRC8(Vector, Len):
-    crc = 0
-    j = 0
-
-    while Len > 0:
-        Extract = Vector[j]
-        for i in range(8, 0, -1):
-            Sum = crc % 2 ^ Extract % 2
-            crc //= 2
-
-            if Sum > 0:
-                str_list = [0] * 8
-                a = format(crc, '08b')
-                b = format(140, '08b')
-
-                for k in range(8):
-                    str_list[k] = int(a[k] != b[k])
-
-                crc = int(''.join(map(str, str_list)), 2)
-
-            Extract //= 2
-
-        Len -= 1
-        j += 1
-
-    return crc
-
-# Create the command to send to Quattrocento
-ConfString = [0] * 40
-ConfString[0] = int('10000000', 2) + Decim + Fsamp[FSsel] + NumChan[NCHsel] + 1
-ConfString[1] = AnOutGain + AnOutSource
-ConfString[2] = AnOutChan
-# -------- IN 1 --------
-ConfString[3] = 0
-ConfString[4] = 0
-ConfString[5] = int('00010100', 2)
-# -------- IN 2 --------
-ConfString[6] = 0
-ConfString[7] = 0
-ConfString[8] = int('00010100', 2)
-# -------- IN 3 --------
-ConfString[9] = 0
-ConfString[10] = 0
-ConfString[11] = int('00010100', 2)
-# -------- IN 4 --------
-ConfString[12] = 0
-ConfString[13] = 0
-ConfString[14] = int('00010100', 2)
-# -------- IN 5 --------
-ConfString[15] = 0
-ConfString[16] = 0
-ConfString[17] = int('00010100', 2)
-# -------- IN 6 --------
-ConfString[18] = 0
-ConfString[19] = 0
-ConfString[20] = int('00010100', 2)
-# -------- IN 7 --------
-ConfString[21] = 0
-ConfString[22] = 0
-ConfString[23] = int('00010100', 2)
-# -------- IN 8 --------
-ConfString[24] = 0
-ConfString[25] = 0
-ConfString[26] = int('00010100', 2)
-# -------- MULTIPLE IN 1 --------
-ConfString[27] = 0
-ConfString[28] = 0
-ConfString[29] = int('00010100', 2)
-# -------- MULTIPLE IN 2 --------
-ConfString[30] = 0
-ConfString[31] = 0
-ConfString[32] = int('00010100', 2)
-# -------- MULTIPLE IN 3 --------
-ConfString[33] = 0
-ConfString[34] = 0
-ConfString[35] = int('00010100', 2)
-# -------- MULTIPLE IN 4 --------
-ConfString[36] = 0
-ConfString[37] = 0
-ConfString[38] = int('00010100', 2)
-# ---------- CRC8 ----------
-ConfString[39] = CRC8(ConfString, 39)
-
-# Control channels
-RampChan = NumChanVal[NCHsel] - 7
-BuffChan = NumChanVal[NCHsel] - 4
-TotSamp = 0
-
-# Open the TCP socket
-tcpSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-tcpSocket.connect(('169.254.1.10', TCPPort))
+# Settings checked once, the configuration strings and the frame layout come from them
+config = QuattrocentoConfig(fsamp=FSsel, nch=NCHsel, decim=Decim, an_out_source=AnOutSource,
+                            an_out_chan=AnOutChan, an_out_gain=AnOutGain)
+layout = config.layout()
+NumChannels = layout.nchannels
+Frequency = layout.frequency
+ConfString = config.conf_string()
+print(f"Quattrocento: {layout.describe()}")
+
+# Open the TCP socket, the receive buffer is sized before connecting
+tuning = SocketTuning(NumChannels, Frequency, slack_seconds=RecvSlack, read_mode=ReadMode)
+if ReplayFile:
+    # The recording takes the place of the socket, configuration commands are ignored
+    tcpSocket = ReplaySource(ReplayFile, tuning.frame_size, Frequency, ReplaySpeed)
+    if load_metadata(ReplayFile).get('nchannels', NumChannels) != NumChannels:
+        print(f"Warning: {ReplayFile} was not recorded with {NumChannels} channels")
+    print(f"Replaying {ReplayFile} ({tcpSocket.duration():.1f} s) at speed {ReplaySpeed or 'max'}")
+else:
+    tcpSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    tuning.apply(tcpSocket)
+    tcpSocket.connect(('169.254.1.10', TCPPort))
+    print(f"Socket tuning: {tuning.describe()}")
+
+recorder = None
+if RecordFile:
+    recorder = RawRecorder(RecordFile, device='Quattrocento', nchannels=NumChannels,
+                           frequency=Frequency, bytes_in_sample=2, byte_order='little',
+                           frame_size=tuning.frame_size, conf_string=ConfString)
+
+relay = None
+if RelayAddress:
+    relay = StreamRelay(RelayAddress, device='Quattrocento', nchannels=NumChannels,
+                        frequency=Frequency, bytes_in_sample=2, byte_order='little',
+                        frame_size=tuning.frame_size)
+    relay.start()
+
+triggers = None
+event_log = None
+if TriggerChannel is not None:
+    triggers = EdgeDetector(TriggerChannel, Frequency, TriggerThreshold, TriggerEdges)
+    print(f"Events: {triggers.describe()}")
+    if recorder is not None:
+        event_log = EventLog(RecordFile)
+
+track_info = layout.track_info(GainFactor, AuxGainFactor)
+stream_info = StreamInfo.from_tracks('Quattrocento', Frequency, track_info)
+
+outlet = None
+if OutletAddress:
+    outlet = StreamOutlet(stream_info, OutletAddress)
+    outlet.start()
+
+ring = None
+if RenderProcesses and not SharedRingName:
+    # The render processes read the samples from the shared ring
+    SharedRingName = f"otb_quattrocento_{os.getpid()}"
+if SharedRingName:
+    # The inputs of the channel code tell render processes and readers where each one is
+    ring = SharedRing(SharedRingName, NumChannels, Frequency, SharedRingSeconds,
+                      channels=stream_info.channels, device='Quattrocento',
+                      **layout.ring_layout(GainFactor, AuxGainFactor))
+    print(f"Samples published in shared memory {SharedRingName}")
 
 # Send the configuration to Quattrocento
 tcpSocket.sendall(bytearray(ConfString))
 
-ConfString[0] = ConfString[0] + int('00100000', 2)  # Force the trigger to go high (bit 5)
-ConfString[39] = CRC8(ConfString, 39)  # Estimates the new CRC
 time.sleep(1)
-tcpSocket.sendall(bytearray(ConfString))
+tcpSocket.sendall(bytearray(config.conf_string(trigger=True)))  # Force the trigger to go high (bit 5)
 
 communication = True
 
 # Define a buffer to store 1 second of data
-buffer_length = int(FsampVal[FSsel] * PlotTime)
-data_buffer = np.zeros((buffer_length, NumChanVal[NCHsel]), dtype=np.int16)
+buffer_length = int(Frequency * PlotTime)
+data_buffer = np.zeros((buffer_length, NumChannels), dtype=np.int16)
 buffer_index = 0
 
 def receive_data():
     global buffer_index
     buffer = b''
-    expected_bytes = 2 * int((NumChanVal[NCHsel] * FsampVal[FSsel]) / 16)
+    read_policy = tuning.read_policy
 
     while communication:
         try:
-            while len(buffer) < expected_bytes:
-                buffer += tcpSocket.recv(expected_bytes - len(buffer))
-
-            data = buffer[:expected_bytes]
-            buffer = buffer[expected_bytes:]
-
-            new_data = np.frombuffer(data, dtype=np.int16).reshape(int(FsampVal[FSsel] / 16), NumChanVal[NCHsel])
+            chunk = tcpSocket.recv(read_policy.next_read_size())
+            if not chunk:
+                print("No data received, connection may be closed")
+                break
+            read_policy.record(len(chunk))
+            if recorder is not None:
+                recorder.write(chunk)
+
+            # Only decode whole frames, the remainder waits for the next read
+            buffer += chunk
+            usable = len(buffer) - len(buffer) % tuning.frame_size
+            if usable == 0:
+                continue
+            data = buffer[:usable]
+            buffer = buffer[usable:]
+            if relay is not None:
+                relay.publish(data)
+
+            new_data = np.frombuffer(data, dtype=np.int16).reshape(-1, NumChannels)
             data_length = new_data.shape[0]
+            if outlet is not None:
+                outlet.push_chunk(new_data.T)
+            if ring is not None:
+                ring.write_frames(new_data)
+            if triggers is not None:
+                events = triggers.process(new_data.T)
+                if len(events) and event_log is not None:
+                    event_log.write(events)
 
             if buffer_index + data_length > buffer_length:
                 end_index = buffer_length - buffer_index
@@ -174,32 +186,64 @@ def receive_data():
 data_receiver_thread = threading.Thread(target=receive_data)
 data_receiver_thread.start()
 
-# Plotting Widget
-pw = pg.plot(title="Real-time Plot")
-pw.showGrid(x=True, y=True)
-
-# Create only the curves for the defined channels in PlotChan
-curves = [pw.plot(pen=pg.intColor(i, len(PlotChan))) for i in PlotChan]
-
-def update_plot():
-    latest_data = np.roll(data_buffer, -buffer_index, axis=0)
-    for plot_index, channel_index in enumerate(PlotChan):
-        curves[plot_index].setData((latest_data[:, channel_index]) * GainFactor + offset * plot_index)
-
-# Start application
-timer = QtCore.QTimer()
-timer.timeout.connect(update_plot)
-timer.start(Update_time)  # Update every x milliseconds
-app = QApplication.instance() if QApplication.instance() else QApplication([])
-app.exec_()
+if RenderProcesses:
+    # This process only receives, each render process draws a part of the channel groups
+    shards = render_shard.launch(SharedRingName, RenderProcesses, PlotTime, Update_time, RenderMode)
+    render_shard.wait(shards)
+else:
+    # Plotting Widget
+    RenderMode = rendering.configure(RenderMode)
+    pw = pg.plot(title="Real-time Plot")
+    pw.showGrid(x=True, y=True)
+    sample_axis = np.arange(buffer_length)
+
+    # Curves only exist for the selected channels, PlotChan is the initial selection
+    selection = ChannelSelection(NumChannels, PlotChan)
+
+    def rebuild_curves(indices=None):
+        global curves, channel_offsets
+        indices = selection.indices
+        pw.clear()
+        pens = [pg.mkPen(pg.intColor(i, len(indices))) for i in indices]
+        curves = rendering.create_curves(pw, pens, mode=RenderMode)
+        channel_offsets = (offset * np.arange(len(indices)))[:, None]
+
+    rebuild_curves()
+    selection.changed.connect(rebuild_curves)
+    picker = GridPicker(selection, 'Quattrocento channels', columns=16)
+    picker.show()
+
+    def update_plot():
+        # Only the selected channels are put in time order and scaled
+        rows = selection.indices
+        index = buffer_index  # read once, the receiver thread moves it
+        latest_data = np.concatenate((data_buffer[index:, rows], data_buffer[:index, rows]))
+        curves.set_data(sample_axis, latest_data.T * GainFactor + channel_offsets)
+
+    # Start application
+    timer = QtCore.QTimer()
+    timer.timeout.connect(update_plot)
+    timer.start(Update_time)  # Update every x milliseconds
+    app = QApplication.instance() if QApplication.instance() else QApplication([])
+    app.exec_()
 
 # Stop data transfer
 communication = False
+# The receiver writes to the recorder, relay and ring: let it finish before they are closed
+data_receiver_thread.join(timeout=1)
 
 # Stop data transfer command
-ConfString[0] = int('10000000', 2)          # First byte that stops the data transfer
-ConfString[39] = CRC8(ConfString, 39)  # Estimates the new CRC
-tcpSocket.sendall(bytearray(ConfString))
+tcpSocket.sendall(bytearray(config.conf_string(go=False)))
 
 # Close the communication
 tcpSocket.close()
+if recorder is not None:
+    recorder.close()
+if relay is not None:
+    relay.close()
+if outlet is not None:
+    outlet.close()
+if ring is not None:
+    ring.close()
+if event_log is not None:
+    event_log.close()
@@ -0,0 +1,87 @@
+# -------------------------------------------------------
+# Configuration space benchmark of device_config.py
+#
+# Builds every Quattrocento configuration and a random sample of Novecento
+# ones (input settings and probe types), checks that the configuration
+# strings and the frame layouts are consistent and reports the time of a
+# first layout, a cached one and of the table and bitwise CRC8.
+#   python benchmark_config.py [novecento_samples]
+#
+import random
+import sys
+import time
+from device_config import (NovecentoConfig, NovecentoInput, QuattrocentoConfig, PROBE_CHANNELS, crc8,
+                           crc8_bitwise, clear_layouts)
+
+
+def check_novecento(config, probes, layout):
+    conf = config.conf_string()
+    assert len(conf) == 15 and crc8_bitwise(conf[:14]) == conf[14]
+    position = 0
+    for slot in layout.inputs:
+        settings = config.inputs[slot.index]
+        assert settings.active and PROBE_CHANNELS[probes[slot.index]]
+        assert slot.start == position and slot.stop - slot.start == (settings.hres + 1) * slot.ratio * slot.channels
+        position = slot.stop
+    assert layout.aux.start == position and layout.accessory.start == layout.aux.stop
+    assert layout.block_size == layout.accessory.stop
+
+
+def check_quattrocento(config, layout):
+    conf = config.conf_string()
+    assert len(conf) == 40 and crc8_bitwise(conf[:39]) == conf[39]
+    assert layout.frame_size == 2 * layout.nchannels and layout.accessory[1] == layout.nchannels
+    # IN 1-8 then MULTIPLE IN 1-4, back to back up to the AUX channels
+    position = 0
+    for _, _, start, stop in layout.inputs:
+        assert start == position
+        position = stop
+    assert position == layout.in_channels
+
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rng = random.Random(0)
+
+    quattrocento = [QuattrocentoConfig(fsamp, nch, decim) for fsamp in range(4) for nch in range(4)
+                    for decim in (False, True)]
+    for config in quattrocento:
+        check_quattrocento(config, config.layout())
+
+    novecento = []
+    for _ in range(samples):
+        inputs = [NovecentoInput(rng.randint(0, 1), rng.randrange(4), rng.randrange(4), rng.randint(0, 1),
+                                 rng.randint(0, 1), rng.randrange(4)) for _ in range(10)]
+        probes = [rng.randrange(len(PROBE_CHANNELS)) for _ in range(10)]
+        novecento.append((NovecentoConfig(inputs, rng.randrange(4)), probes))
+
+    clear_layouts()
+    start = time.perf_counter()
+    layouts = [config.layout(probes) for config, probes in novecento]
+    first = (time.perf_counter() - start) / samples * 1e6
+    start = time.perf_counter()
+    for config, probes in novecento:
+        config.layout(probes)
+    cached = (time.perf_counter() - start) / samples * 1e6
+    for (config, probes), layout in zip(novecento, layouts):
+        check_novecento(config, probes, layout)
+    largest = max(layouts, key=lambda layout: layout.block_size)
+
+    conf = novecento[0][0].conf_string()
+    print(f"Quattrocento: {len(quattrocento)} configurations checked")
+    print(f"Novecento: {samples} configurations checked, largest block {largest.block_size} words "
+          f"({largest.block_size * 2 * 500 / 1e6:.2f} MB/s)")
+    print(f"layout: first {first:.1f} us, cached {cached:.1f} us")
+    print(f"CRC8 of 14 bytes: table {timed(lambda: crc8(conf[:14]), 10000):.2f} us, "
+          f"bitwise {timed(lambda: crc8_bitwise(conf[:14]), 10000):.2f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# -------------------------------------------------------
+# Frame time benchmark of the render modes in rendering.py
+#
+# Draws 1 s of synthetic EMG at 2 kHz for 64, 128 and 408 channels in a
+# single plot (the worst case of a Quattrocento track) and reports the
+# time needed to update the curves and paint the widget, and the number
+# of curve items drawn. The channels get the pens of the viewers, one
+# pg.intColor(i, n) colour each.
+# Run it headless with QT_QPA_PLATFORM=offscreen.
+#
+import sys
+import time
+import numpy as np
+import pyqtgraph as pg
+from PyQt5 import QtWidgets
+import rendering
+
+CHANNELS = [64, 128, 408]
+FREQUENCY = 2000
+FRAMES = 30
+WINDOW_SIZE = (1200, 800)
+
+
+def bench(mode, num_channels):
+    widget = pg.PlotWidget()
+    widget.resize(*WINDOW_SIZE)
+    pens = [pg.mkPen(pg.intColor(i, num_channels)) for i in range(num_channels)]
+    curves = rendering.create_curves(widget, pens, mode=mode)
+    items = len(widget.listDataItems())
+
+    x = np.linspace(0, 1, FREQUENCY)
+    signal = np.random.randn(num_channels, FREQUENCY).cumsum(axis=1)
+    offsets = (10 * np.arange(num_channels))[:, None]
+
+    # First frame builds the layouts and the GL context, it is not timed
+    curves.set_data(x, signal + offsets)
+    widget.grab()
+
+    frame_times = []
+    for frame in range(FRAMES):
+        signal = np.roll(signal, 50, axis=1)
+        start = time.perf_counter()
+        curves.set_data(x, signal + offsets)
+        widget.grab()  # forces a synchronous repaint
+        frame_times.append(time.perf_counter() - start)
+    widget.close()
+    widget.deleteLater()
+    return np.median(frame_times) * 1000, np.max(frame_times) * 1000, items
+
+
+def main():
+    app = QtWidgets.QApplication(sys.argv)
+    modes = sys.argv[1:] or list(rendering.RENDER_MODES)
+    print(f"{'mode':<12}{'channels':>10}{'items':>8}{'median ms':>12}{'max ms':>10}")
+    for requested in modes:
+        mode = rendering.configure(requested)
+        if mode != requested:
+            print(f"{requested:<12}{'skipped, using ' + mode:>40}")
+            continue
+        for num_channels in CHANNELS:
+            median, worst, items = bench(mode, num_channels)
+            app.processEvents()
+            print(f"{mode:<12}{num_channels:>10}{items:>8}{median:>12.1f}{worst:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
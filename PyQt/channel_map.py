@@ -0,0 +1,57 @@
+# -------------------------------------------------------
+# Channel map: route the acquisition channels to the tracks
+#
+# The track tables of the viewers give, for every track, the first
+# acquisition channel it shows (acq_channel) and its number of channels.
+# ChannelMap compiles such a table once into a gather plan: one index
+# array with the acquisition channel of every track channel, track after
+# track. Each decoded block is then routed with a single gather, and the
+# tracks get views of the result, so gaps, overlapping tracks and any
+# order of the tracks cost the same as consecutive ones. When the tracks
+# cover the first channels in order the gather is a plain slice (no copy).
+#
+import numpy as np
+
+
+class ChannelMap:
+    def __init__(self, track_info, nchannels):
+        """track_info entries start with (title, n_channels, acq_channel), nchannels is the frame size"""
+        self.nchannels = nchannels
+        self.titles = []
+        self.bounds = []
+        index = []
+        for title, n_channels, acq_channel, *rest in track_info:
+            if acq_channel < 0 or acq_channel + n_channels > nchannels:
+                raise ValueError(f"Track {title}: channels {acq_channel}-{acq_channel + n_channels - 1} "
+                                 f"out of the {nchannels} acquisition channels")
+            self.titles.append(title)
+            self.bounds.append((len(index), len(index) + n_channels))
+            index.extend(range(acq_channel, acq_channel + n_channels))
+        self.index = np.array(index, dtype=np.intp)
+        self.count = len(self.index)
+
+        # Tracks reading channels 0..count-1 in order need no gather at all
+        self.contiguous = bool(np.array_equal(self.index, np.arange(self.count)))
+
+    def gather(self, block):
+        """(count, samples) block of the track channels, track after track, from a (nchannels, samples) block"""
+        if self.contiguous:
+            return block[:self.count]
+        return block[self.index]
+
+    def split(self, routed):
+        """Views of a gathered block, one per track"""
+        return [routed[start:stop] for start, stop in self.bounds]
+
+    def route(self, block):
+        routed = self.gather(block)
+        return routed, self.split(routed)
+
+    def channels(self, track):
+        """Acquisition channels of a track, by position in the table"""
+        start, stop = self.bounds[track]
+        return self.index[start:stop]
+
+    def describe(self):
+        plan = 'slice' if self.contiguous else 'gather'
+        return f"{len(self.bounds)} tracks, {self.count} of {self.nchannels} channels ({plan})"
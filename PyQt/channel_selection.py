@@ -0,0 +1,101 @@
+# -------------------------------------------------------
+# Channel selection model and grid picker
+#
+# A ChannelSelection holds the channels of a track that are watched as a
+# sorted index array. The viewers create curves only for those channels
+# and use the array to pick them out of each packet, so decoding, scaling
+# and drawing cost follows what is on screen instead of the channel count
+# of the device. GridPicker shows the channels as the electrode matrix
+# (one check button per electrode) to change the selection.
+#
+import math
+import numpy as np
+from PyQt5 import QtCore, QtWidgets
+
+
+def grid_shape(num_channels, columns=None):
+    """Rows and columns of the picker, 8 columns (a matrix row) by default"""
+    columns = columns or min(8, num_channels)
+    return math.ceil(num_channels / columns), columns
+
+
+class ChannelSelection(QtCore.QObject):
+    changed = QtCore.pyqtSignal(object)
+
+    def __init__(self, num_channels, selected=None):
+        super().__init__()
+        self.num_channels = num_channels
+        self.indices = np.arange(num_channels)
+        if selected is not None:
+            self.set(selected, notify=False)
+
+    def set(self, selected, notify=True):
+        indices = np.unique(np.asarray(list(selected), dtype=int))
+        if len(indices) and (indices[0] < 0 or indices[-1] >= self.num_channels):
+            raise ValueError(f"Channels must be between 0 and {self.num_channels - 1}")
+        # Replaced, never modified in place: the receiver thread may be using the old array
+        self.indices = indices
+        if notify:
+            self.changed.emit(indices)
+
+    def toggle(self, channel, on):
+        selected = set(self.indices.tolist())
+        if on:
+            selected.add(channel)
+        else:
+            selected.discard(channel)
+        self.set(selected)
+
+    def select_all(self):
+        self.set(range(self.num_channels))
+
+    def clear(self):
+        self.set([])
+
+    def is_selected(self, channel):
+        return channel in self.indices
+
+    def __len__(self):
+        return len(self.indices)
+
+
+class GridPicker(QtWidgets.QWidget):
+    """Electrode matrix of check buttons bound to a ChannelSelection"""
+
+    def __init__(self, selection, title='Channels', columns=None, parent=None):
+        super().__init__(parent)
+        self.selection = selection
+        self.setWindowTitle(title)
+        layout = QtWidgets.QVBoxLayout(self)
+
+        grid = QtWidgets.QGridLayout()
+        grid.setSpacing(2)
+        rows, columns = grid_shape(selection.num_channels, columns)
+        self.buttons = []
+        for channel in range(selection.num_channels):
+            button = QtWidgets.QPushButton(str(channel + 1))
+            button.setCheckable(True)
+            button.setFixedSize(36, 24)
+            button.toggled.connect(lambda on, channel=channel: self.selection.toggle(channel, on))
+            grid.addWidget(button, channel // columns, channel % columns)
+            self.buttons.append(button)
+        layout.addLayout(grid)
+
+        actions = QtWidgets.QHBoxLayout()
+        for text, slot in (('All', selection.select_all), ('None', selection.clear)):
+            button = QtWidgets.QPushButton(text)
+            button.clicked.connect(slot)
+            actions.addWidget(button)
+        actions.addStretch()
+        layout.addLayout(actions)
+
+        selection.changed.connect(self.refresh)
+        self.refresh(selection.indices)
+
+    def refresh(self, indices):
+        selected = set(np.asarray(indices).tolist())
+        for channel, button in enumerate(self.buttons):
+            # No toggled signal while the buttons follow the model
+            button.blockSignals(True)
+            button.setChecked(channel in selected)
+            button.blockSignals(False)
@@ -0,0 +1,254 @@
+# -------------------------------------------------------
+# Chunked, compressed, columnar export of recordings
+#
+# A store is a directory (Zarr-like layout):
+#   meta.json       shape (channels, samples), chunk shape, dtype, filters, codec
+#   c.<ci>.<ti>     one compressed chunk: channel group ci, time block ti
+#
+# Each chunk goes through the filters (delta along time, byte shuffle) and
+# is compressed with a codec from the standard library (zlib, bz2, lzma and
+# zstd on Python 3.14+), or goes straight to the EMG bit-packing codec of
+# emg_codec.py ('bitpack', which does its own delta). Compression runs in a thread pool (the codecs
+# release the GIL) or a process pool, so throughput scales with the cores.
+# Reading a subset of channels or samples only decompresses the chunks
+# that cover it.
+#
+# Convert a raw recording made with replay.RawRecorder:
+#   python chunked_export.py recording.bin recording.otbz [codec] [level]
+#
+import bz2
+import json
+import lzma
+import os
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import emg_codec
+from sample_decoding import samples_from_bytes
+from replay import load_metadata
+
+META_FILE = 'meta.json'
+
+CODECS = {
+    'none': (lambda data, level: data, lambda data: data),
+    'zlib': (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    'bz2': (lambda data, level: bz2.compress(data, max(1, level)), bz2.decompress),
+    'lzma': (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+try:
+    from compression import zstd  # Python 3.14+
+    CODECS['zstd'] = (lambda data, level: zstd.compress(data, level), zstd.decompress)
+except ImportError:
+    pass
+
+
+def register_codec(name, compress, decompress):
+    """Add a codec: compress(bytes, level) -> bytes, decompress(bytes) -> bytes"""
+    CODECS[name] = (compress, decompress)
+
+
+# Codecs working on the integer chunk itself instead of its bytes, the filters are not applied
+ARRAY_CODECS = {
+    'bitpack': (lambda chunk, level: emg_codec.encode_bytes(chunk), emg_codec.decode_bytes),
+}
+
+
+# ---- filters, applied to a (channels, samples) chunk ----
+def delta_encode(chunk):
+    # Integer arithmetic wraps around, so the round trip is exact
+    out = chunk.copy()
+    out[:, 1:] = np.diff(chunk, axis=1)
+    return out
+
+
+def delta_decode(chunk):
+    return np.cumsum(chunk, axis=1, dtype=chunk.dtype)
+
+
+def shuffle_bytes(data, itemsize):
+    # All the first bytes, then all the second bytes...: the high bytes of small deltas are zeros
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, itemsize).T.tobytes()
+
+
+def unshuffle_bytes(data, itemsize):
+    return np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1).T.tobytes()
+
+
+def encode_chunk(chunk, filters, codec, level):
+    """Filters and compression of one chunk, a top-level function so process pools can run it"""
+    if codec in ARRAY_CODECS:
+        return ARRAY_CODECS[codec][0](chunk, level)
+    if 'delta' in filters:
+        chunk = delta_encode(chunk)
+    data = np.ascontiguousarray(chunk).tobytes()
+    if 'shuffle' in filters:
+        data = shuffle_bytes(data, chunk.dtype.itemsize)
+    return CODECS[codec][0](data, level)
+
+
+def decode_chunk(data, shape, dtype, filters, codec):
+    if codec in ARRAY_CODECS:
+        return ARRAY_CODECS[codec][1](data).astype(dtype).reshape(shape)
+    data = CODECS[codec][1](data)
+    if 'shuffle' in filters:
+        data = unshuffle_bytes(data, dtype.itemsize)
+    chunk = np.frombuffer(data, dtype=dtype).reshape(shape)
+    if 'delta' in filters:
+        chunk = delta_decode(chunk)
+    return chunk
+
+
+def _write_chunk(path, chunk, filters, codec, level):
+    data = encode_chunk(chunk, filters, codec, level)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+
+def make_executor(kind, workers):
+    if kind == 'process':
+        return ProcessPoolExecutor(max_workers=workers)
+    return ThreadPoolExecutor(max_workers=workers)
+
+
+class ChunkedWriter:
+    """Append (channels, samples) blocks, chunks are compressed in the background"""
+
+    def __init__(self, path, nchannels, frequency, dtype='<i2', chunk_channels=8, chunk_samples=8192,
+                 codec='zlib', level=1, filters=('delta', 'shuffle'), executor='thread', workers=None,
+                 **attributes):
+        if codec not in CODECS and codec not in ARRAY_CODECS:
+            raise ValueError(f"Unknown codec {codec}, available: {sorted(CODECS) + sorted(ARRAY_CODECS)}")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.nchannels = nchannels
+        self.frequency = frequency
+        self.dtype = np.dtype(dtype)
+        self.chunk_channels = chunk_channels
+        self.chunk_samples = chunk_samples
+        self.codec = codec
+        self.level = level
+        self.filters = list(filters)
+        self.attributes = attributes
+
+        self.pending = np.empty((nchannels, chunk_samples), dtype=self.dtype)
+        self.pending_samples = 0
+        self.time_chunks = 0
+        self.futures = []
+        self.raw_bytes = 0
+        self.executor = make_executor(executor, workers or os.cpu_count())
+
+    def append(self, block):
+        block = np.asarray(block)
+        position = 0
+        while position < block.shape[1]:
+            n = min(self.chunk_samples - self.pending_samples, block.shape[1] - position)
+            self.pending[:, self.pending_samples:self.pending_samples + n] = block[:, position:position + n]
+            self.pending_samples += n
+            position += n
+            if self.pending_samples == self.chunk_samples:
+                self._submit()
+
+    def _submit(self):
+        if self.pending_samples == 0:
+            return
+        for ci, first in enumerate(range(0, self.nchannels, self.chunk_channels)):
+            chunk = self.pending[first:first + self.chunk_channels, :self.pending_samples].copy()
+            path = os.path.join(self.path, f"c.{ci}.{self.time_chunks}")
+            self.futures.append(self.executor.submit(_write_chunk, path, chunk, self.filters, self.codec, self.level))
+            self.raw_bytes += chunk.nbytes
+        self.time_chunks += 1
+        self.pending_samples = 0
+
+    def close(self):
+        """Flush the last partial chunk, wait for the workers and write the metadata"""
+        samples = (self.time_chunks * self.chunk_samples) + self.pending_samples
+        self._submit()
+        compressed = sum(future.result() for future in self.futures)
+        self.executor.shutdown()
+        meta = {
+            'shape': [self.nchannels, samples],
+            'chunks': [self.chunk_channels, self.chunk_samples],
+            'dtype': self.dtype.str,
+            'filters': self.filters,
+            'codec': self.codec,
+            'level': self.level,
+            'frequency': self.frequency,
+            'attributes': self.attributes,
+        }
+        with open(os.path.join(self.path, META_FILE), 'w') as f:
+            json.dump(meta, f, indent=2)
+        return self.raw_bytes / compressed if compressed else 0
+
+
+class ChunkedReader:
+    """Random access to a store, decompressing only the chunks needed"""
+
+    def __init__(self, path, workers=None):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.nchannels, self.samples = self.meta['shape']
+        self.chunk_channels, self.chunk_samples = self.meta['chunks']
+        self.dtype = np.dtype(self.meta['dtype'])
+        self.frequency = self.meta['frequency']
+        self.workers = workers or os.cpu_count()
+
+    def _load(self, ci, ti):
+        channels = min(self.chunk_channels, self.nchannels - ci * self.chunk_channels)
+        samples = min(self.chunk_samples, self.samples - ti * self.chunk_samples)
+        with open(os.path.join(self.path, f"c.{ci}.{ti}"), 'rb') as f:
+            data = f.read()
+        return decode_chunk(data, (channels, samples), self.dtype, self.meta['filters'], self.meta['codec'])
+
+    def read(self, channels=None, start=0, stop=None):
+        """(len(channels), stop - start) array, channels is a list of indices (None = all)"""
+        channels = np.arange(self.nchannels) if channels is None else np.asarray(channels)
+        stop = self.samples if stop is None else min(stop, self.samples)
+        groups = np.unique(channels // self.chunk_channels)
+        blocks = range(start // self.chunk_samples, (stop - 1) // self.chunk_samples + 1) if stop > start else []
+        wanted = [(ci, ti) for ci in groups for ti in blocks]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            chunks = dict(zip(wanted, pool.map(lambda key: self._load(*key), wanted)))
+
+        out = np.empty((len(channels), max(0, stop - start)), dtype=self.dtype)
+        for row, channel in enumerate(channels):
+            ci, offset = divmod(int(channel), self.chunk_channels)
+            for ti in blocks:
+                first = ti * self.chunk_samples
+                lo, hi = max(start, first), min(stop, first + self.chunk_samples)
+                out[row, lo - start:hi - start] = chunks[(ci, ti)][offset, lo - first:hi - first]
+        return out
+
+
+def export_recording(raw_path, store_path, codec='zlib', level=1, **options):
+    """Convert a raw recording (see replay.py) to a chunked store, returns the compression ratio"""
+    metadata = load_metadata(raw_path)
+    itemsize = metadata.get('bytes_in_sample', 2)
+    if itemsize == 3 and codec != 'bitpack':
+        raise ValueError("24 bit recordings can only be exported with the 'bitpack' codec")
+    nchannels = metadata['frame_size'] // itemsize
+    frame_size = nchannels * itemsize
+    raw = np.memmap(raw_path, dtype=np.uint8, mode='r')
+    frames = len(raw) // frame_size
+
+    writer = ChunkedWriter(store_path, nchannels, metadata['frequency'], dtype='<i2' if itemsize == 2 else '<i4',
+                           codec=codec, level=level, source=os.path.basename(raw_path), **options)
+    step = writer.chunk_samples
+    for first in range(0, frames, step):
+        block = raw[first * frame_size:min(frames, first + step) * frame_size]
+        # Stored little endian whatever the device byte order was
+        writer.append(samples_from_bytes(block, nchannels, itemsize, metadata.get('byte_order', 'big')))
+    return writer.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage: python chunked_export.py recording.bin store.otbz [codec] [level]")
+        sys.exit(1)
+    codec = sys.argv[3] if len(sys.argv) > 3 else 'zlib'
+    level = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+    ratio = export_recording(sys.argv[1], sys.argv[2], codec, level)
+    print(f"Exported {sys.argv[1]} to {sys.argv[2]} ({codec}, compression ratio {ratio:.2f})")
@@ -0,0 +1,323 @@
+# -------------------------------------------------------
+# Configuration strings and frame layouts of Novecento and Quattrocento
+#
+# NovecentoConfig and QuattrocentoConfig hold the settings of a session,
+# check them and build the configuration string (15 and 40 bytes, the
+# last one a CRC8) sent to the device. The frame layout that follows from
+# the settings (where each input is in a frame, how many words it takes,
+# its sampling frequency) is computed once per configuration and cached,
+# so the receive path only reads precomputed offsets.
+#
+# crc8 is the CRC of the devices (reflected, polynomial 0x8C) computed
+# with a 256 entry table instead of bit by bit.
+#
+import numpy as np
+
+
+def crc8_bitwise(data):
+    """Reference CRC8 of the devices, one bit at a time"""
+    crc = 0
+    for byte in data:
+        for _ in range(8):
+            feedback = (crc ^ byte) & 1
+            crc >>= 1
+            if feedback:
+                crc ^= 0x8C
+            byte >>= 1
+    return crc
+
+
+CRC8_TABLE = [crc8_bitwise([value]) for value in range(256)]
+
+
+def crc8(data):
+    crc = 0
+    for byte in data:
+        crc = CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def check_code(name, value, allowed):
+    if value not in allowed:
+        raise ValueError(f"{name} is {value}, expecting one of {list(allowed)}")
+
+
+# ---- Novecento ----
+
+NOVECENTO_FSAMP = [500, 2000, 4000, 8000]   # Hz of the input and AUX sampling codes
+NOVECENTO_AUX_WORDS = [16, 64, 128, 256]    # words of the 16 AUX channels in a 500 Hz block, by AUX code
+NOVECENTO_ACCESSORY_WORDS = 128
+NOVECENTO_ACCESSORY_CHANNELS = 4            # 32 bit channels in the accessory rows, 16 samples per block (8000 Hz)
+NOVECENTO_BLOCK_RATE = 500                  # frames (blocks) per second
+PROBE_CHANNELS = [0, 14, 22, 38, 46, 70, 102, 0, 0, 0, 0, 0, 0, 0, 0, 0]  # channels by probe type, 0 = none
+
+_layouts = {}
+
+
+def clear_layouts():
+    """Forget the cached layouts (benchmarks)"""
+    _layouts.clear()
+
+
+class NovecentoInput:
+    """Settings of one of the 10 Novecento inputs"""
+
+    def __init__(self, active=0, mode=0, gain=0, hres=0, hpf=1, fsamp=1):
+        check_code('active', active, (0, 1))
+        check_code('mode', mode, range(4))
+        check_code('gain', gain, range(4))
+        check_code('hres', hres, (0, 1))
+        check_code('hpf', hpf, (0, 1))
+        check_code('fsamp', fsamp, range(4))
+        self.active = active
+        self.mode = mode
+        self.gain = gain
+        self.hres = hres
+        self.hpf = hpf
+        self.fsamp = fsamp
+
+    def key(self):
+        return (self.active, self.mode, self.gain, self.hres, self.hpf, self.fsamp)
+
+    def code(self):
+        return self.mode * 64 + self.gain * 16 + self.hpf * 8 + self.hres * 4 + self.fsamp
+
+
+class Slot:
+    """Rows of a part of the frame: start:stop words, channels sampled at frequency"""
+
+    def __init__(self, start, stop, channels, frequency, index=None, words=1):
+        self.index = index
+        self.start = start
+        self.stop = stop
+        self.channels = channels
+        self.frequency = frequency
+        self.words = words  # 16 bit words per sample, 2 for high resolution inputs
+        # Samples of each channel in one 500 Hz block
+        self.ratio = frequency // NOVECENTO_BLOCK_RATE if frequency else 0
+
+    def samples(self, frames):
+        """(channels, samples) of a (blocks, block_size) array of frames, samples follow each other in a block"""
+        return frames[:, self.start:self.stop].reshape(-1, self.channels).T
+
+
+class AccessoryDecoder:
+    """int32 accessory channels of Novecento frames, read through a structured view of the frame bytes
+
+    Each sample is two little endian 16 bit words, low word first, so a
+    '<i4' field on the raw bytes is the value itself: nothing is converted.
+    """
+
+    def __init__(self, layout):
+        slot = layout.accessory
+        self.start = slot.start
+        self.stop = slot.stop
+        self.channels = slot.channels
+        self.frequency = slot.frequency
+        self.samples_per_block = slot.ratio
+        self.names = [f"Accessory {i + 1}" for i in range(slot.channels)]
+        self.frame_dtype = np.dtype({'names': ['accessory'], 'formats': [('<i4', (slot.ratio, slot.channels))],
+                                     'offsets': [2 * slot.start], 'itemsize': 2 * layout.block_size})
+
+    def blocks(self, raw):
+        """(blocks, samples per block, channels) view of whole frames of raw bytes, no copy"""
+        return np.frombuffer(raw, dtype=self.frame_dtype)['accessory']
+
+    def decode(self, raw):
+        """(channels, samples) int32 array of whole frames, the blocks one after the other"""
+        return self.blocks(raw).reshape(-1, self.channels).T
+
+    def metadata(self):
+        return {'start': self.start, 'stop': self.stop, 'channels': self.channels, 'frequency': self.frequency,
+                'dtype': '<i4', 'names': self.names}
+
+
+class NovecentoLayout:
+    def __init__(self, inputs, aux, accessory):
+        self.inputs = inputs
+        self.aux = aux
+        self.accessory = accessory
+        self.block_size = accessory.stop  # 16 bit words in one frame
+        self.accessory_decoder = AccessoryDecoder(self)
+
+    def ring_layout(self, scale, aux_scale):
+        """Layout keywords of the shared ring of the viewer"""
+        return dict(
+            # The last 6 channels of an input are not EMG
+            inputs=[{'input': slot.index, 'name': f"IN {slot.index + 1}", 'start': slot.start, 'stop': slot.stop,
+                     'channels': slot.channels, 'plot_channels': slot.channels - 6, 'frequency': slot.frequency,
+                     'scale': scale} for slot in self.inputs],
+            aux={'start': self.aux.start, 'stop': self.aux.stop, 'channels': self.aux.channels,
+                 'frequency': self.aux.frequency, 'scale': aux_scale},
+            accessory=self.accessory_decoder.metadata())
+
+    def describe(self):
+        inputs = ', '.join(f"IN {slot.index + 1} {slot.channels} ch {slot.frequency} Hz" for slot in self.inputs)
+        return f"{inputs or 'no input'}, {self.block_size} words per block"
+
+
+class NovecentoConfig:
+    def __init__(self, inputs, aux_fsamp=0, an_out_source=2, an_out_chan=1, an_out_gain=0b00100000):
+        if len(inputs) != 10:
+            raise ValueError(f"Novecento has 10 inputs, {len(inputs)} given")
+        check_code('aux_fsamp', aux_fsamp, range(4))
+        check_code('an_out_source', an_out_source, range(16))
+        check_code('an_out_chan', an_out_chan, range(256))
+        check_code('an_out_gain', an_out_gain, (0, 0b00010000, 0b00100000, 0b00110000))
+        self.inputs = list(inputs)
+        self.aux_fsamp = aux_fsamp
+        self.an_out_source = an_out_source
+        self.an_out_chan = an_out_chan
+        self.an_out_gain = an_out_gain
+
+    def key(self):
+        return (tuple(i.key() for i in self.inputs), self.aux_fsamp, self.an_out_source, self.an_out_chan,
+                self.an_out_gain)
+
+    def conf_string(self, go=True):
+        """15 configuration bytes, the last one the CRC8; go=False stops the data transfer"""
+        conf = [0] * 15
+        if go:
+            conf[0] = 0b10000000 + self.aux_fsamp * 16 + self.inputs[9].active * 2 + self.inputs[8].active
+        conf[1] = sum(self.inputs[i].active << i for i in range(8))
+        conf[2] = self.an_out_gain + self.an_out_source
+        conf[3] = self.an_out_chan
+        for i, settings in enumerate(self.inputs):
+            conf[4 + i] = settings.code()
+        conf[14] = crc8(conf[:14])
+        return conf
+
+    def layout(self, probe_types):
+        """Frame layout with the probes found on the inputs (bytes 1-10 of the settings reply)"""
+        probe_types = tuple(probe_types)
+        if len(probe_types) != 10:
+            raise ValueError(f"expecting the probe type of the 10 inputs, {len(probe_types)} given")
+        key = (self.key(), probe_types)
+        if key not in _layouts:
+            _layouts[key] = self.build_layout(probe_types)
+        return _layouts[key]
+
+    def build_layout(self, probe_types):
+        slots = []
+        start = 0
+        for index, (settings, probe) in enumerate(zip(self.inputs, probe_types)):
+            if probe >= len(PROBE_CHANNELS):
+                raise ValueError(f"IN {index + 1}: unknown probe type {probe}")
+            channels = PROBE_CHANNELS[probe]
+            # Inputs without a probe send nothing, whatever their setting
+            if not settings.active or channels == 0:
+                continue
+            frequency = NOVECENTO_FSAMP[settings.fsamp]
+            size = (settings.hres + 1) * frequency // NOVECENTO_BLOCK_RATE * channels
+            slots.append(Slot(start, start + size, channels, frequency, index, settings.hres + 1))
+            start += size
+        aux_stop = start + NOVECENTO_AUX_WORDS[self.aux_fsamp]
+        aux = Slot(start, aux_stop, 16, NOVECENTO_FSAMP[self.aux_fsamp])
+        accessory = Slot(aux_stop, aux_stop + NOVECENTO_ACCESSORY_WORDS, NOVECENTO_ACCESSORY_CHANNELS,
+                         NOVECENTO_ACCESSORY_WORDS // 2 // NOVECENTO_ACCESSORY_CHANNELS * NOVECENTO_BLOCK_RATE,
+                         words=2)
+        return NovecentoLayout(slots, aux, accessory)
+
+
+# ---- Quattrocento ----
+
+QUATTROCENTO_FSAMP = [512, 2048, 5120, 10240]  # Hz by sampling code
+QUATTROCENTO_CHANNELS = [120, 216, 312, 408]   # channels in a frame by channel code
+QUATTROCENTO_INPUTS = 12                       # IN 1-8 and MULTIPLE IN 1-4
+QUATTROCENTO_IN_CHANNELS = 16                  # channels of each of IN 1-8
+QUATTROCENTO_MULTIPLE_CHANNELS = 64            # channels of each of MULTIPLE IN 1-4
+QUATTROCENTO_INPUT_DEFAULT = (0, 0, 0b00010100)
+
+
+class QuattrocentoLayout:
+    def __init__(self, nchannels, frequency):
+        self.nchannels = nchannels
+        self.frequency = frequency
+        self.frame_size = 2 * nchannels
+        # 16 AUX IN and 8 accessory channels follow the IN channels
+        self.in_channels = nchannels - 24
+        self.aux = (nchannels - 24, nchannels - 8)
+        self.accessory = (nchannels - 8, nchannels)
+        self.ramp_channel = nchannels - 7
+        self.buffer_channel = nchannels - 4
+        # Channel code c sends IN 1 to 2(c + 1), then MULTIPLE IN 1 to c + 1
+        count = self.in_channels // (2 * QUATTROCENTO_IN_CHANNELS + QUATTROCENTO_MULTIPLE_CHANNELS)
+        self.inputs = []  # (index in the configuration string, name, first channel, stop)
+        start = 0
+        for i in range(2 * count):
+            self.inputs.append((i, f"IN {i + 1}", start, start + QUATTROCENTO_IN_CHANNELS))
+            start += QUATTROCENTO_IN_CHANNELS
+        for i in range(count):
+            self.inputs.append((8 + i, f"MULTIPLE IN {i + 1}", start, start + QUATTROCENTO_MULTIPLE_CHANNELS))
+            start += QUATTROCENTO_MULTIPLE_CHANNELS
+
+    def track_info(self, gain, aux_gain):
+        """(title, channels, first channel, offset, scale) of the IN, AUX IN and accessory channels"""
+        return [('IN', self.in_channels, 0, 1, gain),
+                ('AUX IN', 16, self.aux[0], 1, aux_gain),
+                ('Accessory', 8, self.accessory[0], 1, 1)]
+
+    def ring_layout(self, gain, aux_gain):
+        """Layout keywords of the shared ring of the viewer, one entry per input"""
+        return dict(
+            inputs=[{'input': index, 'name': name, 'start': start, 'stop': stop, 'channels': stop - start,
+                     'plot_channels': stop - start, 'frequency': self.frequency, 'scale': gain}
+                    for index, name, start, stop in self.inputs],
+            aux={'name': 'AUX IN', 'start': self.aux[0], 'stop': self.aux[1], 'channels': 16,
+                 'frequency': self.frequency, 'scale': aux_gain},
+            accessory={'name': 'Accessory', 'start': self.accessory[0], 'stop': self.accessory[1], 'channels': 8,
+                       'frequency': self.frequency, 'scale': 1})
+
+    def describe(self):
+        inputs = ', '.join(name for _, name, _, _ in self.inputs)
+        return f"{self.nchannels} channels at {self.frequency} Hz ({inputs}), {self.frame_size} B frames"
+
+
+class QuattrocentoConfig:
+    def __init__(self, fsamp=1, nch=3, decim=True, an_out_source=9, an_out_chan=0, an_out_gain=0, inputs=None):
+        """inputs are 12 (byte 1, byte 2, byte 3) settings of IN 1-8 and MULTIPLE IN 1-4"""
+        check_code('fsamp', fsamp, range(4))
+        check_code('nch', nch, range(4))
+        check_code('an_out_source', an_out_source, range(16))
+        check_code('an_out_chan', an_out_chan, range(256))
+        check_code('an_out_gain', an_out_gain, (0, 0b00010000, 0b00100000, 0b00110000))
+        inputs = [QUATTROCENTO_INPUT_DEFAULT] * QUATTROCENTO_INPUTS if inputs is None else inputs
+        if len(inputs) != QUATTROCENTO_INPUTS:
+            raise ValueError(f"Quattrocento has {QUATTROCENTO_INPUTS} inputs, {len(inputs)} given")
+        for index, settings in enumerate(inputs):
+            if len(settings) != 3 or any(not 0 <= value < 256 for value in settings):
+                raise ValueError(f"input {index + 1}: expecting 3 byte values, got {settings}")
+        self.fsamp = fsamp
+        self.nch = nch
+        self.decim = bool(decim)
+        self.an_out_source = an_out_source
+        self.an_out_chan = an_out_chan
+        self.an_out_gain = an_out_gain
+        self.inputs = [tuple(settings) for settings in inputs]
+
+    def key(self):
+        return (self.fsamp, self.nch, self.decim, self.an_out_source, self.an_out_chan, self.an_out_gain,
+                tuple(self.inputs))
+
+    def conf_string(self, go=True, trigger=False):
+        """40 configuration bytes, the last one the CRC8
+
+        go=False stops the data transfer, trigger=True forces the trigger high.
+        """
+        conf = [0] * 40
+        conf[0] = 0b10000000
+        if go:
+            conf[0] += self.decim * 64 + self.fsamp * 8 + self.nch * 2 + 1 + trigger * 32
+        conf[1] = self.an_out_gain + self.an_out_source
+        conf[2] = self.an_out_chan
+        for index, settings in enumerate(self.inputs):
+            conf[3 + 3 * index:6 + 3 * index] = settings
+        conf[39] = crc8(conf[:39])
+        return conf
+
+    def layout(self):
+        # Only the sampling and channel codes shape the frames
+        key = ('quattrocento', self.fsamp, self.nch)
+        if key not in _layouts:
+            _layouts[key] = QuattrocentoLayout(QUATTROCENTO_CHANNELS[self.nch], QUATTROCENTO_FSAMP[self.fsamp])
+        return _layouts[key]
@@ -0,0 +1,202 @@
+# -------------------------------------------------------
+# Lossless delta / zig-zag / bit-packing codec for EMG blocks
+#
+# Works on decoded (channels, samples) integer blocks with 16 or 24 bit
+# samples (bytes_in_sample 2 or 3). The block is cut in frames of
+# frame_samples samples; inside a frame every channel stores
+#   - its first sample (int32)
+#   - the bit width of its zig-zag mapped first-order deltas (uint8)
+#   - the deltas packed with that width
+# Consecutive EMG samples are strongly correlated, so the deltas need far
+# fewer bits than the samples. Every frame starts from a stored sample, so
+# any frame (and any channel inside it) is decoded without the others.
+#
+# All the work is vectorized with NumPy: rows (frame, channel) that share
+# the same bit width are packed together into 64-bit words.
+#
+import struct
+import numpy as np
+
+MAGIC = b'OTBC'
+VERSION = 1
+# magic, version, channels, frame_samples, frames, samples, payload words
+HEADER = struct.Struct('<4sHHIIQQ')
+WORD_BITS = 64
+
+
+def zigzag_encode(values):
+    # Small positive and negative numbers become small unsigned numbers
+    values = np.asarray(values, dtype=np.int32)
+    return ((values << 1) ^ (values >> 31)).view(np.uint32)
+
+
+def zigzag_decode(values):
+    values = np.asarray(values, dtype=np.uint32)
+    return ((values >> 1) ^ -(values & 1)).view(np.int32)
+
+
+def bit_width(values):
+    """Bits needed by the largest unsigned value of each row"""
+    largest = values.max(axis=-1).astype(np.uint64)
+    widths = np.zeros(largest.shape, dtype=np.uint8)
+    nonzero = largest > 0
+    widths[nonzero] = np.floor(np.log2(largest[nonzero].astype(np.float64))).astype(np.uint8) + 1
+    return widths
+
+
+def _positions(n, width):
+    # Word and shift of every value of a row packed with 'width' bits
+    bit = np.arange(n, dtype=np.uint64) * np.uint64(width)
+    word = (bit >> np.uint64(6)).astype(np.int64)
+    shift = bit & np.uint64(63)
+    spill = (shift + np.uint64(width)) > np.uint64(WORD_BITS)
+    return word, shift, spill
+
+
+def pack_rows(values, width):
+    """Pack a (rows, n) uint32 array with 'width' bits each, n * width must be a multiple of 64"""
+    rows, n = values.shape
+    if width == 0:
+        return np.zeros((rows, 0), dtype=np.uint64)
+    values = values.astype(np.uint64)
+    word, shift, spill = _positions(n, width)
+    # Bits of different values never overlap, so adding them is the same as or-ing them
+    starts = np.flatnonzero(np.r_[True, word[1:] != word[:-1]])
+    words = np.add.reduceat(values << shift, starts, axis=1)
+    if spill.any():
+        words[:, word[spill] + 1] += values[:, spill] >> (np.uint64(WORD_BITS) - shift[spill])
+    return words
+
+
+def unpack_rows(words, width, n):
+    rows = words.shape[0]
+    if width == 0:
+        return np.zeros((rows, n), dtype=np.uint32)
+    word, shift, spill = _positions(n, width)
+    values = words[:, word] >> shift
+    if spill.any():
+        values[:, spill] |= words[:, word[spill] + 1] << (np.uint64(WORD_BITS) - shift[spill])
+    return (values & np.uint64((1 << width) - 1)).astype(np.uint32)
+
+
+class EncodedBlock:
+    """Frames of an encoded block, with the index needed for random access"""
+
+    def __init__(self, channels, frame_samples, samples, firsts, widths, payload):
+        self.channels = channels
+        self.frame_samples = frame_samples
+        self.samples = samples
+        self.firsts = firsts      # (frames, channels) int32
+        self.widths = widths      # (frames, channels) uint8
+        self.payload = payload    # uint64 words
+        # Word offset of every row (frame, channel), the last entry is the payload size
+        row_words = widths.astype(np.int64).ravel() * (frame_samples // WORD_BITS)
+        self.row_offsets = np.r_[0, np.cumsum(row_words)]
+
+    @property
+    def frames(self):
+        return self.firsts.shape[0]
+
+    def nbytes(self):
+        return HEADER.size + self.firsts.nbytes + self.widths.nbytes + self.payload.nbytes
+
+    def tobytes(self):
+        header = HEADER.pack(MAGIC, VERSION, self.channels, self.frame_samples, self.frames,
+                             self.samples, len(self.payload))
+        return (header + self.firsts.astype('<i4').tobytes() + self.widths.tobytes()
+                + self.payload.astype('<u8').tobytes())
+
+    @classmethod
+    def frombytes(cls, data):
+        magic, version, channels, frame_samples, frames, samples, words = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not an encoded EMG block")
+        offset = HEADER.size
+        firsts = np.frombuffer(data, dtype='<i4', count=frames * channels, offset=offset).reshape(frames, channels)
+        offset += firsts.nbytes
+        widths = np.frombuffer(data, dtype=np.uint8, count=frames * channels, offset=offset).reshape(frames, channels)
+        offset += widths.nbytes
+        payload = np.frombuffer(data, dtype='<u8', count=words, offset=offset)
+        return cls(channels, frame_samples, samples, firsts, widths, payload)
+
+    def decode_frame(self, frame, channels=None):
+        """(channels, frame_samples) block of one frame, decoding only the requested channels"""
+        channels = np.arange(self.channels) if channels is None else np.asarray(channels)
+        out = np.empty((len(channels), self.frame_samples), dtype=np.int32)
+        rows = frame * self.channels + channels
+        for width in np.unique(self.widths[frame, channels]):
+            selected = np.flatnonzero(self.widths[frame, channels] == width)
+            nwords = int(width) * self.frame_samples // WORD_BITS
+            index = self.row_offsets[rows[selected]][:, None] + np.arange(nwords)
+            deltas = zigzag_decode(unpack_rows(self.payload[index], int(width), self.frame_samples))
+            out[selected] = np.cumsum(deltas, axis=1, dtype=np.int32) + self.firsts[frame, channels[selected]][:, None]
+        length = min(self.frame_samples, self.samples - frame * self.frame_samples)
+        return out[:, :length]
+
+    def decode(self, channels=None):
+        return decode_block(self, channels)
+
+
+def encode_block(block, frame_samples=256):
+    """Encode a (channels, samples) block of 16 or 24 bit integers"""
+    if frame_samples % WORD_BITS:
+        raise ValueError(f"frame_samples must be a multiple of {WORD_BITS}")
+    block = np.asarray(block, dtype=np.int32)
+    channels, samples = block.shape
+    frames = -(-samples // frame_samples)
+
+    # The last frame is padded by repeating the last sample: zero deltas cost nothing
+    padded = np.empty((channels, frames * frame_samples), dtype=np.int32)
+    padded[:, :samples] = block
+    padded[:, samples:] = block[:, -1:] if samples else 0
+    # (frames, channels, frame_samples)
+    framed = padded.reshape(channels, frames, frame_samples).transpose(1, 0, 2)
+
+    firsts = np.ascontiguousarray(framed[:, :, 0])
+    deltas = np.empty_like(framed)
+    deltas[:, :, 0] = 0
+    np.subtract(framed[:, :, 1:], framed[:, :, :-1], out=deltas[:, :, 1:])
+    zigzag = zigzag_encode(deltas).reshape(frames * channels, frame_samples)
+    widths = bit_width(zigzag)
+
+    encoded = EncodedBlock(channels, frame_samples, samples, firsts, widths.reshape(frames, channels),
+                           np.empty(0, dtype=np.uint64))
+    payload = np.empty(encoded.row_offsets[-1], dtype=np.uint64)
+    for width in np.unique(widths):
+        if width == 0:
+            continue
+        rows = np.flatnonzero(widths == width)
+        words = pack_rows(zigzag[rows], int(width))
+        payload[encoded.row_offsets[rows][:, None] + np.arange(words.shape[1])] = words
+    encoded.payload = payload
+    return encoded
+
+
+def decode_block(encoded, channels=None):
+    """Decode all the frames of an EncodedBlock into a (channels, samples) int32 array"""
+    channels = np.arange(encoded.channels) if channels is None else np.asarray(channels)
+    frame_samples = encoded.frame_samples
+    frames = encoded.frames
+    rows = (np.arange(frames)[:, None] * encoded.channels + channels).ravel()
+    widths = encoded.widths[:, channels].ravel()
+    firsts = encoded.firsts[:, channels].ravel()
+
+    deltas = np.zeros((len(rows), frame_samples), dtype=np.int32)
+    for width in np.unique(widths):
+        if width == 0:
+            continue
+        selected = np.flatnonzero(widths == width)
+        nwords = int(width) * frame_samples // WORD_BITS
+        index = encoded.row_offsets[rows[selected]][:, None] + np.arange(nwords)
+        deltas[selected] = zigzag_decode(unpack_rows(encoded.payload[index], int(width), frame_samples))
+    values = np.cumsum(deltas, axis=1, dtype=np.int32) + firsts[:, None]
+    values = values.reshape(frames, len(channels), frame_samples).transpose(1, 0, 2)
+    return values.reshape(len(channels), frames * frame_samples)[:, :encoded.samples]
+
+
+def encode_bytes(block, frame_samples=256):
+    return encode_block(block, frame_samples).tobytes()
+
+
+def decode_bytes(data, channels=None):
+    return decode_block(EncodedBlock.frombytes(data), channels)
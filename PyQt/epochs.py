@@ -0,0 +1,163 @@
+# -------------------------------------------------------
+# Running averages of the signal around events (evoked responses,
+# spike-triggered averages)
+#
+# EpochAggregator reads the windows around the events straight from the
+# history of a track, which is written twice (at i and i + capacity): the
+# window around an event is always a contiguous view of it and nothing is
+# copied. Events are queued with their sample index on the track counter
+# and averaged as soon as the samples after them have arrived. The mean
+# and the variance of every channel and lag are updated with Welford's
+# method, one vectorized step per event. AveragedView draws the mean of
+# the channels, with an optional standard deviation band, at display rate.
+#
+from collections import deque
+import numpy as np
+import pyqtgraph as pg
+from PyQt5 import QtCore, QtWidgets
+import rendering
+
+
+class EpochAggregator:
+    def __init__(self, nchannels, frequency, before, after, start=0):
+        """before and after are seconds around each event, start the first sample of the history to use"""
+        self.nchannels = nchannels
+        self.frequency = frequency
+        self.before = int(round(before * frequency))
+        self.after = int(round(after * frequency))
+        self.window = self.before + self.after
+        if self.window <= 0:
+            raise ValueError("The epoch window must be longer than one sample")
+        self.start = start
+        self.pending = deque()
+        self.reset()
+
+    def request_reset(self):
+        # From the GUI thread, applied by the receiver before the next epoch
+        self.reset_requested = True
+
+    def reset(self):
+        self.reset_requested = False
+        self.count = 0
+        self.mean = np.zeros((self.nchannels, self.window))
+        self.m2 = np.zeros((self.nchannels, self.window))
+        self.dropped = 0
+        self.pending.clear()
+        self.latest = (0, self.mean.copy(), self.m2.copy())
+
+    def add_events(self, samples):
+        self.pending.extend(int(sample) for sample in samples)
+
+    def epoch(self, sample, history, position, capacity, received):
+        """View of the window around an event in a mirrored history, None when it is not (or no longer) in it
+
+        position is where the next sample goes, received the samples written so far.
+        """
+        first = sample - self.before
+        if first < self.start or received - first > capacity or sample + self.after > received:
+            return None
+        offset = (position - (received - first)) % capacity
+        return history[:, offset:offset + self.window]
+
+    def collect(self, history, position, capacity, received):
+        """Average the events whose samples have all arrived"""
+        if self.reset_requested:
+            self.reset()
+        updated = False
+        while self.pending and self.pending[0] + self.after <= received:
+            window = self.epoch(self.pending.popleft(), history, position, capacity, received)
+            if window is None:
+                self.dropped += 1
+                continue
+            # Welford: running mean and sum of squared deviations of every channel and lag
+            self.count += 1
+            delta = window - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (window - self.mean)
+            updated = True
+        if updated:
+            # Replaced in one assignment, the view reads it without a lock
+            self.latest = (self.count, self.mean.copy(), self.m2.copy())
+
+    def variance(self):
+        count, mean, m2 = self.latest
+        return m2 / max(count - 1, 1)
+
+    def lags(self):
+        """Time (s) of each sample of the window, 0 at the event"""
+        return (np.arange(self.window) - self.before) / self.frequency
+
+    def describe(self):
+        return (f"{self.count} epochs of {self.window} samples ({self.before} before the event), "
+                f"{len(self.pending)} waiting, {self.dropped} dropped")
+
+
+class AveragedView(QtWidgets.QWidget):
+    """Average of every channel around the events, one channel over another"""
+
+    def __init__(self, aggregator, title='Average', conv_fact=1, offset=1, selection=None, update_interval=100):
+        super().__init__()
+        self.aggregator = aggregator
+        self.conv_fact = conv_fact
+        self.offset = offset
+        self.selection = selection
+        self.shown = None
+        self.setWindowTitle(title)
+        self.resize(800, 900)
+
+        layout = QtWidgets.QVBoxLayout(self)
+        self.plot = pg.PlotWidget(title=title)
+        self.plot.setLabel('bottom', 'Time from event', units='s')
+        self.plot.showGrid(x=True, y=True, alpha=0.3)
+        self.label = QtWidgets.QLabel()
+        controls = QtWidgets.QHBoxLayout()
+        self.spread = QtWidgets.QCheckBox("Standard deviation")
+        reset_button = QtWidgets.QPushButton("Reset")
+        reset_button.clicked.connect(lambda: self.aggregator.request_reset())
+        controls.addWidget(self.label)
+        controls.addStretch()
+        controls.addWidget(self.spread)
+        controls.addWidget(reset_button)
+        layout.addWidget(self.plot)
+        layout.addLayout(controls)
+
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(update_interval)
+
+    def channels(self):
+        return np.arange(self.aggregator.nchannels) if self.selection is None else self.selection.indices
+
+    def rebuild(self, channels):
+        self.plot.clear()
+        pens = [pg.mkPen(color=i, width=1) for i in channels]
+        self.curves = rendering.create_curves(self.plot, pens, mode='batched')
+        # Mean - std and mean + std of every channel, drawn as one line
+        self.bands = self.plot.plot(pen=pg.mkPen((150, 150, 150, 100), width=1), connect='finite')
+        self.shown = channels
+
+    def refresh(self):
+        count, mean, m2 = self.aggregator.latest
+        channels = self.channels()
+        if self.shown is None or not np.array_equal(self.shown, channels):
+            self.rebuild(channels)
+        self.label.setText(f"{count} events")
+        if count == 0 or len(channels) == 0:
+            return
+        x = self.aggregator.lags()
+        offsets = (self.offset * np.arange(len(channels)))[:, None]
+        y = mean[channels] * self.conv_fact + offsets
+        self.curves.set_data(x, y)
+        if self.spread.isChecked() and count > 1:
+            std = np.sqrt(m2[channels] / (count - 1)) * self.conv_fact
+            # Upper then lower edge of each channel, separated by NaN
+            lines = np.concatenate((y + std, np.full((len(channels), 1), np.nan), y - std,
+                                    np.full((len(channels), 1), np.nan)), axis=1)
+            times = np.concatenate((x, [np.nan], x, [np.nan]))
+            self.bands.setData(np.tile(times, len(channels)), lines.reshape(-1))
+        else:
+            self.bands.setData([], [])
+
+    def closeEvent(self, event):
+        self.timer.stop()
+        event.accept()
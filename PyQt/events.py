@@ -0,0 +1,144 @@
+# -------------------------------------------------------
+# Trigger edges as events with sample indices, and their index file
+#
+# EdgeDetector runs on the trigger channels of every decoded block: the
+# channels are compared with a threshold and the level changes found with
+# one diff over the whole block, so the cost does not depend on the
+# number of samples per event. Each event carries the index of its first
+# sample since the start of the stream (the frame index in the recording),
+# the acquisition channel and the edge (+1 rising, -1 falling).
+#
+# EventLog appends the events to <recording>.events next to a RawRecorder
+# file. EventIndex loads that file and cuts epochs around the events out
+# of the recording through a memory map, without reading the rest of it.
+#
+import os
+import numpy as np
+from replay import load_metadata
+from sample_decoding import samples_from_bytes
+
+EVENT_DTYPE = np.dtype([('sample', '<i8'), ('channel', '<i4'), ('edge', '<i1')])
+EDGES = {'rising': (1,), 'falling': (-1,), 'both': (1, -1)}
+
+
+def events_path(path):
+    return path + '.events'
+
+
+class EdgeDetector:
+    def __init__(self, channels, frequency, threshold, edges='rising', min_interval=0.0):
+        """channels are acquisition channels, min_interval (s) ignores the bounces after an edge"""
+        if edges not in EDGES:
+            raise ValueError(f"Unknown edges {edges}, expecting one of {list(EDGES)}")
+        self.channels = np.atleast_1d(np.asarray(channels, dtype=np.intp))
+        self.frequency = frequency
+        self.threshold = threshold
+        self.edges = EDGES[edges]
+        self.min_gap = int(min_interval * frequency)
+        self.level = None
+        self.last = np.full(len(self.channels), -self.min_gap - 1, dtype=np.int64)
+        self.samples = 0  # samples seen so far, index of the next one
+
+    def process(self, block):
+        """Events of a (channels, samples) block of all the acquisition channels, in sample order"""
+        high = block[self.channels] > self.threshold
+        n = high.shape[1]
+        if n == 0:
+            return np.zeros(0, dtype=EVENT_DTYPE)
+        previous = high[:, :1] if self.level is None else self.level[:, None]
+        change = np.diff(high.astype(np.int8), axis=1, prepend=previous.astype(np.int8))
+        self.level = high[:, -1]
+        mask = np.isin(change, self.edges)
+        rows, columns = np.nonzero(mask)
+        order = np.argsort(columns, kind='stable')
+        rows, columns = rows[order], columns[order]
+        events = np.empty(len(rows), dtype=EVENT_DTYPE)
+        events['sample'] = self.samples + columns
+        events['channel'] = self.channels[rows]
+        events['edge'] = change[rows, columns]
+        self.samples += n
+        if self.min_gap and len(events):
+            # Few events per block: the bounce filter can look at them one by one
+            keep = np.ones(len(events), dtype=bool)
+            for i, (sample, row) in enumerate(zip(events['sample'], rows)):
+                if sample - self.last[row] <= self.min_gap:
+                    keep[i] = False
+                else:
+                    self.last[row] = sample
+            events = events[keep]
+        return events
+
+    def describe(self):
+        return f"trigger on channels {self.channels.tolist()} above {self.threshold}"
+
+
+class EventLog:
+    """Append the events of a recording to <recording>.events"""
+
+    def __init__(self, path):
+        self.path = events_path(path)
+        self.file = open(self.path, 'wb')
+        self.count = 0
+
+    def write(self, events):
+        self.file.write(events.tobytes())
+        self.file.flush()
+        self.count += len(events)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+def load_events(path):
+    """Events of a recording, empty if it has none"""
+    if not os.path.exists(events_path(path)):
+        return np.zeros(0, dtype=EVENT_DTYPE)
+    return np.fromfile(events_path(path), dtype=EVENT_DTYPE)
+
+
+class EventIndex:
+    """Events of a raw recording and the epochs around them"""
+
+    def __init__(self, path):
+        self.path = path
+        self.metadata = load_metadata(path)
+        if not self.metadata:
+            raise ValueError(f"{path} has no metadata sidecar")
+        self.events = load_events(path)
+        self.frequency = self.metadata['frequency']
+        self.bytes_in_sample = self.metadata.get('bytes_in_sample', 2)
+        self.frame_size = self.metadata['frame_size']
+        self.nchannels = self.frame_size // self.bytes_in_sample
+
+    def select(self, channel=None, edge=1):
+        """Sample indices of the events of a channel (all by default) and edge (None = both)"""
+        mask = np.ones(len(self.events), dtype=bool)
+        if channel is not None:
+            mask &= self.events['channel'] == channel
+        if edge is not None:
+            mask &= self.events['edge'] == edge
+        return self.events['sample'][mask]
+
+    def times(self, samples):
+        return samples / self.frequency
+
+    def epochs(self, samples, before, after, channels=None):
+        """(events, channels, before + after) windows starting 'before' samples ahead of each event
+
+        Events too close to the ends of the recording are left out, the
+        sample indices of the kept ones are returned with the windows.
+        """
+        frames = os.path.getsize(self.path) // self.frame_size
+        samples = np.asarray(samples, dtype=np.int64)
+        samples = samples[(samples >= before) & (samples + after <= frames)]
+        channels = np.arange(self.nchannels) if channels is None else np.asarray(channels)
+        if len(samples) == 0:
+            return samples, np.zeros((0, len(channels), before + after), dtype=np.int32)
+        data = np.memmap(self.path, dtype=np.uint8, mode='r', shape=(frames, self.frame_size))
+        # Only the frames of the windows are read
+        window = data[samples[:, None] + np.arange(-before, after)]
+        values = samples_from_bytes(window.reshape(-1), self.nchannels, self.bytes_in_sample,
+                                    self.metadata.get('byte_order', 'big'))
+        epochs = values[channels].reshape(len(channels), len(samples), before + after).transpose(1, 0, 2)
+        return samples, epochs
@@ -0,0 +1,84 @@
+# -------------------------------------------------------
+# Adaptive frame pacing for the Soundtrack viewers
+#
+# A single-shot timer is re-armed only after a frame is finished, so a
+# slow draw can never pile up timer events. Each frame redraws only the
+# tracks that received samples since they were last drawn and that are
+# visible in the scroll area, and paints it at once instead of leaving
+# the repaint to the event loop, so the frame time covers both setData
+# and painting. When a frame takes more than the budget (a fraction of
+# the frame interval) the interval grows, leaving CPU time and the GIL
+# to the receiver thread, and it shrinks back once there is headroom
+# again.
+#
+import time
+from PyQt5 import QtCore
+
+
+def is_on_screen(widget, viewport):
+    """False when the widget is hidden or scrolled out of the scroll area viewport"""
+    if not widget.isVisible():
+        return False
+    rect = QtCore.QRect(widget.mapTo(viewport, QtCore.QPoint(0, 0)), widget.size())
+    return rect.intersects(viewport.rect())
+
+
+class FrameScheduler(QtCore.QObject):
+    def __init__(self, window, viewport, tracks, base_interval=16, max_interval=250, budget=0.75):
+        super().__init__()
+        self.window = window
+        self.viewport = viewport
+        self.tracks = tracks
+        self.base_interval = base_interval  # milliseconds
+        self.max_interval = max_interval    # milliseconds
+        self.budget = budget                # fraction of the interval drawing may use
+        self.interval = base_interval
+        self.running = False
+        self.last_drawn = {}
+        self.last_draw_time = 0
+        self.frames = 0
+        self.skipped_tracks = 0
+
+        self.timer = QtCore.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.tick)
+
+    def start(self):
+        self.running = True
+        self.timer.start(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.timer.stop()
+
+    def tick(self):
+        start = time.perf_counter()
+        if self.window.isVisible() and not self.window.isMinimized():
+            for track in self.tracks:
+                # Nothing new since the last draw, or nobody can see it
+                if self.last_drawn.get(id(track)) == track.samples_received or not is_on_screen(track.plot_widget, self.viewport):
+                    self.skipped_tracks += 1
+                    continue
+                self.last_drawn[id(track)] = track.samples_received
+                track.draw()
+                # Painted now: the paint queued by setData is done and not repeated
+                track.plot_widget.viewport().repaint()
+        self.frames += 1
+        self.last_draw_time = time.perf_counter() - start
+        self.adapt(self.last_draw_time)
+        if self.running:
+            self.timer.start(self.interval)
+
+    def adapt(self, draw_time):
+        budget = self.interval / 1000 * self.budget
+        if draw_time > budget:
+            self.interval = min(self.max_interval, int(self.interval * 1.5) + 1)
+        elif draw_time < budget / 3 and self.interval > self.base_interval:
+            self.interval = max(self.base_interval, int(self.interval / 1.25))
+
+    def invalidate(self):
+        """Force every track to be redrawn on the next frame"""
+        self.last_drawn.clear()
+
+    def describe(self):
+        return f"frame {self.interval} ms, draw and paint {self.last_draw_time * 1000:.1f} ms"
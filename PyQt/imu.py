@@ -0,0 +1,169 @@
+# -------------------------------------------------------
+# Orientation of the probes from their quaternion channels
+#
+# Muovi, Muovi+, Due+, Quattro+ and Sessantaquattro+ send the orientation
+# of the probe as 4 quaternion channels (w, x, y, z) next to the EMG. The
+# functions below work on whole (4, samples) blocks with NumPy: normalize,
+# convert to Euler angles or rotation matrices and compute the angular
+# velocity between consecutive quaternions. OrientationStream decimates
+# the incoming blocks to a low rate orientation stream, so only a few
+# samples per block are converted, and OrientationView draws the probe as
+# a rotating box at display rate.
+#
+import numpy as np
+import pyqtgraph as pg
+from PyQt5 import QtCore, QtWidgets
+
+
+def normalize(q):
+    """Unit quaternions of a (4, samples) block, all-zero samples stay zero"""
+    q = np.asarray(q, dtype=np.float64)
+    norm = np.sqrt(np.einsum('ij,ij->j', q, q))
+    return q / np.where(norm > 0, norm, 1)
+
+
+def multiply(a, b):
+    """Hamilton product of two (4, samples) blocks"""
+    aw, ax, ay, az = a
+    bw, bx, by, bz = b
+    return np.array([aw * bw - ax * bx - ay * by - az * bz,
+                     aw * bx + ax * bw + ay * bz - az * by,
+                     aw * by - ax * bz + ay * bw + az * bx,
+                     aw * bz + ax * by - ay * bx + az * bw])
+
+
+def to_euler(q):
+    """(3, samples) roll, pitch and yaw in radians (Z-Y-X convention) of unit quaternions"""
+    w, x, y, z = q
+    roll = np.arctan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y))
+    pitch = np.arcsin(np.clip(2 * (w * y - z * x), -1, 1))
+    yaw = np.arctan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z))
+    return np.array([roll, pitch, yaw])
+
+
+def to_matrices(q):
+    """(samples, 3, 3) rotation matrices of unit quaternions"""
+    w, x, y, z = q
+    m = np.empty((q.shape[1], 3, 3))
+    m[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    m[:, 0, 1] = 2 * (x * y - w * z)
+    m[:, 0, 2] = 2 * (x * z + w * y)
+    m[:, 1, 0] = 2 * (x * y + w * z)
+    m[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    m[:, 1, 2] = 2 * (y * z - w * x)
+    m[:, 2, 0] = 2 * (x * z - w * y)
+    m[:, 2, 1] = 2 * (y * z + w * x)
+    m[:, 2, 2] = 1 - 2 * (x * x + y * y)
+    return m
+
+
+def angular_velocity(q, interval):
+    """(3, samples - 1) angular velocity in rad/s between consecutive unit quaternions 'interval' s apart
+
+    The velocity is in the frame of the probe.
+    """
+    conjugate = q[:, :-1] * np.array([[1], [-1], [-1], [-1]])
+    delta = multiply(conjugate, q[:, 1:])
+    # q and -q are the same rotation, the shortest one is used
+    delta *= np.where(delta[0] < 0, -1, 1)
+    vector = delta[1:]
+    sin_half = np.sqrt(np.einsum('ij,ij->j', vector, vector))
+    angle = 2 * np.arctan2(sin_half, delta[0])
+    return vector * (angle / np.where(sin_half > 0, sin_half, 1)) / interval
+
+
+class OrientationStream:
+    """Low rate orientation of a quaternion channel block stream
+
+    process() is called with the raw (4, samples) blocks of the receiver;
+    one sample every frequency / rate is kept and converted. latest holds
+    the newest (quaternion, euler, angular velocity) for the display.
+    """
+
+    def __init__(self, frequency, rate=50):
+        self.rate = rate
+        self.reset(frequency)
+
+    def reset(self, frequency=None):
+        # Also after a gap: the next velocity must not span the missing samples
+        if frequency is not None:
+            self.frequency = frequency
+            self.step = max(1, int(round(frequency / self.rate)))
+        self.phase = 0
+        self.previous = None
+        self.latest = None
+
+    def process(self, block):
+        """Orientation samples of a block: quaternions (4, n), Euler angles (3, n) and angular velocity (3, n)"""
+        positions = np.arange(self.phase, block.shape[1], self.step)
+        self.phase = (self.phase - block.shape[1]) % self.step
+        if len(positions) == 0:
+            return None
+        q = normalize(block[:, positions])
+        euler = to_euler(q)
+        interval = self.step / self.frequency
+        if self.previous is None:
+            velocity = np.concatenate((np.zeros((3, 1)), angular_velocity(q, interval)), axis=1)
+        else:
+            velocity = angular_velocity(np.concatenate((self.previous, q), axis=1), interval)
+        self.previous = q[:, -1:]
+        # Replaced in one assignment, the display thread reads it without a lock
+        self.latest = (q[:, -1], euler[:, -1], velocity[:, -1])
+        return q, euler, velocity
+
+
+class OrientationView(QtWidgets.QWidget):
+    """Probe drawn as a box with its axes, seen from a fixed camera"""
+
+    # Box edges as pairs of corners, the probe is longer than it is thick
+    CORNERS = np.array([[x, y, z] for x in (-1, 1) for y in (-0.6, 0.6) for z in (-0.25, 0.25)])
+    EDGES = [(a, b) for a in range(8) for b in range(a + 1, 8) if bin(a ^ b).count('1') == 1]
+
+    def __init__(self, stream, title='Orientation', update_interval=16):
+        super().__init__()
+        self.stream = stream
+        self.setWindowTitle(title)
+        self.resize(500, 560)
+
+        layout = QtWidgets.QVBoxLayout(self)
+        self.plot = pg.PlotWidget()
+        self.plot.setAspectLocked(True)
+        self.plot.setMouseEnabled(x=False, y=False)
+        self.plot.hideAxis('left')
+        self.plot.hideAxis('bottom')
+        self.plot.setRange(xRange=(-1.8, 1.8), yRange=(-1.8, 1.8), padding=0)
+        self.box = self.plot.plot(pen=pg.mkPen((200, 200, 200), width=2), connect='pairs')
+        self.axes = [self.plot.plot(pen=pg.mkPen(color, width=3)) for color in ('r', 'g', 'b')]
+        self.label = QtWidgets.QLabel()
+        layout.addWidget(self.plot)
+        layout.addWidget(self.label)
+
+        # Camera looking down at the probe from the front right
+        yaw, pitch = np.radians(-35), np.radians(25)
+        turn = np.array([[np.cos(yaw), -np.sin(yaw), 0], [np.sin(yaw), np.cos(yaw), 0], [0, 0, 1]])
+        tilt = np.array([[1, 0, 0], [0, np.cos(pitch), -np.sin(pitch)], [0, np.sin(pitch), np.cos(pitch)]])
+        self.camera = (tilt @ turn)[[0, 2]]
+        self.pairs = np.array(self.EDGES).reshape(-1)
+
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(update_interval)
+
+    def refresh(self):
+        latest = self.stream.latest
+        if latest is None:
+            return
+        q, euler, velocity = latest
+        projection = self.camera @ to_matrices(q[:, None])[0]
+        corners = projection @ self.CORNERS.T
+        self.box.setData(corners[0, self.pairs], corners[1, self.pairs])
+        for axis, curve in enumerate(self.axes):
+            tip = 1.5 * projection[:, axis]
+            curve.setData([0, tip[0]], [0, tip[1]])
+        roll, pitch, yaw = np.degrees(euler)
+        self.label.setText(f"Roll {roll:7.1f}°  Pitch {pitch:7.1f}°  Yaw {yaw:7.1f}°  "
+                           f"|ω| {np.degrees(np.linalg.norm(velocity)):6.1f} °/s")
+
+    def closeEvent(self, event):
+        self.timer.stop()
+        event.accept()
@@ -0,0 +1,337 @@
+# -------------------------------------------------------
+# Level of detail session view: min/max pyramid, overview and detail plots
+#
+# MinMaxPyramid is built while the data arrives: level 0 keeps the minimum
+# and the maximum of every first_factor samples of each channel, every
+# next level halves the previous one (2x, 4x, ... coarser). Drawing a time
+# window reads the coarsest level that still gives one bucket per pixel,
+# so minutes or hours of data cost the same as a few seconds. Windows too
+# short for level 0 are drawn from the raw samples (the last raw_seconds
+# are kept in memory, older ones come from raw_source, e.g. a recording).
+#
+# SessionView shows the whole session in an overview strip with a region
+# selecting the zoomable detail plot below it. Samples lost while a probe
+# was disconnected are zeros in the pyramid, listed in gaps and shaded in
+# the overview.
+#
+# Browse a raw recording made with replay.RawRecorder:
+#   python lod_view.py recording.bin [first_channel] [last_channel]
+#
+import os
+import sys
+import numpy as np
+import pyqtgraph as pg
+from PyQt5 import QtCore, QtWidgets
+import rendering
+from replay import load_metadata
+from sample_decoding import samples_from_bytes
+
+
+class Level:
+    """Growable (channels, buckets) minimum and maximum arrays"""
+
+    def __init__(self, nchannels, factor, dtype, capacity=1024):
+        self.factor = factor
+        self.mins = np.empty((nchannels, capacity), dtype=dtype)
+        self.maxs = np.empty((nchannels, capacity), dtype=dtype)
+        self.length = 0
+
+    def extend(self, mins, maxs):
+        n = mins.shape[1]
+        if self.length + n > self.mins.shape[1]:
+            capacity = max(2 * self.mins.shape[1], self.length + n)
+            for name in ('mins', 'maxs'):
+                grown = np.empty((self.mins.shape[0], capacity), dtype=self.mins.dtype)
+                grown[:, :self.length] = getattr(self, name)[:, :self.length]
+                setattr(self, name, grown)
+        self.mins[:, self.length:self.length + n] = mins
+        self.maxs[:, self.length:self.length + n] = maxs
+        # Readers only look up to length, it moves after the data is written
+        self.length += n
+
+
+class MinMaxPyramid:
+    def __init__(self, nchannels, frequency, first_factor=32, raw_seconds=10, raw_source=None, dtype=np.int16):
+        self.nchannels = nchannels
+        self.frequency = frequency
+        self.first_factor = first_factor
+        self.dtype = np.dtype(dtype)
+        self.raw_source = raw_source  # raw_source(start, stop) -> (channels, samples), for samples out of the tail
+        self.levels = [Level(nchannels, first_factor, self.dtype)]
+        self.pending = np.empty((nchannels, 0), dtype=self.dtype)
+        self.total = 0
+        self.gaps = []  # (first sample, samples) of the missing data, not in raw_source
+
+        self.tail = np.zeros((nchannels, int(raw_seconds * frequency)), dtype=self.dtype)
+
+    def append(self, block):
+        """Add a (channels, samples) block of raw values"""
+        block = np.asarray(block, dtype=self.dtype)
+        n = block.shape[1]
+        if n == 0:
+            return
+        # Raw tail, written at total % size
+        size = self.tail.shape[1]
+        if 0 < size <= n:
+            positions = np.arange(self.total + n - size, self.total + n) % size
+            self.tail[:, positions] = block[:, -size:]
+        elif size:
+            start = self.total % size
+            first = min(n, size - start)
+            self.tail[:, start:start + first] = block[:, :first]
+            self.tail[:, :n - first] = block[:, first:]
+
+        # Level 0 from whole buckets of raw samples
+        data = np.concatenate((self.pending, block), axis=1) if self.pending.shape[1] else block
+        usable = data.shape[1] - data.shape[1] % self.first_factor
+        if usable:
+            buckets = data[:, :usable].reshape(self.nchannels, -1, self.first_factor)
+            self.levels[0].extend(buckets.min(axis=2), buckets.max(axis=2))
+        self.pending = data[:, usable:].copy()
+        self.total += n
+
+        # Every next level from pairs of the previous one
+        index = 0
+        while True:
+            level = self.levels[index]
+            if index + 1 == len(self.levels):
+                if level.length < 2:
+                    break
+                self.levels.append(Level(self.nchannels, level.factor * 2, self.dtype))
+            upper = self.levels[index + 1]
+            lo, hi = 2 * upper.length, level.length - level.length % 2
+            if hi > lo:
+                upper.extend(level.mins[:, lo:hi].reshape(self.nchannels, -1, 2).min(axis=2),
+                             level.maxs[:, lo:hi].reshape(self.nchannels, -1, 2).max(axis=2))
+            index += 1
+
+    def mark_gap(self, samples):
+        """Missing samples: zeros keep the time axis, the gap is listed in gaps"""
+        self.gaps.append((self.total, samples))
+        step = max(1, int(10 * self.frequency))
+        while samples > 0:
+            n = min(samples, step)
+            self.append(np.zeros((self.nchannels, n), dtype=self.dtype))
+            samples -= n
+
+    def raw(self, start, stop):
+        """Raw samples start:stop from the tail or the raw source, None when not available"""
+        size = self.tail.shape[1]
+        if size and start >= self.total - size:
+            positions = np.arange(start, stop) % size
+            return self.tail[:, positions]
+        if self.raw_source is not None:
+            # The source has no samples for the gaps, the ones before the window shift it
+            shift = 0
+            for first, samples in self.gaps:
+                if start < first + samples and stop > first:
+                    return None
+                if first + samples <= start:
+                    shift += samples
+            return self.raw_source(start - shift, stop - shift)
+        return None
+
+    def query(self, start, stop, pixels, channels=None):
+        """Envelope of samples start:stop for about 'pixels' points
+
+        Returns the times (s) and a (channels, points) array alternating the
+        minimum and the maximum of each bucket, ready to be drawn as a line.
+        """
+        channels = np.arange(self.nchannels) if channels is None else np.asarray(channels)
+        start, stop = max(0, int(start)), min(self.total, int(stop))
+        if stop <= start:
+            return np.zeros(0), np.zeros((len(channels), 0))
+        per_pixel = (stop - start) / max(1, pixels)
+
+        if per_pixel < self.first_factor:
+            raw = self.raw(start, stop)
+            if raw is not None:
+                raw = raw[channels]
+                bucket = int(per_pixel)
+                if bucket <= 1:
+                    return np.arange(start, stop) / self.frequency, raw
+                usable = raw.shape[1] - raw.shape[1] % bucket
+                buckets = raw[:, :usable].reshape(len(channels), -1, bucket)
+                return self.envelope(start, bucket, buckets.min(axis=2), buckets.max(axis=2))
+
+        # Coarsest level that still has a bucket per pixel
+        level = self.levels[0]
+        for candidate in self.levels:
+            if candidate.factor <= per_pixel and candidate.length:
+                level = candidate
+        lo = start // level.factor
+        hi = min(level.length, -(-stop // level.factor))
+        return self.envelope(lo * level.factor, level.factor, level.mins[channels, lo:hi], level.maxs[channels, lo:hi])
+
+    def envelope(self, start, factor, mins, maxs):
+        y = np.empty((mins.shape[0], 2 * mins.shape[1]), dtype=mins.dtype)
+        y[:, 0::2] = mins
+        y[:, 1::2] = maxs
+        x = np.repeat(start + factor * np.arange(mins.shape[1]), 2) / self.frequency
+        return x, y
+
+    def duration(self):
+        return self.total / self.frequency
+
+
+class SessionView(QtWidgets.QWidget):
+    """Overview of the whole session and a zoomable detail of the selected region"""
+
+    def __init__(self, pyramid, title='Session', conv_fact=1, offset=1, selection=None, window=10,
+                 update_interval=500):
+        super().__init__()
+        self.pyramid = pyramid
+        self.conv_fact = conv_fact
+        self.offset = offset
+        self.selection = selection
+        self.curves = {}
+        self.gap_items = []
+        self.updating = False
+        self.setWindowTitle(title)
+        self.resize(1200, 700)
+
+        layout = QtWidgets.QVBoxLayout(self)
+        self.overview = pg.PlotWidget(title='Session overview')
+        self.overview.setFixedHeight(150)
+        self.overview.setMouseEnabled(x=False, y=False)
+        self.overview.setLabel('bottom', 'Time', units='s')
+        self.region = pg.LinearRegionItem([0, window])
+        self.region.setZValue(10)
+        self.overview.addItem(self.region)
+        self.detail = pg.PlotWidget(title='Detail')
+        self.detail.setMouseEnabled(x=True, y=False)
+        self.detail.setLabel('bottom', 'Time', units='s')
+        self.follow = QtWidgets.QCheckBox("Follow live data")
+        self.follow.setChecked(True)
+        layout.addWidget(self.overview)
+        layout.addWidget(self.detail)
+        layout.addWidget(self.follow)
+
+        self.region.sigRegionChanged.connect(self.region_changed)
+        self.detail.sigXRangeChanged.connect(self.detail_changed)
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(update_interval)
+        self.refresh()
+
+    def channels(self):
+        return np.arange(self.pyramid.nchannels) if self.selection is None else self.selection.indices
+
+    def draw(self, plot, start, stop):
+        channels = self.channels()
+        if self.curves.get(plot, (None,))[0] != len(channels):
+            # Curves follow the number of shown channels
+            plot.clear()
+            if plot is self.overview:
+                plot.addItem(self.region)
+                for item in self.gap_items:
+                    plot.addItem(item)
+            pens = [pg.mkPen(color=i, width=1) for i in channels]
+            self.curves[plot] = (len(channels), rendering.create_curves(plot, pens, mode='batched'))
+        curves = self.curves[plot][1]
+        pixels = max(100, plot.width())
+        x, y = self.pyramid.query(start * self.pyramid.frequency, stop * self.pyramid.frequency, pixels, channels)
+        if len(x):
+            curves.set_data(x, y * self.conv_fact + (self.offset * np.arange(len(channels)))[:, None])
+
+    def refresh(self):
+        duration = self.pyramid.duration()
+        self.draw(self.overview, 0, duration)
+        for first, samples in self.pyramid.gaps[len(self.gap_items):]:
+            start = first / self.pyramid.frequency
+            item = pg.LinearRegionItem([start, start + samples / self.pyramid.frequency], movable=False,
+                                       brush=pg.mkBrush(200, 50, 50, 80))
+            self.overview.addItem(item)
+            self.gap_items.append(item)
+        self.overview.setXRange(0, max(duration, 1), padding=0)
+        lo, hi = self.region.getRegion()
+        if self.follow.isChecked() and duration > hi:
+            # Keep the region width, slide it to the newest data
+            self.region.setRegion([max(0, duration - (hi - lo)), duration])
+        else:
+            self.region_changed()
+
+    def region_changed(self):
+        if self.updating:
+            return
+        self.updating = True
+        lo, hi = self.region.getRegion()
+        self.detail.setXRange(lo, hi, padding=0)
+        self.draw(self.detail, lo, hi)
+        self.updating = False
+
+    def detail_changed(self, view, x_range):
+        # Zooming or panning the detail moves the region of the overview
+        if self.updating:
+            return
+        self.updating = True
+        self.region.setRegion(x_range)
+        self.draw(self.detail, *x_range)
+        self.updating = False
+
+    def closeEvent(self, event):
+        self.timer.stop()
+        event.accept()
+
+
+def recording_source(path, nchannels, channels=None, byte_order='big', bytes_in_sample=2):
+    """raw_source reading some channels (all by default) of a raw recording, also while it is written"""
+    channels = np.arange(nchannels) if channels is None else np.asarray(channels)
+    frame_size = nchannels * bytes_in_sample
+
+    def read(start, stop):
+        # Mapped again at every read, the file grows during the session
+        stop = min(stop, os.path.getsize(path) // frame_size)
+        if stop <= start:
+            return np.zeros((len(channels), 0), dtype=np.int32)
+        raw = np.memmap(path, dtype=np.uint8, mode='r', offset=frame_size * start, shape=(stop - start) * frame_size)
+        return samples_from_bytes(raw, nchannels, bytes_in_sample, byte_order)[channels]
+    return read
+
+
+def recording_pyramid(path, block_seconds=10):
+    """Pyramid of a raw recording, finer zoom levels read the file itself"""
+    metadata = load_metadata(path)
+    if not metadata:
+        raise ValueError(f"{path} has no metadata sidecar")
+    bytes_in_sample = metadata.get('bytes_in_sample', 2)
+    nchannels = metadata['frame_size'] // bytes_in_sample
+    source = recording_source(path, nchannels, byte_order=metadata.get('byte_order', 'big'),
+                              bytes_in_sample=bytes_in_sample)
+    pyramid = MinMaxPyramid(nchannels, metadata['frequency'], raw_seconds=0, raw_source=source,
+                            dtype=np.int16 if bytes_in_sample == 2 else np.int32)
+    step = int(block_seconds * metadata['frequency'])
+    frames = os.path.getsize(path) // metadata['frame_size']
+    # Frames lost during a disconnection are put back as gaps, so the time axis is the one of the session
+    position = 0
+    for frame, missing in metadata.get('gaps', []) + [[frames, 0]]:
+        frame = min(frame, frames)
+        for first in range(position, frame, step):
+            pyramid.append(source(first, min(first + step, frame)))
+        if missing:
+            pyramid.mark_gap(missing)
+        position = frame
+    return pyramid
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python lod_view.py recording.bin [first_channel] [last_channel]")
+        sys.exit(1)
+    app = QtWidgets.QApplication(sys.argv)
+    pyramid = recording_pyramid(sys.argv[1])
+    first = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    last = int(sys.argv[3]) if len(sys.argv) > 3 else pyramid.nchannels - 1
+    from channel_selection import ChannelSelection
+    selection = ChannelSelection(pyramid.nchannels, range(first, last + 1))
+    # One channel height of raw units, from the spread of the first level
+    offset = float(np.median(pyramid.levels[0].maxs[:, :pyramid.levels[0].length].astype(float) -
+                             pyramid.levels[0].mins[:, :pyramid.levels[0].length])) or 1
+    view = SessionView(pyramid, sys.argv[1], offset=offset, selection=selection)
+    view.follow.setChecked(False)
+    view.show()
+    app.exec_()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+# -------------------------------------------------------
+# Lab Streaming Layer style outlet, implemented with local sockets
+#
+# StreamInfo follows the LSL stream description (name, type, channel
+# count, nominal rate, channel format, source id and per channel label
+# and type). It is built from the track definitions of the viewers
+# (title, n_channels, acq_channel, offset, conv_fact), so every channel
+# keeps the name and the scale of the track it is plotted in.
+#
+# StreamOutlet pushes chunks of samples, converted to float32 physical
+# units, with the local_clock() time stamp of their first sample; one
+# header per chunk instead of per sample keeps the overhead low at full
+# channel counts. StreamInlet is the matching consumer. The transport is
+# the fan-out server of stream_relay.py, so a slow inlet drops old chunks
+# instead of slowing down the acquisition.
+#
+# Wire format after the JSON stream description line:
+#   <samples uint32><channels uint32><first timestamp float64> + float32 samples (sample-major)
+#
+import json
+import socket
+import struct
+import time
+import numpy as np
+from stream_relay import StreamRelay, Subscriber, open_socket
+
+CHUNK_HEADER = struct.Struct('<IId')
+EMG_TRACKS = ('HDsEMG', 'Bipolar', 'IN')
+
+
+def local_clock():
+    """Monotonic clock shared by all the processes of the machine, in seconds"""
+    return time.monotonic()
+
+
+class StreamInfo:
+    def __init__(self, name, type, channel_count, nominal_srate, channel_format='float32', source_id='',
+                 channels=None):
+        self.name = name
+        self.type = type
+        self.channel_count = channel_count
+        self.nominal_srate = nominal_srate
+        self.channel_format = channel_format
+        self.source_id = source_id
+        self.channels = channels or [{'label': f"Ch {i + 1}"} for i in range(channel_count)]
+        if len(self.channels) != channel_count:
+            raise ValueError(f"{len(self.channels)} channel descriptions for {channel_count} channels")
+
+    @classmethod
+    def from_tracks(cls, name, nominal_srate, track_info, source_id=''):
+        """Channel metadata from the (title, n_channels, acq_channel, offset, conv_fact) track definitions"""
+        channels = []
+        for title, n_channels, acq_channel, offset, conv_fact in track_info:
+            for i in range(n_channels):
+                channels.append({
+                    'label': f"{title} {i + 1}" if n_channels > 1 else title,
+                    'track': title,
+                    'acq_channel': acq_channel + i,
+                    'scale': conv_fact,
+                    'type': 'EMG' if title.startswith(EMG_TRACKS) else 'AUX',
+                })
+        return cls(name, 'EMG', len(channels), nominal_srate, source_id=source_id or name, channels=channels)
+
+    def scales(self):
+        return np.array([channel.get('scale', 1) for channel in self.channels], dtype=np.float32)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'type': self.type,
+            'channel_count': self.channel_count,
+            'nominal_srate': self.nominal_srate,
+            'channel_format': self.channel_format,
+            'source_id': self.source_id,
+            'channels': self.channels,
+        }
+
+    @classmethod
+    def from_dict(cls, info):
+        return cls(info['name'], info['type'], info['channel_count'], info['nominal_srate'],
+                   info['channel_format'], info['source_id'], info['channels'])
+
+
+class ChunkSubscriber(Subscriber):
+    # Chunks carry their own header, inlets always get all the channels
+    def info(self):
+        return self.relay.info.to_dict()
+
+
+class StreamOutlet(StreamRelay):
+    """Publish (channels, samples) blocks as time stamped float32 chunks
+
+    chunk_size splits larger blocks into chunks of at most that many samples
+    (0 = one chunk per pushed block).
+    """
+
+    def __init__(self, info, address, chunk_size=0, max_chunks=256):
+        description = info.to_dict()
+        super().__init__(address, max_chunks, nchannels=info.channel_count,
+                         frame_size=info.channel_count * 4, **description)
+        self.info = info
+        self.chunk_size = chunk_size
+        self.scale = info.scales()[:, None]
+        self.pushed_samples = 0
+
+    def make_subscriber(self, connection, request):
+        return ChunkSubscriber(self, connection, max_blocks=self.max_blocks)
+
+    def push_chunk(self, block, timestamp=None):
+        """Push a (channels, samples) block of raw values, timestamp is the time of its last sample"""
+        samples = block.shape[1]
+        if samples == 0:
+            return
+        if timestamp is None:
+            timestamp = local_clock()
+        first = timestamp - (samples - 1) / self.info.nominal_srate
+        self.pushed_samples += samples
+        if not self.subscribers:
+            return
+        values = (block * self.scale).astype(np.float32).T
+        step = self.chunk_size or samples
+        for start in range(0, samples, step):
+            chunk = values[start:start + step]
+            header = CHUNK_HEADER.pack(len(chunk), self.info.channel_count,
+                                       first + start / self.info.nominal_srate)
+            self.publish(header + chunk.tobytes())
+
+
+class StreamInlet:
+    """Receive the chunks of a StreamOutlet"""
+
+    def __init__(self, address, timeout=None):
+        self.socket = open_socket(address)
+        self.socket.connect(address)
+        self.socket.settimeout(timeout)
+        self.socket.sendall(b'{}\n')
+        self.file = self.socket.makefile('rb')
+        self.info = StreamInfo.from_dict(json.loads(self.file.readline()))
+
+    def pull_chunk(self):
+        """(timestamps, samples) with samples shaped (n, channels), None when the outlet closed"""
+        try:
+            header = self.file.read(CHUNK_HEADER.size)
+        except socket.timeout:
+            return None
+        if len(header) < CHUNK_HEADER.size:
+            return None
+        samples, channels, first = CHUNK_HEADER.unpack(header)
+        data = self.file.read(samples * channels * 4)
+        if len(data) < samples * channels * 4:
+            return None
+        values = np.frombuffer(data, dtype=np.float32).reshape(samples, channels)
+        timestamps = first + np.arange(samples) / self.info.nominal_srate
+        return timestamps, values
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
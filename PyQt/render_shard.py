@@ -0,0 +1,185 @@
+# -------------------------------------------------------
+# Render processes reading a shared acquisition ring
+#
+# With hundreds of channels a single Qt process spends all its time
+# drawing. The viewer that owns the socket publishes the samples with
+# shared_ring.py and launches N render processes; each one draws a part of
+# the channel groups in its own window, with its own GUI loop, so drawing
+# scales across the CPU cores.
+#
+# Channel groups come from the ring metadata:
+#   - Quattrocento and Novecento rings describe every input ('inputs', see
+#     ring_layout() in device_config.py), one group each, plus the AUX and
+#     accessory channels
+#   - the other rings have one channel map entry per channel, consecutive
+#     channels of the same track form a group of at most GROUP_SIZE channels
+#
+# A render process can also be started by hand:
+#   python render_shard.py ring_name [--groups 0,1] [--plot-time 1] [--update 50] [--mode batched]
+#
+import argparse
+import json
+import subprocess
+import sys
+import numpy as np
+import pyqtgraph as pg
+from PyQt5 import QtCore, QtWidgets
+import rendering
+from shared_ring import SharedRingReader
+
+GROUP_SIZE = 64
+OFFSET = 2  # vertical distance between channels
+
+
+def channel_groups(metadata, nchannels, frequency):
+    """Groups of columns of the ring: title, start, stop, channels, plot_channels, scale, frequency
+
+    Rows of the ring may hold several samples of a group (Novecento blocks),
+    the samples of a group are the columns start:stop read row after row.
+    """
+    groups = []
+    if 'inputs' in metadata:
+        for entry in metadata['inputs']:
+            groups.append(dict(title=entry['name'], start=entry['start'], stop=entry['stop'],
+                               channels=entry['channels'], plot_channels=entry['plot_channels'],
+                               scale=entry['scale'], frequency=entry['frequency']))
+        for key, title in (('aux', 'AUX'), ('accessory', 'Accessory')):
+            entry = metadata.get(key)
+            # Novecento accessory samples are int32 word pairs, not ring values
+            if entry and 'dtype' not in entry:
+                groups.append(dict(title=entry.get('name', title), start=entry['start'], stop=entry['stop'],
+                                   channels=entry['channels'], plot_channels=entry['channels'],
+                                   scale=entry['scale'], frequency=entry['frequency']))
+        return groups
+
+    channels = metadata.get('channels') or [{'track': 'Channels'}] * nchannels
+    first = 0
+    while first < nchannels:
+        # One track, split in groups when it is too large for one plot
+        track = channels[first].get('track')
+        last = first + 1
+        while last < nchannels and channels[last].get('track') == track:
+            last += 1
+        for start in range(first, last, GROUP_SIZE):
+            stop = min(last, start + GROUP_SIZE)
+            title = track if last - first <= GROUP_SIZE else f"{track} {start - first + 1}-{stop - first}"
+            groups.append(dict(title=title, start=start, stop=stop, channels=stop - start,
+                               plot_channels=stop - start, scale=channels[start].get('scale', 1),
+                               frequency=frequency))
+        first = last
+    return groups
+
+
+class GroupPlot:
+    def __init__(self, group, mode):
+        self.group = group
+        self.widget = pg.PlotWidget(title=group['title'])
+        self.widget.setMinimumHeight(300)
+        n = group['plot_channels']
+        pens = [pg.mkPen(pg.intColor(i, n)) for i in range(n)]
+        self.curves = rendering.create_curves(self.widget, pens, mode=mode)
+        self.offsets = (OFFSET * np.arange(n))[:, None]
+        self.x = None
+
+    def draw(self, frames):
+        # frames is a (rows, ring channels) view, the samples of the group follow each other row after row
+        group = self.group
+        samples = frames[:, group['start']:group['stop']].reshape(-1, group['channels']).T
+        values = samples[:group['plot_channels']] * group['scale'] + self.offsets
+        if self.x is None or len(self.x) != values.shape[1]:
+            self.x = np.arange(values.shape[1]) / group['frequency']
+        self.curves.set_data(self.x, values)
+
+
+class ShardWindow(QtWidgets.QWidget):
+    def __init__(self, reader, groups, plot_time, update_time, mode):
+        super().__init__()
+        self.reader = reader
+        self.rows = int(plot_time * reader.frequency)
+        self.last_cursor = None
+
+        layout = QtWidgets.QVBoxLayout(self)
+        scroll_area = QtWidgets.QScrollArea()
+        scroll_area.setWidgetResizable(True)
+        content = QtWidgets.QWidget()
+        content_layout = QtWidgets.QVBoxLayout(content)
+        self.plots = []
+        for group in groups:
+            plot = GroupPlot(group, mode)
+            content_layout.addWidget(plot.widget)
+            self.plots.append(plot)
+        scroll_area.setWidget(content)
+        layout.addWidget(scroll_area)
+        self.setWindowTitle(f"{reader.metadata.get('device', 'Device')}: {', '.join(g['title'] for g in groups)}")
+        self.resize(1000, 800)
+
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.update_plots)
+        self.timer.start(update_time)
+
+    def update_plots(self):
+        frames, cursor = self.reader.read_latest(self.rows)
+        if cursor == self.last_cursor or frames.shape[1] == 0:
+            return
+        self.last_cursor = cursor
+        frames = frames.T
+        for plot in self.plots:
+            plot.draw(frames)
+
+    def closeEvent(self, event):
+        self.timer.stop()
+        event.accept()
+
+
+def split(count, processes):
+    """Contiguous lists of group indices, one per process"""
+    processes = max(1, min(processes, count))
+    bounds = np.linspace(0, count, processes + 1).astype(int)
+    return [list(range(bounds[i], bounds[i + 1])) for i in range(processes)]
+
+
+def launch(ring_name, processes, plot_time=1, update_time=50, mode='batched'):
+    """Start the render processes for a ring, returns their Popen objects"""
+    reader = SharedRingReader(ring_name)
+    count = len(channel_groups(reader.metadata, reader.nchannels, reader.frequency))
+    reader.close()
+    # Separate interpreters: the viewers are scripts that must not run again in the children
+    return [subprocess.Popen([sys.executable, __file__, ring_name, '--groups', ','.join(map(str, indices)),
+                              '--plot-time', str(plot_time), '--update', str(update_time), '--mode', mode])
+            for indices in split(count, processes)]
+
+
+def wait(shards):
+    """Return when every render window is closed"""
+    for shard in shards:
+        shard.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Draw channel groups of a shared acquisition ring")
+    parser.add_argument('ring')
+    parser.add_argument('--groups', help="comma separated group indices, all by default")
+    parser.add_argument('--plot-time', type=float, default=1)
+    parser.add_argument('--update', type=int, default=50)
+    parser.add_argument('--mode', default='batched', choices=rendering.RENDER_MODES)
+    parser.add_argument('--list', action='store_true', help="print the channel groups and exit")
+    args = parser.parse_args()
+
+    reader = SharedRingReader(args.ring)
+    groups = channel_groups(reader.metadata, reader.nchannels, reader.frequency)
+    if args.list:
+        for index, group in enumerate(groups):
+            print(index, json.dumps(group))
+        return
+    if args.groups:
+        groups = [groups[int(index)] for index in args.groups.split(',')]
+
+    app = QtWidgets.QApplication(sys.argv)
+    mode = rendering.configure(args.mode)
+    window = ShardWindow(reader, groups, args.plot_time, args.update, mode)
+    window.show()
+    app.exec_()
+
+
+if __name__ == '__main__':
+    main()
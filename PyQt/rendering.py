@@ -0,0 +1,119 @@
+# -------------------------------------------------------
+# Switchable rendering backends for the pyqtgraph viewers
+#
+# Render modes (Config.RENDER_MODE):
+#   'antialiased' - one curve per channel, antialiasing on (previous behaviour)
+#   'fast'        - one curve per channel, antialiasing only on sparse tracks,
+#                   curves peak-downsampled to the screen resolution
+#   'batched'     - antialiasing off, the channels sharing a pen are drawn as
+#                   a single curve (one vertex buffer, one draw call). Tracks
+#                   with more pens than BATCH_COLORS reuse a repeating palette
+#                   picked from their pens
+#   'opengl'      - 'batched' drawn through OpenGL. No GPU is needed: with
+#                   Mesa the llvmpipe software rasterizer is used
+#
+import importlib.util
+import os
+import numpy as np
+import pyqtgraph as pg
+
+RENDER_MODES = ('antialiased', 'fast', 'batched', 'opengl')
+DENSE_TRACK = 8  # tracks with more channels than this are never antialiased in 'fast' mode
+BATCH_COLORS = 9  # curves of a 'batched' track at most, as many as the colours of pg.intColor(i)
+
+
+def configure(mode, software_gl=True):
+    """Set the global pyqtgraph options for a render mode, returns the mode actually used
+
+    Call it once after the QApplication is created and before any plot widget.
+    """
+    if mode not in RENDER_MODES:
+        raise ValueError(f"Unknown render mode {mode}, expecting one of {RENDER_MODES}")
+    if mode == 'opengl' and importlib.util.find_spec('OpenGL') is None:
+        print("PyOpenGL is not installed, falling back to 'batched' rendering")
+        mode = 'batched'
+    if mode == 'opengl' and software_gl:
+        # Mesa llvmpipe: same GL path on machines without a usable GPU
+        os.environ.setdefault('LIBGL_ALWAYS_SOFTWARE', '1')
+    pg.setConfigOptions(antialias=(mode == 'antialiased'), useOpenGL=(mode == 'opengl'))
+    return mode
+
+
+def pen_key(pen):
+    # Pens drawing the same line
+    return pen.color().rgba(), pen.widthF()
+
+
+class ChannelCurves:
+    """One PlotDataItem for each channel"""
+
+    def __init__(self, plot_widget, pens, names=None, fast=False):
+        self.curves = []
+        for i, pen in enumerate(pens):
+            name = names[i] if names else None
+            curve = plot_widget.plot(pen=pen, name=name)
+            if fast:
+                curve.setDownsampling(auto=True, method='peak')
+                curve.setSkipFiniteCheck(True)
+            self.curves.append(curve)
+
+    def set_data(self, x, y):
+        # y is a (channels, samples) array
+        for index, curve in enumerate(self.curves):
+            curve.setData(x, y[index])
+
+
+class BatchedCurves:
+    """Channels sharing a pen are concatenated in a single PlotCurveItem
+
+    The 'connect' array breaks the line between the last sample of a channel
+    and the first sample of the next one, so each group costs one draw call.
+    The viewers give each channel its own colour (pg.intColor(i, n)): with
+    more than 'colors' different pens, channel i is drawn with pen
+    i % colors of a palette taken evenly from them, so neighbouring
+    channels still get distant colours.
+    """
+
+    def __init__(self, plot_widget, pens, colors=BATCH_COLORS):
+        if len({pen_key(pen) for pen in pens}) > colors:
+            palette = [pens[k * len(pens) // colors] for k in range(colors)]
+            pens = [palette[i % colors] for i in range(len(pens))]
+        groups = {}
+        for i, pen in enumerate(pens):
+            groups.setdefault(pen_key(pen), (pen, []))[1].append(i)
+
+        self.groups = []
+        for pen, indices in groups.values():
+            item = pg.PlotCurveItem(pen=pen, skipFiniteCheck=True)
+            plot_widget.addItem(item)
+            self.groups.append((np.array(indices), item))
+        self.num_samples = None
+        self.layouts = []
+
+    def _build_layouts(self, x):
+        # The tiled x values and the connect arrays only change with the window length
+        n = len(x)
+        self.layouts = []
+        for indices, _ in self.groups:
+            connect = np.ones(len(indices) * n, dtype=bool)
+            connect[n - 1::n] = False
+            self.layouts.append((np.tile(x, len(indices)), connect))
+        self.num_samples = n
+
+    def set_data(self, x, y):
+        if len(x) != self.num_samples:
+            self._build_layouts(x)
+        for (indices, item), (xs, connect) in zip(self.groups, self.layouts):
+            item.setData(xs, y[indices].ravel(), connect=connect)
+
+
+def create_curves(plot_widget, pens, names=None, mode='fast'):
+    """Create the curves of a track for the given render mode"""
+    if mode == 'antialiased':
+        plot_widget.setAntialiasing(True)
+        return ChannelCurves(plot_widget, pens, names)
+    if mode == 'fast':
+        plot_widget.setAntialiasing(len(pens) <= DENSE_TRACK)
+        return ChannelCurves(plot_widget, pens, names, fast=True)
+    plot_widget.setAntialiasing(False)
+    return BatchedCurves(plot_widget, pens)
@@ -0,0 +1,159 @@
+# -------------------------------------------------------
+# Raw stream recording and offline replay
+#
+# RawRecorder writes the bytes exactly as they come from the device, plus
+# a small JSON sidecar (<file>.json) with the stream layout. ReplaySource
+# memory-maps such a file and behaves like the connected socket: the
+# viewers read from it with recv() and get the same blocks they would get
+# from the probe, paced at 1x, Nx or as fast as possible.
+#
+import json
+import mmap
+import os
+import time
+
+
+def metadata_path(path):
+    return path + '.json'
+
+
+def segment_path(path, segment):
+    """Recording path of a segment, the first one (0) is path itself"""
+    if segment == 0:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}_{segment}{ext}"
+
+
+def load_metadata(path):
+    """Sidecar metadata of a recording, empty if the file has none"""
+    if not os.path.exists(metadata_path(path)):
+        return {}
+    with open(metadata_path(path)) as f:
+        return json.load(f)
+
+
+class RawRecorder:
+    """Write the raw device stream to disk"""
+
+    def __init__(self, path, **metadata):
+        self.path = path
+        self.metadata = dict(metadata, recorded_at=time.strftime('%Y-%m-%d %H:%M:%S'))
+        with open(metadata_path(path), 'w') as f:
+            json.dump(self.metadata, f, indent=2)
+        self.file = open(path, 'wb')
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.file.write(data)
+        self.bytes_written += len(data)
+
+    def mark_gap(self, frames):
+        """Note frames lost at the current position in the sidecar, the file itself has no filler"""
+        frame = self.bytes_written // self.metadata['frame_size']
+        self.metadata.setdefault('gaps', []).append([frame, frames])
+        with open(metadata_path(self.path), 'w') as f:
+            json.dump(self.metadata, f, indent=2)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+class ReplaySource:
+    """Socket-like object playing back a raw recording
+
+    speed is 1.0 for real time, N for N times faster and 0 (or None) to
+    deliver the data as fast as it is read. Pacing is computed from the
+    start of the replay, so sleep jitter never accumulates.
+    """
+
+    def __init__(self, path, frame_size=None, frequency=None, speed=1.0, loop=False, block_time=1 / 64):
+        self.path = path
+        self.metadata = load_metadata(path)
+        self.frame_size = frame_size or self.metadata['frame_size']
+        self.frequency = frequency or self.metadata['frequency']
+        self.speed = speed
+        self.loop = loop
+
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        # A truncated last frame is never delivered
+        self.size = len(self.map) - len(self.map) % self.frame_size
+        self.position = 0
+        self.played = 0
+        self.start_time = None
+        self.closed = False
+
+        self.bytes_per_second = self.frame_size * self.frequency
+        # Paced replay hands out blocks no larger than the device would send at once
+        self.block_size = max(self.frame_size, int(self.frequency * block_time) * self.frame_size)
+
+    def duration(self):
+        return self.size / self.bytes_per_second
+
+    def _wait_for(self, played):
+        if not self.speed:
+            return
+        if self.start_time is None:
+            self.start_time = time.perf_counter()
+        target = self.start_time + played / (self.bytes_per_second * self.speed)
+        delay = target - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def read_block(self, nbytes):
+        """Next block as a memoryview on the mapped file (no copy), empty at the end"""
+        if self.closed:
+            return memoryview(b'')
+        if self.position >= self.size:
+            if not self.loop or self.size == 0:
+                return memoryview(b'')
+            self.position = 0
+        if self.speed:
+            nbytes = min(nbytes, self.block_size)
+        end = min(self.size, self.position + nbytes)
+        block = self.view[self.position:end]
+        self._wait_for(self.played + len(block))
+        self.position = end
+        self.played += len(block)
+        return block
+
+    # ---- socket interface used by the receivers ----
+    def recv(self, nbytes):
+        return bytes(self.read_block(nbytes))
+
+    def recv_into(self, buffer, nbytes=0):
+        target = memoryview(buffer)
+        block = self.read_block(nbytes or len(target))
+        target[:len(block)] = block
+        return len(block)
+
+    def send(self, data):
+        # Commands to the device are meaningless during a replay
+        return len(data)
+
+    def sendall(self, data):
+        return None
+
+    def setsockopt(self, *args):
+        return None
+
+    def settimeout(self, timeout):
+        return None
+
+    def shutdown(self, how):
+        return None
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.view.release()
+            self.map.close()
+        except BufferError:
+            # The receiver thread still holds a block, the mapping goes away with it
+            pass
+        self.file.close()
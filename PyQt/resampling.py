@@ -0,0 +1,136 @@
+# -------------------------------------------------------
+# Streaming polyphase resampling of mixed rate inputs
+#
+# Each Novecento input has its own sampling frequency (500 to 8000 Hz) and
+# the AUX channels another one. PolyphaseResampler converts a stream from
+# one rate to another block by block: the rational factor up/down is
+# applied with a windowed sinc filter split into 'up' phases, so only the
+# needed output samples are computed, for all the channels at once. The
+# filter is centred on a whole number of output samples, and those first
+# outputs are dropped: output k is the signal at time k / frequency_out,
+# exactly, whatever the input rate. MixedRateAligner uses one resampler
+# per input to put all the inputs on a common clock, or keeps their
+# native rates and gives the time of each sample.
+#
+import math
+import numpy as np
+
+
+class PolyphaseResampler:
+    def __init__(self, nchannels, frequency_in, frequency_out, taps_per_phase=16, rolloff=0.9, beta=8.0):
+        if frequency_in <= 0 or frequency_out <= 0:
+            raise ValueError("Sampling frequencies must be positive")
+        g = math.gcd(int(frequency_in), int(frequency_out))
+        self.nchannels = nchannels
+        self.frequency_in = frequency_in
+        self.frequency_out = frequency_out
+        self.up = int(frequency_out) // g
+        self.down = int(frequency_in) // g
+        self.passthrough = self.up == self.down
+        self.produced = 0  # output samples returned so far
+
+        if self.passthrough:
+            return
+        # taps_per_phase samples of the slower rate on each side of the centre, which falls on a
+        # multiple of 'down' upsampled samples: the delay is 'skip' whole output samples
+        self.skip = math.ceil(max(self.up, self.down) * taps_per_phase / 2 / self.down)
+        centre = self.skip * self.down
+        n = np.arange(2 * centre + 1)
+        cutoff = rolloff * 0.5 / max(self.up, self.down)  # cycles per upsampled sample
+        h = self.up * 2 * cutoff * np.sinc(2 * cutoff * (n - centre)) * np.kaiser(len(n), beta)
+        # Phase p uses taps p, p + up, p + 2 up, ...
+        self.taps = -(-len(h) // self.up)
+        h = np.concatenate((h, np.zeros(self.taps * self.up - len(h))))
+        self.phases = h.reshape(self.taps, self.up).T.copy()
+
+        self.history = np.zeros((nchannels, self.taps - 1))
+        self.consumed = 0     # input samples received so far
+        self.next_output = 0  # index of the next output, the first 'skip' ones are dropped
+
+    def process(self, block):
+        """Resampled (channels, samples) of the next (channels, samples) input block"""
+        if self.passthrough:
+            self.produced += block.shape[1]
+            return np.asarray(block, dtype=np.float64)
+        n = block.shape[1]
+        extended = np.concatenate((self.history, block), axis=1)
+        first = self.consumed - (self.taps - 1)  # input index of extended[:, 0]
+        self.consumed += n
+
+        # Outputs whose newest input sample has arrived
+        last = (self.consumed * self.up - 1) // self.down
+        outputs = np.arange(self.next_output, last + 1)
+        self.next_output = last + 1
+        upsampled = outputs * self.down
+        newest = upsampled // self.up - first
+        weights = self.phases[upsampled % self.up]
+        result = np.zeros((self.nchannels, len(outputs)))
+        for j in range(self.taps):
+            result += extended[:, newest - j] * weights[:, j]
+        self.history = extended[:, extended.shape[1] - (self.taps - 1):]
+
+        # The filter delay, dropped once
+        dropped = min(len(outputs), max(0, self.skip - (outputs[0] if len(outputs) else 0)))
+        result = result[:, dropped:]
+        self.produced += result.shape[1]
+        return result
+
+    def times(self, count):
+        """Times (s) of the next count outputs"""
+        return (self.produced + np.arange(count)) / self.frequency_out
+
+
+class MixedRateAligner:
+    """Inputs of a Novecento layout on a common clock, or at their native rates with their sample times
+
+    process() takes the (blocks, block_size) frames of the receiver. With a
+    rate it returns the start time and a (channels, samples) array of all
+    the inputs, AUX last, and bounds gives the rows of each input. Without
+    a rate it returns a (samples, times) pair per input.
+    """
+
+    def __init__(self, layout, rate=None, taps_per_phase=16):
+        self.slots = list(layout.inputs) + [layout.aux]
+        for slot in self.slots:
+            if slot.words != 1:
+                raise ValueError(f"IN {slot.index + 1}: high resolution inputs are not resampled")
+        self.rate = rate
+        self.counts = [0] * len(self.slots)
+        self.bounds = []
+        start = 0
+        for slot in self.slots:
+            self.bounds.append((start, start + slot.channels))
+            start += slot.channels
+        self.nchannels = start
+        if rate is not None:
+            self.resamplers = [PolyphaseResampler(slot.channels, slot.frequency, rate, taps_per_phase)
+                               for slot in self.slots]
+            self.pending = [np.zeros((slot.channels, 0)) for slot in self.slots]
+            self.aligned = 0
+
+    def process(self, frames):
+        if self.rate is None:
+            blocks = []
+            for i, slot in enumerate(self.slots):
+                samples = slot.samples(frames)
+                blocks.append((samples, (self.counts[i] + np.arange(samples.shape[1])) / slot.frequency))
+                self.counts[i] += samples.shape[1]
+            return blocks
+
+        for i, (slot, resampler) in enumerate(zip(self.slots, self.resamplers)):
+            resampled = resampler.process(slot.samples(frames))
+            self.pending[i] = np.concatenate((self.pending[i], resampled), axis=1)
+        # Only the samples every input has reached leave, the rest waits for the next frames
+        count = min(pending.shape[1] for pending in self.pending)
+        block = np.empty((self.nchannels, count))
+        for i, (start, stop) in enumerate(self.bounds):
+            block[start:stop] = self.pending[i][:, :count]
+            self.pending[i] = self.pending[i][:, count:]
+        start_time = self.aligned / self.rate
+        self.aligned += count
+        return start_time, block
+
+    def describe(self):
+        if self.rate is None:
+            return f"{len(self.slots)} inputs at their native rates"
+        return f"{len(self.slots)} inputs resampled to {self.rate} Hz"
@@ -0,0 +1,62 @@
+# -------------------------------------------------------
+# Decoding of interleaved 16 and 24 bit samples
+#
+# The probes send frames of nchannels samples, each sample 2 bytes (EMG)
+# or 3 bytes (Muovi EEG mode, Sessantaquattro+ high resolution), most
+# significant byte first. 16 bit frames are decoded as a NumPy view on
+# the received bytes. 24 bit frames have no NumPy type: the bytes are
+# copied, reversed, into the top three bytes of 32 bit words through a
+# uint8 view, and an arithmetic shift right by 8 sign-extends them. Both
+# paths are a few vectorized passes, with no Python loop per sample.
+#
+import numpy as np
+
+
+def decode_24(raw, byte_order='big'):
+    """int32 values of packed 3 byte samples"""
+    b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+    words = np.empty((len(b), 4), dtype=np.uint8)
+    # Little endian words: byte 0 is the lowest, the sample fills bytes 1-3
+    words[:, 0] = 0
+    words[:, 1:] = b[:, ::-1] if byte_order == 'big' else b
+    values = words.view('<i4').reshape(-1)
+    values >>= 8
+    return values
+
+
+def samples_from_bytes(raw, nchannels, bytes_in_sample, byte_order='big'):
+    """(channels, samples) int32 block from interleaved 2 or 3 byte samples"""
+    if bytes_in_sample == 2:
+        values = np.frombuffer(raw, dtype=('>' if byte_order == 'big' else '<') + 'i2').astype(np.int32)
+    elif bytes_in_sample == 3:
+        values = decode_24(raw, byte_order)
+    else:
+        raise ValueError(f"Unknown bytes_in_sample value {bytes_in_sample}, expecting 2 or 3")
+    return values.reshape(-1, nchannels).T
+
+
+class SampleDecoder:
+    """Frame layout of a device and the matching decode path"""
+
+    def __init__(self, nchannels, bytes_in_sample=2, byte_order='big'):
+        if bytes_in_sample not in (2, 3):
+            raise ValueError(f"Unknown bytes_in_sample value {bytes_in_sample}, expecting 2 or 3")
+        self.nchannels = nchannels
+        self.bytes_in_sample = bytes_in_sample
+        self.byte_order = byte_order
+        self.frame_size = nchannels * bytes_in_sample
+        self.dtype = np.dtype(np.int16 if bytes_in_sample == 2 else np.int32)
+
+    def decode(self, raw):
+        """(channels, samples) block of whole frames of raw bytes
+
+        16 bit samples are a view on raw, 24 bit samples a new int32 array.
+        """
+        if self.bytes_in_sample == 2:
+            values = np.frombuffer(raw, dtype=('>' if self.byte_order == 'big' else '<') + 'i2')
+        else:
+            values = decode_24(raw, self.byte_order)
+        return values.reshape(-1, self.nchannels).T
+
+    def describe(self):
+        return f"{8 * self.bytes_in_sample} bit samples, {self.frame_size} B frames"
@@ -0,0 +1,168 @@
+# -------------------------------------------------------
+# Acquisition ring buffer in shared memory
+#
+# The process that owns the device socket writes the decoded samples into
+# a multiprocessing.shared_memory block; any process of the same host
+# attaches to it by name and reads the latest samples as NumPy views, with
+# no socket and no serialization in between.
+#
+# Layout of the block:
+#   fixed header   magic, version, nchannels, capacity, frequency, dtype,
+#                  write cursor (total samples written), data offset
+#   JSON           device, channel map (label, acq_channel, scale per
+#                  channel) and any other attribute
+#   data           (2 * capacity, nchannels) samples
+#
+# Every sample is written twice, at i and i + capacity, so the latest n
+# samples (n <= capacity) are always contiguous and read_latest() returns
+# a view without copying. The cursor is updated after the samples, so a
+# reader never sees samples that are not written yet; a view stays valid
+# until the writer wraps around it (capacity - n samples later).
+#
+import json
+import struct
+import time
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+MAGIC = b'OTBR'
+VERSION = 1
+# magic, version, nchannels, capacity, frequency, dtype, data offset, metadata length
+FIXED_HEADER = struct.Struct('<4sHIQd8sQI')
+CURSOR_OFFSET = 64  # the cursor has its own 8 byte aligned slot after the fixed header
+ALIGNMENT = 64
+
+
+def attach(name):
+    """Attach to an existing block without letting this process unlink it at exit"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        # Older versions register every attached block with the resource tracker
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+class SharedRing:
+    """Writer side, owned by the process that receives the data"""
+
+    def __init__(self, name, nchannels, frequency, seconds=10, dtype='<i2', channels=None, **attributes):
+        self.name = name
+        self.nchannels = nchannels
+        self.frequency = frequency
+        self.capacity = int(seconds * frequency)
+        self.dtype = np.dtype(dtype)
+        if channels is not None and len(channels) != nchannels:
+            raise ValueError(f"{len(channels)} channel descriptions for {nchannels} channels")
+        metadata = json.dumps(dict(attributes, channels=channels)).encode()
+
+        data_offset = -(-(CURSOR_OFFSET + 8 + len(metadata)) // ALIGNMENT) * ALIGNMENT
+        size = data_offset + 2 * self.capacity * nchannels * self.dtype.itemsize
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left over by a viewer that did not close cleanly
+            stale = attach(name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        FIXED_HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, nchannels, self.capacity, frequency,
+                               self.dtype.str.encode(), data_offset, len(metadata))
+        self.shm.buf[CURSOR_OFFSET + 8:CURSOR_OFFSET + 8 + len(metadata)] = metadata
+        self.cursor = np.ndarray(1, dtype=np.uint64, buffer=self.shm.buf, offset=CURSOR_OFFSET)
+        self.cursor[0] = 0
+        self.data = np.ndarray((2 * self.capacity, nchannels), dtype=self.dtype, buffer=self.shm.buf,
+                               offset=data_offset)
+
+    def write_frames(self, frames):
+        """Append a (samples, nchannels) block"""
+        n = len(frames)
+        if n > self.capacity:
+            frames = frames[-self.capacity:]
+            self.cursor[0] += n - self.capacity
+            n = self.capacity
+        start = int(self.cursor[0]) % self.capacity
+        first = min(n, self.capacity - start)
+        for base in (start, start + self.capacity):
+            self.data[base:base + first] = frames[:first]
+        if first < n:
+            # Wrapped: the rest goes at the start of both copies
+            rest = n - first
+            self.data[:rest] = frames[first:]
+            self.data[self.capacity:self.capacity + rest] = frames[first:]
+        self.cursor[0] += n
+
+    def write(self, block):
+        """Append a (nchannels, samples) block"""
+        self.write_frames(np.asarray(block).T)
+
+    def close(self):
+        del self.cursor, self.data
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedRingReader:
+    """Reader side, any process of the same host"""
+
+    def __init__(self, name):
+        self.shm = attach(name)
+        (magic, version, self.nchannels, self.capacity, self.frequency, dtype, data_offset,
+         metadata_length) = FIXED_HEADER.unpack_from(self.shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{name} is not a shared acquisition ring")
+        self.dtype = np.dtype(dtype.rstrip(b'\0').decode())
+        self.metadata = json.loads(bytes(self.shm.buf[CURSOR_OFFSET + 8:CURSOR_OFFSET + 8 + metadata_length]))
+        self.channels = self.metadata.get('channels')
+        self.cursor = np.ndarray(1, dtype=np.uint64, buffer=self.shm.buf, offset=CURSOR_OFFSET)
+        self.data = np.ndarray((2 * self.capacity, self.nchannels), dtype=self.dtype, buffer=self.shm.buf,
+                               offset=data_offset)
+        self.last_cursor = 0
+
+    def scales(self):
+        """Conversion factor of every channel (1 when the writer gave none)"""
+        if not self.channels:
+            return np.ones(self.nchannels, dtype=np.float32)
+        return np.array([channel.get('scale', 1) for channel in self.channels], dtype=np.float32)
+
+    def samples_written(self):
+        return int(self.cursor[0])
+
+    def wait(self, timeout=None, spin=0.001):
+        """Wait for samples newer than the last read, False on timeout"""
+        start = time.perf_counter()
+        while int(self.cursor[0]) == self.last_cursor:
+            elapsed = time.perf_counter() - start
+            if timeout is not None and elapsed >= timeout:
+                return False
+            # Spin first for the lowest latency, then poll without burning a core
+            time.sleep(0 if elapsed < spin else 0.0002)
+        return True
+
+    def read_latest(self, n, block=False, timeout=None):
+        """(nchannels, n) view of the latest n samples and the cursor after them
+
+        block=True waits for samples newer than the previous read, None is
+        returned on timeout. Fewer than n samples are returned at the start.
+        """
+        if block and not self.wait(timeout):
+            return None, self.last_cursor
+        cursor = int(self.cursor[0])
+        n = min(n, self.capacity, cursor)
+        # The mirrored copy makes the window contiguous whatever the wrap position
+        start = (cursor - n) % self.capacity
+        self.last_cursor = cursor
+        return self.data[start:start + n].T, cursor
+
+    def overwritten(self, cursor, n):
+        """True when samples returned at 'cursor' may have been overwritten since"""
+        return int(self.cursor[0]) - cursor > self.capacity - n
+
+    def close(self):
+        del self.cursor, self.data
+        self.shm.close()
@@ -0,0 +1,183 @@
+# -------------------------------------------------------
+# Socket tuning shared by the device drivers
+#
+# The receive buffer is sized from the data rate of the device
+# (channels x bytes per sample x sampling frequency x slack seconds)
+# and every socket option is applied in one place, so all the
+# viewers behave the same way. The chosen values are kept and can be
+# printed or shown in the status bar through diagnostics().
+#
+import socket
+import sys
+import time
+
+DEFAULT_SLACK_SECONDS = 0.5   # seconds of data the kernel buffer must hold
+MIN_RCVBUF = 64 * 1024        # never go below the usual OS default
+
+# Not every Python build exposes these constants, fall back to the Linux values
+SO_BUSY_POLL = getattr(socket, 'SO_BUSY_POLL', 46 if sys.platform.startswith('linux') else None)
+SO_RCVLOWAT = getattr(socket, 'SO_RCVLOWAT', None)
+
+READ_MODES = ('latency', 'throughput', 'adaptive')
+
+
+def drain(sock, quiet=0.05, limit=1.0):
+    """Read and drop what the peer still sends until it is quiet for 'quiet' seconds
+
+    Used after a stop command, before the stream restarts with another frame
+    layout. Returns the number of bytes dropped.
+    """
+    if SO_RCVLOWAT is not None:
+        # A low-water mark would hold back the last bytes until the timeout
+        sock.setsockopt(socket.SOL_SOCKET, SO_RCVLOWAT, 1)
+    timeout = sock.gettimeout()
+    sock.settimeout(quiet)
+    dropped = 0
+    deadline = time.perf_counter() + limit
+    try:
+        while time.perf_counter() < deadline:
+            try:
+                data = sock.recv(65536)
+            except socket.timeout:
+                break
+            if not data:
+                break
+            dropped += len(data)
+    finally:
+        sock.settimeout(timeout)
+    return dropped
+
+
+def compute_rcvbuf(nchannels, bytes_in_sample, frequency, slack_seconds=DEFAULT_SLACK_SECONDS):
+    """Receive buffer size in bytes able to hold slack_seconds of data"""
+    return max(MIN_RCVBUF, int(nchannels * bytes_in_sample * frequency * slack_seconds))
+
+
+class ReadSizePolicy:
+    """Choose recv sizes (always whole frames) trading latency against syscall count
+
+    A frame is one sample of every channel. The low-water mark tells the
+    kernel how many bytes must be queued before recv wakes us up, the read
+    size is how much we drain in one call:
+      - latency:    wake up on every frame, drain everything available
+      - throughput: wake up only when a full max_block is queued
+      - adaptive:   wake up every min_block, grow the read size while the
+                    kernel has a backlog and shrink it again once we caught up
+    """
+
+    def __init__(self, frame_size, frequency, mode='adaptive', min_block=0.004, max_block=0.0625):
+        if mode not in READ_MODES:
+            raise ValueError(f"Unknown read mode {mode}, expecting one of {READ_MODES}")
+        self.frame_size = frame_size
+        self.mode = mode
+        self.min_frames = max(1, int(frequency * min_block))
+        self.max_frames = max(self.min_frames, int(frequency * max_block))
+
+        if mode == 'latency':
+            self.frames = self.max_frames
+            self.lowat_frames = 1
+        elif mode == 'throughput':
+            self.frames = self.max_frames
+            self.lowat_frames = self.max_frames
+        else:
+            self.frames = self.min_frames
+            self.lowat_frames = self.min_frames
+
+        self.reads = 0
+        self.bytes_read = 0
+
+    @property
+    def read_size(self):
+        return self.frames * self.frame_size
+
+    @property
+    def lowat(self):
+        return self.lowat_frames * self.frame_size
+
+    def next_read_size(self):
+        return self.read_size
+
+    def record(self, nbytes):
+        """Update the statistics and, in adaptive mode, the next read size"""
+        self.reads += 1
+        self.bytes_read += nbytes
+        if self.mode != 'adaptive':
+            return
+        if nbytes >= self.read_size:
+            # The kernel had more than we asked for: use fewer, larger reads
+            self.frames = min(self.max_frames, self.frames * 2)
+        elif nbytes < self.read_size // 4:
+            # We are keeping up: go back to small reads for low latency
+            self.frames = max(self.min_frames, self.frames // 2)
+
+    def average_read(self):
+        return self.bytes_read / self.reads if self.reads else 0
+
+
+class SocketTuning:
+    """Socket options and read-size policy computed from the device data rate"""
+
+    def __init__(self, nchannels, frequency, bytes_in_sample=2, slack_seconds=DEFAULT_SLACK_SECONDS,
+                 nodelay=True, busy_poll_us=0, read_mode='adaptive', min_block=0.004, max_block=0.0625):
+        self.nchannels = nchannels
+        self.frequency = frequency
+        self.bytes_in_sample = bytes_in_sample
+        self.slack_seconds = slack_seconds
+        self.nodelay = nodelay
+        self.busy_poll_us = busy_poll_us
+        self.frame_size = nchannels * bytes_in_sample
+        self.rcvbuf = compute_rcvbuf(nchannels, bytes_in_sample, frequency, slack_seconds)
+        self.read_policy = ReadSizePolicy(self.frame_size, frequency, read_mode, min_block, max_block)
+        self.applied = {}
+
+    def _set(self, sock, name, level, option, value):
+        try:
+            sock.setsockopt(level, option, value)
+            self.applied[name] = sock.getsockopt(level, option)
+        except OSError as e:
+            # Not supported on this platform or not enough privileges
+            self.applied[name] = f"failed ({e})"
+
+    def apply(self, sock):
+        """Apply the options to a socket
+
+        Call it on the listening socket before listen() (or before connect()
+        for client sockets) so the TCP window scale matches the buffer, and
+        again on the accepted connection.
+        """
+        self._set(sock, 'rcvbuf', socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        if self.nodelay and sock.type == socket.SOCK_STREAM:
+            self._set(sock, 'nodelay', socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.busy_poll_us and SO_BUSY_POLL is not None:
+            self._set(sock, 'busy_poll_us', socket.SOL_SOCKET, SO_BUSY_POLL, self.busy_poll_us)
+        if SO_RCVLOWAT is not None:
+            effective = self.applied.get('rcvbuf')
+            lowat = self.read_policy.lowat
+            if isinstance(effective, int):
+                # A low-water mark above the buffer size would block forever
+                lowat = min(lowat, effective // 2)
+            self._set(sock, 'rcvlowat', socket.SOL_SOCKET, SO_RCVLOWAT, max(1, lowat))
+        return sock
+
+    def diagnostics(self):
+        policy = self.read_policy
+        return {
+            'rcvbuf_requested': self.rcvbuf,
+            'rcvbuf_effective': self.applied.get('rcvbuf'),
+            'slack_seconds': self.slack_seconds,
+            'nodelay': self.applied.get('nodelay'),
+            'busy_poll_us': self.applied.get('busy_poll_us'),
+            'rcvlowat': self.applied.get('rcvlowat'),
+            'frame_size': self.frame_size,
+            'read_mode': policy.mode,
+            'read_size': policy.read_size,
+            'read_size_range': (policy.min_frames * self.frame_size, policy.max_frames * self.frame_size),
+            'reads': policy.reads,
+            'average_read': round(policy.average_read()),
+        }
+
+    def describe(self):
+        d = self.diagnostics()
+        return (f"rcvbuf {d['rcvbuf_requested']} B (effective {d['rcvbuf_effective']}), "
+                f"nodelay {d['nodelay']}, busy_poll {d['busy_poll_us']}, rcvlowat {d['rcvlowat']}, "
+                f"read {d['read_mode']} {d['read_size']} B")
@@ -0,0 +1,222 @@
+# -------------------------------------------------------
+# Fan-out relay of a live device stream
+#
+# The viewer that accepted the device connection publishes every block of
+# whole frames to the relay, which serves it to any number of local
+# subscribers over TCP ((host, port) address) or a Unix socket (path).
+#
+# Protocol: the subscriber sends one JSON line with its request
+#   {"channels": [0, 1, 2], "decimation": 4}     (both optional, {} = all)
+# and receives one JSON line describing the stream it gets (device
+# metadata, channels, frequency after decimation, frame_size), then the raw
+# frames in the device byte order.
+#
+# Each subscriber has its own bounded queue and sender thread: publishing
+# never blocks the acquisition loop, and a slow subscriber loses its oldest
+# blocks (counted in 'dropped') instead of slowing down the others.
+#
+import json
+import os
+import socket
+import threading
+from collections import deque
+import numpy as np
+from sample_decoding import samples_from_bytes
+
+
+def open_socket(address):
+    if isinstance(address, str):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+
+class Subscriber:
+    def __init__(self, relay, connection, channels=None, decimation=1, max_blocks=256):
+        self.relay = relay
+        self.connection = connection
+        self.decimation = max(1, int(decimation))
+        self.queue = deque(maxlen=max_blocks)
+        self.ready = threading.Condition()
+        self.running = True
+        self.dropped = 0
+        self.position = 0  # frames seen, keeps the decimation phase across blocks
+
+        nchannels = relay.metadata.get('nchannels')
+        bytes_in_sample = relay.metadata.get('bytes_in_sample', 2)
+        self.channels = list(range(nchannels)) if channels is None else [int(c) for c in channels]
+        if nchannels is not None and any(c < 0 or c >= nchannels for c in self.channels):
+            raise ValueError(f"Channels must be between 0 and {nchannels - 1}")
+        self.columns = None
+        if channels is not None:
+            # Byte columns of the selected channels inside a frame
+            self.columns = (np.array(self.channels)[:, None] * bytes_in_sample + np.arange(bytes_in_sample)).ravel()
+
+    def info(self):
+        info = dict(self.relay.metadata)
+        info['channels'] = self.channels
+        info['decimation'] = self.decimation
+        if 'frequency' in info:
+            info['frequency'] = info['frequency'] / self.decimation
+        if self.columns is not None:
+            info['frame_size'] = len(self.columns)
+        return info
+
+    def put(self, data):
+        with self.ready:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append(data)
+            self.ready.notify()
+
+    def select(self, data):
+        if self.columns is None and self.decimation == 1:
+            return data
+        frames = np.frombuffer(data, dtype=np.uint8).reshape(-1, self.relay.frame_size)
+        if self.decimation > 1:
+            # Every Nth frame of the whole stream, whatever the block boundaries
+            first = -self.position % self.decimation
+            self.position += len(frames)
+            frames = frames[first::self.decimation]
+        if self.columns is not None:
+            frames = frames[:, self.columns]
+        return frames.tobytes()
+
+    def run(self):
+        while self.running:
+            with self.ready:
+                while self.running and not self.queue:
+                    self.ready.wait()
+                if not self.running:
+                    break
+                data = self.queue.popleft()
+            try:
+                self.connection.sendall(self.select(data))
+            except OSError:
+                break
+        self.connection.close()
+        self.relay.remove(self)
+
+    def stop(self):
+        with self.ready:
+            self.running = False
+            self.ready.notify()
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.connection.close()
+
+
+class StreamRelay:
+    """Serve the frames published by the receiver to local subscribers
+
+    metadata describes the stream as for replay.RawRecorder and must contain
+    frame_size, nchannels and bytes_in_sample for channel subsets.
+    """
+
+    def __init__(self, address, max_blocks=256, **metadata):
+        self.address = address
+        self.max_blocks = max_blocks
+        self.metadata = metadata
+        self.frame_size = metadata['frame_size']
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.server = None
+        self.running = False
+
+    def start(self):
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+        self.server = open_socket(self.address)
+        if not isinstance(self.address, str):
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(self.address)
+        self.server.listen()
+        self.running = True
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+        print(f"Relay listening on {self.address}")
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.subscribe, args=(connection,), daemon=True).start()
+
+    def subscribe(self, connection):
+        try:
+            connection.settimeout(5)
+            request = json.loads(connection.makefile('rb').readline() or b'{}')
+            subscriber = self.make_subscriber(connection, request)
+            connection.settimeout(None)
+            connection.sendall(json.dumps(subscriber.info()).encode() + b'\n')
+        except (OSError, ValueError) as e:
+            print(f"Relay subscription refused: {e}")
+            connection.close()
+            return
+        with self.lock:
+            self.subscribers.append(subscriber)
+        print(f"Relay subscriber connected ({len(subscriber.channels)} channels, decimation {subscriber.decimation})")
+        subscriber.run()
+
+    def make_subscriber(self, connection, request):
+        return Subscriber(self, connection, request.get('channels'), request.get('decimation', 1), self.max_blocks)
+
+    def remove(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+                print(f"Relay subscriber disconnected, {subscriber.dropped} blocks dropped")
+
+    def publish(self, data):
+        """Queue a block of whole frames for every subscriber, never blocks"""
+        if not self.subscribers:
+            return
+        data = bytes(data)
+        with self.lock:
+            for subscriber in self.subscribers:
+                subscriber.put(data)
+
+    def describe(self):
+        with self.lock:
+            dropped = sum(subscriber.dropped for subscriber in self.subscribers)
+            return f"relay: {len(self.subscribers)} subscribers, {dropped} blocks dropped"
+
+    def close(self):
+        self.running = False
+        if self.server is not None:
+            self.server.close()
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.stop()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class RelayClient:
+    """Subscriber side: read (channels, samples) blocks from a relay"""
+
+    def __init__(self, address, channels=None, decimation=1):
+        self.socket = open_socket(address)
+        self.socket.connect(address)
+        request = {'decimation': decimation}
+        if channels is not None:
+            request['channels'] = list(channels)
+        self.socket.sendall(json.dumps(request).encode() + b'\n')
+        self.file = self.socket.makefile('rb')
+        self.info = json.loads(self.file.readline())
+        self.frame_size = self.info['frame_size']
+
+    def read(self, samples):
+        """Block until 'samples' samples are received, None when the relay closed"""
+        data = self.file.read(samples * self.frame_size)
+        if len(data) < samples * self.frame_size:
+            return None
+        return samples_from_bytes(data, len(self.info['channels']), self.info.get('bytes_in_sample', 2),
+                                  self.info.get('byte_order', 'big'))
+
+    def close(self):
+        self.file.close()
+        self.socket.close()